@@ -1,34 +1,189 @@
-import jack
-import numpy
+import time
 
-from instruments.keyboard import Keyboard
-from instruments.sampler import Sampler
-from instruments.drummachine import DrumMachine
+from instruments.midi import NOTE_OFF, NOTE_ON, CONTROL_CHANGE
+from stats import PERIOD, TOTAL, EVENTS, ENTITY_FIELDS
+from supervisor import InstrumentProcess
+
+# midi channels, and the route of a channel that plays whichever instrument
+# is selected
+CHANNELS = 16
+FOLLOW = 0xff
 
 class Backend:
-    def __init__(self, client, metronome, entities):
+    def __init__(self, client, metronome, entities, lazy = False, stats = None,
+            processes = False, realtime = False, midi_input = False):
         '''
         entities: list
-        List of constructors to initialise the instruments.
-        '''
-        self.client = client
+        List of constructors to initialise the instruments, or
+        InstrumentSpecs.
 
-        self.entities = []
-        for i in range(0, len(entities)):
-            port = self.client.midi_outports.register("out" + str(i))
-            self.entities.append(entities[i](port, self.client.samplerate))
+        lazy: bool
+        Only build an instrument, and register its port, when entity() is
+        first asked for it.
 
+        stats: CallbackStats
+        Record the timing of every callback into it, or None.
+
+        processes: bool
+        Run every instrument in a child process as a JACK client of its own
+        (see supervisor.py), all started up front. This client then only
+        runs the metronome.
+
+        realtime: bool
+        Start the child processes in realtime-safe mode.
+
+        midi_input: bool
+        Register a MIDI input port. Its note and controller events are
+        decoded in the JACK callback and played by the instrument their
+        channel is routed to (see route_channel), at the offset they
+        arrived at. Only for instruments in this process.
+        '''
+        self.client = client
         self.metronome = metronome
+        self.constructors = entities
+        self.stats = stats
+        self.processes = processes
+        self.realtime = realtime
+
+        # instruments by number, None until built
+        self.entities = [None] * len(entities)
+        # the built instruments, in the order process() runs them
+        self.active = []
+        # the instruments running in child processes
+        self.children = []
+        # where the instruments' output is captured to, or None
+        self.capture = None
+        # instrument number every midi channel plays, or FOLLOW
+        self.midi_in = None
+        self.midi_routes = bytearray([FOLLOW] * CHANNELS)
+        self.selected = 0
+        # input events no built instrument was there to play
+        self.midi_dropped = 0
+        if midi_input:
+            self.midi_in = self.client.midi_inports.register("in")
+        if processes or not lazy:
+            for i in range(0, len(entities)):
+                self.entity(i)
 
         # callbacks
         self.client.set_shutdown_callback(self.shutdown)
-        self.client.set_process_callback(self.process)
+        if stats is None:
+            self.client.set_process_callback(self.process)
+        else:
+            self.client.set_process_callback(self.process_timed)
+            self.client.set_xrun_callback(stats.xrun)
+
+    def entity(self, i):
+        '''
+        The instrument number i, built on first use. Called from the control
+        thread, process() only sees the instrument once it is complete.
+        '''
+        if self.entities[i] is None and self.processes:
+            self.entities[i] = InstrumentProcess(self.constructors[i], i, self.realtime)
+            self.children.append(self.entities[i])
+        elif self.entities[i] is None:
+            port = self.client.midi_outports.register("out" + str(i))
+            entity = self.constructors[i](port, self.client.samplerate, self.metronome)
+            entity.capture = self.capture
+            entity.track = i
+            self.entities[i] = entity
+            self.active.append(entity)
+        return self.entities[i]
+
+    def route_channel(self, channel, i):
+        '''
+        Make a MIDI channel, from 0, play instrument number i, or whichever
+        instrument is selected if i is FOLLOW. Called from the control
+        thread.
+        '''
+        if i != FOLLOW:
+            self.entity(i)
+        self.midi_routes[channel] = i
+
+    def select(self, i):
+        '''
+        Make the channels routed to FOLLOW play instrument number i.
+        '''
+        self.entity(i)
+        self.selected = i
+
+    def capture_to(self, capture):
+        '''
+        Capture everything the instruments in this process play, each on
+        the track of its number. Instruments built later are captured too.
+        '''
+        self.capture = capture
+        for entity in self.active:
+            entity.capture = capture
+
+    def close(self):
+        '''
+        Stop the child processes, if any.
+        '''
+        for child in self.children:
+            child.close()
 
     def shutdown(self):
         self.client.deactivate()
         self.client.close()
 
+    def route_input(self):
+        '''
+        JACK thread: hand every note and controller event on the input port
+        to the instrument its channel plays. The instrument plays it when
+        it flushes the period.
+        '''
+        routes = self.midi_routes
+        entities = self.entities
+        for offset, data in self.midi_in.incoming_midi_events():
+            if len(data) != 3:
+                continue
+            status, data1, data2 = bytes(data)
+            kind = status & 0xf0
+            if kind != NOTE_ON and kind != NOTE_OFF and kind != CONTROL_CHANGE:
+                continue
+            target = routes[status & 0x0f]
+            if target == FOLLOW:
+                target = self.selected
+            entity = entities[target]
+            if entity is None or entity.process is None:
+                self.midi_dropped += 1
+                continue
+            entity.midi_input.push(offset, status, data1, data2)
+
     def process(self, no_frames):
-        self.metronome.process()
-        for entity in self.entities:
+        self.metronome.process(no_frames)
+        if self.midi_in is not None:
+            self.route_input()
+        for entity in self.active:
+            entity.process(no_frames)
+
+    def process_timed(self, no_frames):
+        '''
+        process(), recording how long the whole callback and every entity
+        took and how many events were written into the next sample of the
+        stats ring. Entities run in instrument order here.
+        '''
+        stats = self.stats
+        samples = stats.samples
+        start = (stats.written & stats.mask) * stats.width
+        clock = time.perf_counter_ns
+        began = clock()
+        self.metronome.process(no_frames)
+        if self.midi_in is not None:
+            self.route_input()
+        events = 0
+        entities = self.entities
+        for i in range(0, len(entities)):
+            entity = entities[i]
+            if entity is None or entity.process is None:
+                samples[start + ENTITY_FIELDS + i] = 0
+                continue
+            entity_began = clock()
             entity.process(no_frames)
+            samples[start + ENTITY_FIELDS + i] = clock() - entity_began
+            events += entity.output.count
+        samples[start + PERIOD] = no_frames
+        samples[start + EVENTS] = events
+        samples[start + TOTAL] = clock() - began
+        stats.written += 1
@@ -0,0 +1,165 @@
+'''
+Capture of everything the instruments play into a Standard MIDI File.
+
+Every instrument hands the events of a period to Capture.record() right
+after writing them to its port, on the JACK thread, which only pushes them
+into a preallocated ring with the JACK frame time of each. A writer thread
+drains the ring a few times a second and streams every event to a
+temporary file per track, so memory stays the same however long the set
+goes on. close() writes the .mid file: format 1, a tempo track and one
+track per instrument, with the temporary files copied in chunk by chunk.
+
+Times are kept exact: the file's tempo is the one the capture starts at,
+and frames are converted to ticks at that tempo. A full ring drops
+events rather than making the JACK thread wait, they are counted.
+'''
+import os
+import struct
+import threading
+
+from ringbuffer import RingBuffer
+
+# events the ring holds, several seconds of dense playing
+CAPTURE_CAPACITY = 16384
+# seconds between drains of the ring
+CAPTURE_INTERVAL = 0.05
+# ticks per quarter note
+DIVISION = 960
+# bytes copied at a time when the file is put together
+COPY_CHUNK = 65536
+
+# fields of a captured event
+TRACK = 0
+FRAME = 1
+STATUS = 2
+DATA1 = 3
+DATA2 = 4
+CAPTURE_WIDTH = 5
+
+# jack frame times are unsigned 32 bit and wrap around
+FRAME_TIME_WRAP = 1 << 32
+FRAME_TIME_HALF = 1 << 31
+
+HEADER_CHUNK = struct.Struct(">4sIHHH")
+TRACK_CHUNK = struct.Struct(">4sI")
+END_OF_TRACK = b"\xff\x2f\x00"
+
+def variable_length(value):
+    '''
+    A delta time as a MIDI variable-length quantity.
+    '''
+    encoded = bytearray((value & 0x7f,))
+    value >>= 7
+    while value:
+        encoded.insert(0, 0x80 | (value & 0x7f))
+        value >>= 7
+    return bytes(encoded)
+
+def meta_event(kind, data):
+    return b"\x00\xff" + bytes((kind,)) + variable_length(len(data)) + data
+
+class Capture(threading.Thread):
+    def __init__(self, path, samplerate, bpm, names, capacity = CAPTURE_CAPACITY):
+        '''
+        names: list
+        Name of every track, one per instrument number.
+        '''
+        super().__init__(daemon = True)
+        self.path = path
+        self.samplerate = samplerate
+        self.names = names
+        self.ring = RingBuffer(capacity, CAPTURE_WIDTH)
+        self.tracks = [open(self.track_path(i), "wb") for i in range(0, len(names))]
+        # tick of the last event written to each track
+        self.last_ticks = [0] * len(names)
+        self.written = 0
+        # tempo of the file, in microseconds per quarter
+        self.tempo = round(60000000 / bpm)
+        self.ticks_per_frame = DIVISION * bpm / 60 / samplerate
+        # the start of the first period anything was played in is tick 0,
+        # set by the JACK thread
+        self.origin = None
+        self.last_frame = 0
+        self.stopped = threading.Event()
+
+    def track_path(self, track):
+        return self.path + ".track" + str(track)
+
+    def record(self, track, period_start, output):
+        '''
+        JACK thread: capture the events of one period of an instrument.
+        '''
+        ring = self.ring
+        offsets = output.offsets
+        messages = output.messages
+        if self.origin is None and output.count > 0:
+            self.origin = self.last_frame = period_start
+        for i in range(0, output.count):
+            message = messages[i]
+            ring.push(track, period_start + offsets[i], message[0], message[1], message[2])
+
+    def dropped(self):
+        return self.ring.overflows
+
+    def run(self):
+        while not self.stopped.wait(CAPTURE_INTERVAL):
+            self.drain()
+        self.drain()
+
+    def drain(self):
+        ring = self.ring
+        tracks = self.tracks
+        while not ring.empty():
+            track = ring.peek(TRACK)
+            frame = self.unwrap(ring.peek(FRAME))
+            tick = round((frame - self.origin) * self.ticks_per_frame)
+            # events of one track come in order, so do their ticks
+            delta = tick - self.last_ticks[track]
+            self.last_ticks[track] += delta
+            tracks[track].write(variable_length(delta)
+                    + bytes((ring.peek(STATUS), ring.peek(DATA1), ring.peek(DATA2))))
+            self.written += 1
+            ring.advance()
+
+    def unwrap(self, frame):
+        '''
+        A frame time as a count that carries on past the 32 bit wrap.
+        '''
+        delta = (frame - self.last_frame) % FRAME_TIME_WRAP
+        if delta >= FRAME_TIME_HALF:
+            # a little earlier than the last one, from another track
+            delta -= FRAME_TIME_WRAP
+        self.last_frame += delta
+        return self.last_frame
+
+    def close(self):
+        '''
+        Stop the writer and put the .mid file together.
+        '''
+        self.stopped.set()
+        if self.ident is not None:
+            self.join()
+        else:
+            self.drain()
+        for track in self.tracks:
+            track.write(b"\x00" + END_OF_TRACK)
+            track.close()
+        with open(self.path, "wb") as f:
+            f.write(HEADER_CHUNK.pack(b"MThd", 6, 1, len(self.names) + 1, DIVISION))
+            tempo = (meta_event(0x03, b"palette")
+                    + meta_event(0x51, self.tempo.to_bytes(3, "big"))
+                    + b"\x00" + END_OF_TRACK)
+            f.write(TRACK_CHUNK.pack(b"MTrk", len(tempo)))
+            f.write(tempo)
+            for i in range(0, len(self.names)):
+                name = meta_event(0x03, self.names[i].encode())
+                f.write(TRACK_CHUNK.pack(b"MTrk",
+                    len(name) + os.path.getsize(self.track_path(i))))
+                f.write(name)
+                with open(self.track_path(i), "rb") as track:
+                    while True:
+                        chunk = track.read(COPY_CHUNK)
+                        if not chunk:
+                            break
+                        f.write(chunk)
+                os.unlink(self.track_path(i))
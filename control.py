@@ -0,0 +1,126 @@
+import asyncio
+import os
+import time
+from array import array
+
+# how many recent samples the latency statistics are taken over
+LATENCY_SAMPLES = 1024
+
+class LatencyStats:
+    '''
+    The last LATENCY_SAMPLES durations, in nanoseconds, kept in a
+    preallocated ring.
+    '''
+    def __init__(self, size = LATENCY_SAMPLES):
+        self.samples = array("q", bytes(8 * size))
+        self.size = size
+        self.count = 0
+
+    def record(self, duration):
+        self.samples[self.count % self.size] = duration
+        self.count += 1
+
+    def percentiles(self, *fractions):
+        '''
+        Returns one value per fraction, or None if nothing was recorded.
+        '''
+        if self.count == 0:
+            return None
+        recent = sorted(self.samples[0:min(self.count, self.size)])
+        return [recent[min(len(recent) - 1, int(len(recent) * fraction))]
+                for fraction in fractions]
+
+class ControlLoop:
+    '''
+    The control thread of palette: an asyncio loop that waits on every input
+    source at once and runs the periodic housekeeping. Nothing scheduled
+    here ever runs on the JACK thread, it only hands events over to the
+    instruments' queues.
+    '''
+    def __init__(self):
+        self.loop = asyncio.new_event_loop()
+        # time spent in the handler for every event
+        self.handler_latency = LatencyStats()
+        # time from the driver stamping an event to the handler finishing
+        self.input_latency = LatencyStats()
+        self.sources = []
+        self.tasks = []
+        self.servers = []
+
+    def add_source(self, source, handler, poll = None):
+        '''
+        source: object
+        Anything with fileno() and drain(handler), like KeyReader.
+
+        handler: function
+        Called as handler(key, pressed, stamp, device) for every event.
+
+        poll: float
+        Also drain the source every poll seconds, for sources whose wakeups
+        can go missing.
+        '''
+        def timed(key, pressed, stamp, device):
+            started = time.monotonic_ns()
+            handler(key, pressed, stamp, device)
+            finished = time.monotonic_ns()
+            self.handler_latency.record(finished - started)
+            self.input_latency.record(finished - stamp)
+
+        def readable():
+            if not source.drain(timed):
+                # a blocking source whose writer went away
+                self.loop.remove_reader(source.fileno())
+                self.sources.remove(source)
+
+        self.loop.add_reader(source.fileno(), readable)
+        self.sources.append(source)
+        if poll is not None:
+            def sweep():
+                if source in self.sources:
+                    readable()
+            self.every(poll, sweep)
+
+    def remove_source(self, source):
+        if source in self.sources:
+            self.loop.remove_reader(source.fileno())
+            self.sources.remove(source)
+
+    def every(self, interval, callback):
+        '''
+        Call callback every interval seconds from the control thread.
+        '''
+        async def repeat():
+            while True:
+                await asyncio.sleep(interval)
+                callback()
+
+        self.tasks.append(self.loop.create_task(repeat()))
+
+    def serve(self, path, report):
+        '''
+        Answer every connection to a Unix socket at path with the text
+        report() returns, then hang up.
+        '''
+        async def answer(reader, writer):
+            writer.write(report().encode())
+            await writer.drain()
+            writer.close()
+
+        if os.path.exists(path):
+            # left behind by an earlier run
+            os.unlink(path)
+        server = self.loop.run_until_complete(asyncio.start_unix_server(answer, path))
+        self.servers.append((server, path))
+
+    def run(self):
+        self.loop.run_forever()
+        for server, path in self.servers:
+            server.close()
+            os.unlink(path)
+        for task in self.tasks:
+            task.cancel()
+        self.loop.run_until_complete(asyncio.gather(*self.tasks, return_exceptions = True))
+        self.loop.close()
+
+    def stop(self):
+        self.loop.stop()
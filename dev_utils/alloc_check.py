@@ -0,0 +1,153 @@
+'''
+Allocation regression check of the JACK callback, for the realtime-safe
+mode.
+
+Runs the metronome and every instrument against the mock JACK client with
+the transport rolling, keys played on every instrument and a loop recorded
+and played back, and measures each of them separately with tracemalloc.
+The drum machine's lookahead is stepped between callbacks instead of on its
+own thread, so that only the JACK side is measured. Fails if, once warmed
+up,
+
+    any of them allocates more than --budget bytes while it runs,
+    any of them leaves a container behind for the garbage collector, or
+    memory allocated by palette's code grows over the run, which is
+    reported by the line that allocated it.
+
+A callback can't help creating the odd int and loop iterator, all freed
+before it returns, the budget allows for those but not for building a
+dict or a list of events every period.
+
+    python3 dev_utils/alloc_check.py --cycles 2000
+
+python -m unittest runs it through test_alloc.py.
+'''
+import argparse
+import gc
+import os
+import sys
+import tracemalloc
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(HERE)
+sys.path.insert(0, HERE)
+
+from backend_bench import build, PLAYING_KEYS
+
+# transient bytes a callback may allocate
+TRANSIENT_BUDGET = 384
+# cycles run before measuring, for caches to fill
+WARMUP_CYCLES = 500
+# cycles between key presses
+KEY_EVERY = 7
+# looper keys of the keyboard: record, then play back, slot 0
+RECORD_LOOP_AT = 100
+CLOSE_LOOP_AT = 1100
+
+def measure(function, no_frames):
+    '''
+    Bytes allocated at the peak of one call, and the containers it left
+    for the garbage collector.
+    '''
+    count = gc.get_count()[0]
+    before = tracemalloc.get_traced_memory()[0]
+    tracemalloc.reset_peak()
+    function(no_frames)
+    peak = tracemalloc.get_traced_memory()[1]
+    return peak - before, gc.get_count()[0] - count
+
+def palette_code(statistic):
+    '''
+    True for memory allocated by palette itself rather than the mock or
+    this script.
+    '''
+    filename = statistic.traceback[0].filename
+    return (filename.startswith(ROOT) and not filename.startswith(HERE)
+            and "tracemalloc" not in filename)
+
+def play_keys(client, backend, cycle):
+    '''
+    Control thread work between callbacks: a key on every instrument and
+    the loop commands.
+    '''
+    if cycle % KEY_EVERY == 0:
+        for i in range(0, len(backend.active)):
+            keys = PLAYING_KEYS[i]
+            key = keys[(cycle // KEY_EVERY) % len(keys)]
+            backend.active[i].key_pressed(key, client.frame_time)
+            backend.active[i].key_released(key, client.frame_time)
+    if cycle == RECORD_LOOP_AT or cycle == CLOSE_LOOP_AT:
+        backend.active[0].record_loop(0)
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(description = "Check that the JACK callback does not allocate.")
+    parser.add_argument("--period", type = int, default = 256)
+    parser.add_argument("--samplerate", type = int, default = 48000)
+    parser.add_argument("--cycles", type = int, default = 2000,
+            help = "cycles measured after the warmup")
+    parser.add_argument("--budget", type = int, default = TRANSIENT_BUDGET,
+            help = "transient bytes a callback may allocate")
+    args = parser.parse_args(argv)
+
+    client, metronome, backend = build(args.period, args.samplerate)
+    lookaheads = []
+    for entity in backend.active:
+        if hasattr(entity, "lookahead"):
+            entity.lookahead.stop()
+            entity.lookahead.join()
+            lookaheads.append(entity.lookahead)
+
+    names = ["Metronome"] + [type(entity).__name__ for entity in backend.active]
+    stages = [metronome.process] + [entity.process for entity in backend.active]
+    transient = [0] * len(stages)
+    containers = [0] * len(stages)
+
+    gc.disable()
+    tracemalloc.start()
+    # what measuring costs by itself
+    overhead = max(measure(lambda no_frames: None, args.period)[0] for i in range(0, 100))
+    start = None
+    for cycle in range(0, WARMUP_CYCLES + args.cycles):
+        if cycle == WARMUP_CYCLES:
+            start = tracemalloc.take_snapshot()
+        play_keys(client, backend, cycle)
+        for lookahead in lookaheads:
+            lookahead.step()
+        client.begin_cycle(args.period)
+        for i in range(0, len(stages)):
+            peak, left = measure(stages[i], args.period)
+            if cycle >= WARMUP_CYCLES:
+                transient[i] = max(transient[i], peak - overhead)
+                containers[i] += left
+        client.end_cycle(args.period)
+    end = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+    gc.enable()
+
+    failures = []
+    print("{0:<12} {1:>10} {2:>11}".format("", "transient", "containers"))
+    for i in range(0, len(stages)):
+        print("{0:<12} {1:>10} {2:>11}".format(names[i], transient[i], containers[i]))
+        if transient[i] > args.budget:
+            failures.append("{0} allocates {1} bytes per callback".format(names[i], transient[i]))
+        if containers[i] > 0:
+            failures.append("{0} left {1} containers over {2} callbacks".format(names[i],
+                containers[i], args.cycles))
+    for statistic in end.compare_to(start, "lineno"):
+        if statistic.size_diff > 0 and statistic.count_diff > 0 and palette_code(statistic):
+            failures.append("{0}:{1} kept {2} bytes over {3} callbacks".format(
+                statistic.traceback[0].filename, statistic.traceback[0].lineno,
+                statistic.size_diff, args.cycles))
+    loop = backend.active[0].looper.loops[0]
+    if not loop.playing or loop.count == 0:
+        failures.append("the loop was not recorded, its path went unmeasured")
+
+    for failure in failures:
+        print("FAIL " + failure)
+    if failures:
+        return 1
+    print("ok")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,231 @@
+'''
+Headless benchmark of Backend.process.
+
+Runs the backend with all four instruments against the mock JACK client,
+with the transport rolling, the drum machine and push loaded with patterns
+and a thread feeding key events at a fixed rate, and reports how long each
+process callback takes against the period deadline and how many of the
+drum machine's periods with steps came rendered from its lookahead. It then
+compares the ways of writing a period's events to a port: tuples converted
+by the port, as instruments used to write them, cached bytes through
+write_midi_event and cached bytes through reserve_midi_event.
+
+    python3 dev_utils/backend_bench.py --period 64 --rate 2000 --seconds 5
+'''
+import argparse
+import os
+import random
+import sys
+import threading
+import time
+import tracemalloc
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, HERE)
+sys.path.insert(0, os.path.join(HERE, ".."))
+
+import mock_jack
+mock_jack.install()
+
+from null_interface import NullInterface
+from backend import Backend
+from metronome import Metronome
+from render import RenderThread
+from instruments import keyboard, sampler, push
+from instruments.output import OutputBuffer
+from instruments.keyboard import Keyboard
+from instruments.sampler import Sampler
+from instruments.drummachine import DrumMachine
+from instruments.push import Push
+
+CONSTRUCTORS = [Keyboard, Sampler, DrumMachine, Push]
+# keys that make each instrument play something
+PLAYING_KEYS = [
+        keyboard.layout.keys("note"),
+        sampler.layout.keys("channel"),
+        [4, 22, 7, 9, 10, 11, 27, 6],
+        push.layout.keys("sample")
+        ]
+
+def build(period, samplerate):
+    client = mock_jack.Client("palette", samplerate = samplerate, blocksize = period)
+    metronome = Metronome(client)
+    backend = Backend(client, metronome, CONSTRUCTORS)
+    client.activate()
+    metronome.sync_transport()
+    client.transport_start()
+
+    # give the pattern instruments something to play: a full bar of closed
+    # hihats, bass drum on every quarter and two push samples
+    drums = backend.entities[2]
+    drums.key_pressed(30, 0)
+    drums.key_pressed(11, 0)
+    drums.key_released(30, 0)
+    drums.key_pressed(32, 0)
+    drums.key_pressed(27, 0)
+    drums.key_released(32, 0)
+    push = backend.entities[3]
+    push.key_pressed(30, 0)
+    push.key_pressed(33, 0)
+    return client, metronome, backend
+
+class KeyFeeder(threading.Thread):
+    '''
+    Presses and releases keys on every instrument at a fixed rate, like
+    Main does for the selected instrument.
+    '''
+    def __init__(self, client, backend, rate):
+        super().__init__(daemon = True)
+        self.client = client
+        self.backend = backend
+        self.interval = 1.0 / rate if rate > 0 else None
+        self.stopped = threading.Event()
+        self.sent = 0
+
+    def run(self):
+        if self.interval is None:
+            return
+        random.seed(1)
+        held = []
+        while not self.stopped.is_set():
+            index = random.randrange(len(self.backend.entities))
+            entity = self.backend.entities[index]
+            key = random.choice(PLAYING_KEYS[index])
+            if index != 2 and index != 3:
+                # the pattern instruments are left alone, their keys edit the pattern
+                entity.key_pressed(key, self.client.frame_time)
+                held.append((entity, key))
+            if len(held) > 4:
+                entity, key = held.pop(0)
+                entity.key_released(key, self.client.frame_time)
+            self.sent += 1
+            time.sleep(self.interval)
+
+    def stop(self):
+        self.stopped.set()
+        self.join()
+
+def percentile(values, fraction):
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+def run_timed(client, backend, period, cycles, paced):
+    durations = [0] * cycles
+    written = 0
+    deadline = period / client.samplerate
+    next_cycle = time.perf_counter()
+    for i in range(0, cycles):
+        client.begin_cycle(period)
+        started = time.perf_counter_ns()
+        backend.process(period)
+        durations[i] = time.perf_counter_ns() - started
+        for port in client.midi_outports:
+            written += port.count
+        client.end_cycle(period)
+        if paced:
+            next_cycle += deadline
+            remaining = next_cycle - time.perf_counter()
+            if remaining > 0:
+                time.sleep(remaining)
+    durations.sort()
+    return durations, written
+
+def run_allocations(client, backend, period, cycles):
+    '''
+    Peak bytes allocated inside one callback and bytes left behind by it.
+    '''
+    tracemalloc.start()
+    peaks = 0
+    retained = 0
+    for i in range(0, cycles):
+        client.begin_cycle(period)
+        tracemalloc.reset_peak()
+        before = tracemalloc.get_traced_memory()[0]
+        backend.process(period)
+        current, peak = tracemalloc.get_traced_memory()
+        retained += current - before
+        peaks += peak - before
+        client.end_cycle(period)
+    tracemalloc.stop()
+    return peaks / cycles, retained / cycles
+
+def write_tuples(output, port):
+    '''
+    The old write path: a fresh tuple per event.
+    '''
+    for i in range(0, output.count):
+        message = output.messages[i]
+        port.write_midi_event(output.offsets[i], (message[0], message[1], message[2]))
+
+def run_write_paths(period, events, repeats):
+    '''
+    Nanoseconds per event written, for every write path.
+    '''
+    port = mock_jack.MidiPort("bench", buffer_size = 3 * events)
+    output = OutputBuffer(events)
+    for i in range(0, events):
+        output.insert(i * period // events, 144 + i % 16, 36 + i % 48, 63)
+    # the same events, written through reserve_midi_event; the mock
+    # allocates a buffer per reserved event, jack-client does not
+    reserving = OutputBuffer(events, reserve = True)
+    reserving.offsets = output.offsets
+    reserving.messages = output.messages
+    reserving.count = output.count
+    paths = [
+            ("tuples", lambda: write_tuples(output, port)),
+            ("bytes", lambda: output.write_to(port)),
+            ("reserve", lambda: reserving.write_to(port))
+            ]
+    results = []
+    for name, write in paths:
+        started = time.perf_counter_ns()
+        for i in range(0, repeats):
+            port.clear_buffer()
+            write()
+        results.append((name, (time.perf_counter_ns() - started) / (repeats * events)))
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description = "Benchmark Backend.process headless.")
+    parser.add_argument("--period", type = int, nargs = "+", default = [64, 256, 1024],
+            help = "period sizes in frames")
+    parser.add_argument("--samplerate", type = int, default = 48000)
+    parser.add_argument("--rate", type = int, default = 1000,
+            help = "key events per second")
+    parser.add_argument("--seconds", type = float, default = 3.0,
+            help = "simulated seconds per period size")
+    parser.add_argument("--free-run", action = "store_true",
+            help = "run the callbacks back to back instead of at the period rate")
+    args = parser.parse_args()
+
+    for period in args.period:
+        client, metronome, backend = build(period, args.samplerate)
+        cycles = int(args.seconds * args.samplerate / period)
+        renderer = RenderThread(NullInterface([]), metronome.snapshot)
+        renderer.start()
+        feeder = KeyFeeder(client, backend, args.rate)
+        feeder.start()
+        durations, written = run_timed(client, backend, period, cycles, not args.free_run)
+        lookahead = backend.entities[2].lookahead
+        hits, misses = lookahead.hits, lookahead.misses
+        feeder.stop()
+        renderer.stop()
+        peak, retained = run_allocations(client, backend, period, min(cycles, 2000))
+
+        deadline = period * 1000000 / args.samplerate
+        p50 = percentile(durations, 0.5) / 1000
+        p99 = percentile(durations, 0.99) / 1000
+        worst = durations[-1] / 1000
+        print("period {0:5d} ({1:.0f}us), {2} cycles, {3} keys, {4} midi events".format(
+            period, deadline, cycles, feeder.sent, written))
+        print("    latency p50 {0:.1f}us p99 {1:.1f}us max {2:.1f}us".format(p50, p99, worst))
+        print("    headroom at p99 {0:.1f}%, at max {1:.1f}%".format(
+            100 * (1 - p99 / deadline), 100 * (1 - worst / deadline)))
+        print("    drum machine periods with steps played from the lookahead: {0} of {1}".format(
+            hits, hits + misses))
+        print("    allocations per cycle: {0:.0f} bytes peak, {1:.1f} bytes retained".format(
+            peak, retained))
+        print("    writing 64 events: " + ", ".join("{0} {1:.0f}ns".format(name, ns)
+            for name, ns in run_write_paths(period, 64, 2000)) + " per event")
+
+if __name__ == "__main__":
+    main()
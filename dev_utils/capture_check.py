@@ -0,0 +1,226 @@
+'''
+End to end check of the MIDI file capture against the mock JACK client.
+
+Replays a key log through all four instruments with the transport rolling
+and a capture running, reads back what every instrument wrote to its port
+along with the frame time of each period, then parses the .mid file and
+compares it track by track: the same events in the same order, each at the
+tick its frame time comes to, give or take one for rounding. The clock
+starts just short of the 32 bit wrap so that the wrap is crossed too.
+
+The key log is one key per line, "cycle instrument key pressed", a fixed
+one is played if none is given. With --cycles in the hundreds of
+thousands it also shows that memory stays flat however long the capture
+runs.
+
+    python3 dev_utils/capture_check.py --cycles 5000
+
+python -m unittest runs it through test_capture.py.
+'''
+import argparse
+import os
+import struct
+import sys
+import tempfile
+import tracemalloc
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, HERE)
+
+from backend_bench import build, PLAYING_KEYS
+import capture as capture_module
+import ringbuffer
+from capture import Capture, DIVISION
+
+# cycles between keys of the fixed log
+KEY_EVERY = 5
+# frames before the jack clock wraps when the check starts
+WRAP_AHEAD = 100000
+# cycles between memory samples
+SAMPLE_EVERY = 1000
+
+def fixed_log(cycles, instruments):
+    '''
+    A key pressed on every instrument in turn, released two cycles later.
+    '''
+    log = []
+    for cycle in range(0, cycles, KEY_EVERY):
+        instrument = (cycle // KEY_EVERY) % instruments
+        keys = PLAYING_KEYS[instrument]
+        key = keys[(cycle // KEY_EVERY // instruments) % len(keys)]
+        log.append((cycle, instrument, key, True))
+        log.append((cycle + 2, instrument, key, False))
+    return sorted(log, key = lambda entry: entry[0])
+
+def read_log(path):
+    log = []
+    with open(path) as f:
+        for line in f:
+            if line.strip() and not line.startswith("#"):
+                cycle, instrument, key, pressed = line.split()
+                log.append((int(cycle), int(instrument), int(key), pressed == "1"))
+    return sorted(log, key = lambda entry: entry[0])
+
+def variable_length(data, position):
+    value = 0
+    while True:
+        byte = data[position]
+        position += 1
+        value = value << 7 | (byte & 0x7f)
+        if byte < 0x80:
+            return value, position
+
+def parse_smf(path):
+    '''
+    Division and, for every track, its name and its events as (tick,
+    bytes). Only what Capture writes: meta events and three byte channel
+    messages with their status.
+    '''
+    with open(path, "rb") as f:
+        data = f.read()
+    magic, size, form, count, division = struct.unpack_from(">4sIHHH", data)
+    if magic != b"MThd" or size != 6 or form != 1:
+        raise ValueError("not a format 1 MIDI file")
+    position = 8 + size
+    tracks = []
+    for i in range(0, count):
+        magic, size = struct.unpack_from(">4sI", data, position)
+        if magic != b"MTrk":
+            raise ValueError("track {0} is not an MTrk chunk".format(i))
+        position += 8
+        end = position + size
+        tick = 0
+        name = None
+        events = []
+        ended = False
+        while position < end:
+            delta, position = variable_length(data, position)
+            tick += delta
+            if data[position] == 0xff:
+                kind = data[position + 1]
+                length, position = variable_length(data, position + 2)
+                if kind == 0x03:
+                    name = data[position:position + length].decode()
+                elif kind == 0x2f:
+                    ended = True
+                position += length
+            else:
+                events.append((tick, bytes(data[position:position + 3])))
+                position += 3
+        if position != end or not ended:
+            raise ValueError("track {0} is not terminated where its length says".format(i))
+        tracks.append((name, events))
+    return division, tracks
+
+def compare(expected, events, name):
+    failures = []
+    if len(events) != len(expected):
+        failures.append("{0}: {1} events captured, {2} played".format(name,
+            len(events), len(expected)))
+    for i in range(0, min(len(events), len(expected))):
+        (tick, data), (played_tick, played) = events[i], expected[i]
+        if data != played or abs(tick - played_tick) > 1:
+            failures.append("{0}: event {1} is {2} at tick {3}, {4} at tick {5} was played".format(
+                name, i, data.hex(), tick, played.hex(), played_tick))
+            break
+    return failures
+
+def capture_memory():
+    '''
+    Bytes held by memory the capture allocated.
+    '''
+    snapshot = tracemalloc.take_snapshot().filter_traces([
+        tracemalloc.Filter(True, capture_module.__file__),
+        tracemalloc.Filter(True, ringbuffer.__file__)])
+    return sum(statistic.size for statistic in snapshot.statistics("filename"))
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(description = "Check the MIDI file capture.")
+    parser.add_argument("--period", type = int, default = 256)
+    parser.add_argument("--samplerate", type = int, default = 48000)
+    parser.add_argument("--cycles", type = int, default = 5000)
+    parser.add_argument("--keys", metavar = "FILE",
+            help = "key log to replay, one \"cycle instrument key pressed\" per line")
+    parser.add_argument("--keep", metavar = "FILE",
+            help = "write the capture to FILE and keep it")
+    args = parser.parse_args(argv)
+
+    client, metronome, backend = build(args.period, args.samplerate)
+    client.last_frame_time = (1 << 32) - WRAP_AHEAD
+    log = read_log(args.keys) if args.keys is not None else fixed_log(args.cycles,
+            len(backend.active))
+    path = args.keep
+    if path is None:
+        path = os.path.join(tempfile.mkdtemp(), "capture.mid")
+    names = [type(entity).__name__ for entity in backend.active]
+    capture = Capture(path, args.samplerate, metronome.bpm, names)
+    backend.capture_to(capture)
+    capture.start()
+
+    tracemalloc.start()
+    memory = []
+    # what every track played, as (unwrapped frame, bytes), and the start
+    # of the first period anything was played in
+    played = [[] for entity in backend.active]
+    unwrapped = 0
+    origin = None
+    next_key = 0
+    for cycle in range(0, args.cycles):
+        while next_key < len(log) and log[next_key][0] <= cycle:
+            at, instrument, key, pressed = log[next_key]
+            if pressed:
+                backend.active[instrument].key_pressed(key, client.frame_time)
+            else:
+                backend.active[instrument].key_released(key, client.frame_time)
+            next_key += 1
+        client.cycle(args.period)
+        for entity in backend.active:
+            for offset, data in entity.midi_port.events:
+                if origin is None:
+                    origin = unwrapped
+                played[entity.track].append((unwrapped + offset, data))
+        unwrapped += args.period
+        if cycle % SAMPLE_EVERY == 0:
+            memory.append(capture_memory())
+    capture.close()
+    tracemalloc.stop()
+    for entity in backend.active:
+        if hasattr(entity, "lookahead"):
+            entity.lookahead.stop()
+
+    failures = []
+    if capture.dropped() > 0:
+        failures.append("the capture dropped {0} events".format(capture.dropped()))
+    division, tracks = parse_smf(path)
+    if division != DIVISION or len(tracks) != len(names) + 1:
+        failures.append("{0} tracks at {1} ticks per quarter".format(len(tracks), division))
+    else:
+        ticks_per_frame = DIVISION * metronome.bpm / 60 / args.samplerate
+        for i in range(0, len(names)):
+            name, events = tracks[i + 1]
+            if name != names[i]:
+                failures.append("track {0} is named {1}, not {2}".format(i + 1, name, names[i]))
+            expected = [(round((frame - origin) * ticks_per_frame), data)
+                    for frame, data in played[i]]
+            failures.extend(compare(expected, events, names[i]))
+    leftovers = [name for name in os.listdir(os.path.dirname(path))
+            if name.startswith(os.path.basename(path) + ".track")]
+    if leftovers:
+        failures.append("temporary files left behind: " + " ".join(leftovers))
+
+    print("{0} events in {1} bytes over {2:.1f} seconds".format(capture.written,
+        os.path.getsize(path), args.cycles * args.period / args.samplerate))
+    if len(memory) > 2:
+        print("capture holds {0} bytes after the first sample, {1} at the end".format(
+            memory[1], memory[-1]))
+    for failure in failures:
+        print("FAIL " + failure)
+    if args.keep is None:
+        os.unlink(path)
+    if failures:
+        return 1
+    print("ok")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,110 @@
+'''
+Benchmark of the control path: key records written to palette.pipe and read
+by KeyReader, or written to a shared memory ring and read by RingReader,
+dispatched by Main and queued in the selected instrument.
+
+    python3 dev_utils/dispatch_bench.py [keystrokes] [records per write] [pipe|ring]
+'''
+import os
+import select
+import sys
+import tempfile
+import threading
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, HERE)
+sys.path.insert(0, os.path.join(HERE, ".."))
+
+import mock_jack
+mock_jack.install()
+
+import palette
+import protocol
+import shmring
+from null_interface import NullInterface
+
+palette.Interface = NullInterface
+
+def write_keys(path, count, batch):
+    keys = palette.pad
+    fifo = os.open(path, os.O_WRONLY)
+    stamp = time.monotonic_ns()
+    changes = []
+    for i in range(0, count):
+        # press and release each key in turn
+        changes.append((keys[(i // 2) % len(keys)], i % 2 == 0))
+        if len(changes) == batch:
+            os.write(fifo, protocol.encode_binary(changes, stamp))
+            changes = []
+    if len(changes) > 0:
+        os.write(fifo, protocol.encode_binary(changes, stamp))
+    os.close(fifo)
+
+def write_ring(name, count, batch):
+    keys = palette.pad
+    ring = shmring.RingWriter(name)
+    stamp = time.monotonic_ns()
+    changes = []
+    for i in range(0, count):
+        changes.append((keys[(i // 2) % len(keys)], i % 2 == 0))
+        if len(changes) == batch or i == count - 1:
+            # unlike the driver, wait for room instead of dropping
+            while ring.space() < len(changes):
+                time.sleep(0.0001)
+            ring.write(changes, stamp)
+            changes = []
+    ring.close()
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 200000
+    batch = int(sys.argv[2]) if len(sys.argv) > 2 else 6
+    transport = sys.argv[3] if len(sys.argv) > 3 else "pipe"
+    directory = tempfile.mkdtemp()
+    os.chdir(directory)
+    if transport == "ring":
+        name = "bench-" + str(os.getpid())
+        main = palette.Main(None, [name])
+        reader = main.rings[0]
+        writer = threading.Thread(target = write_ring, args = (name, count, batch))
+    else:
+        os.mkfifo("palette.pipe")
+        writer = threading.Thread(target = write_keys, args = ("palette.pipe", count, batch))
+    writer.start()
+
+    if transport != "ring":
+        main = palette.Main()
+        reader = main.readers[0]
+    received = [0]
+
+    def handler(key, pressed, stamp, device):
+        received[0] += 1
+        main.key_event(key, pressed, stamp, device)
+
+    elapsed = 0
+    while received[0] < count:
+        select.select([reader], [], [], shmring.RING_POLL)
+        started = time.perf_counter_ns()
+        reader.drain(handler)
+        elapsed += time.perf_counter_ns() - started
+        # let the backend empty the instrument queues, outside the timing
+        main.client.cycle()
+    writer.join()
+    main.renderer.stop()
+    reader.close()
+    if transport == "ring":
+        os.unlink(shmring.ring_path(name))
+        os.unlink(shmring.bell_path(name))
+    else:
+        os.unlink("palette.pipe")
+    os.rmdir(directory)
+
+    print("{0} keystrokes in {1:.1f}ms: {2:.0f} keystrokes/s, {3:.2f}us each".format(
+        received[0], elapsed / 1e6, received[0] / (elapsed / 1e9), elapsed / 1000 / received[0]))
+    dropped = sum(entity.overflows() for entity in main.be.active)
+    # a full read holds more records than an instrument queue, so at this
+    # rate the queues overflow between two backend cycles
+    print("instrument queue overflows: " + str(dropped))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,84 @@
+'''
+Replays keyboard HID reports through hidreport.ReportDecoder and reports
+how many reports and key changes it gets through per second.
+
+Reports come from a file saved with palette-driver.py --record, or are made
+up: random chords rolling over up to six keys in boot reports, or any
+number of keys in NKRO reports.
+
+    python3 dev_utils/hid_replay_bench.py --reports 2000000
+    python3 dev_utils/hid_replay_bench.py --file session.hid
+'''
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from hidreport import ReportDecoder, BOOT_REPORT_SIZE
+
+NKRO_REPORT_SIZE = 33
+# the keys palette has mappings for
+KEYS = list(range(4, 40)) + list(range(44, 57)) + list(range(58, 70)) + list(range(84, 98))
+
+def load(path):
+    reports = []
+    with open(path, "rb") as f:
+        data = f.read()
+    offset = 0
+    while offset < len(data):
+        length = data[offset]
+        reports.append(data[offset + 1:offset + 1 + length])
+        offset += 1 + length
+    return reports
+
+def synthesize(count, nkro, max_keys):
+    random.seed(1)
+    reports = []
+    held = []
+    for i in range(0, count):
+        if len(held) < max_keys and (not held or random.random() < 0.5):
+            key = random.choice(KEYS)
+            if key not in held:
+                held.append(key)
+        else:
+            held.pop(random.randrange(len(held)))
+        if nkro:
+            bitmap = 0
+            for key in held:
+                bitmap |= 1 << key
+            reports.append(bytes(1) + bitmap.to_bytes(NKRO_REPORT_SIZE - 1, "little"))
+        else:
+            reports.append(bytes(2) + bytes(held) + bytes(BOOT_REPORT_SIZE - 2 - len(held)))
+    return reports
+
+def main():
+    parser = argparse.ArgumentParser(description = "Benchmark HID report decoding.")
+    parser.add_argument("--file", help = "reports saved by palette-driver.py --record")
+    parser.add_argument("--reports", type = int, default = 1000000,
+            help = "how many reports to make up")
+    parser.add_argument("--nkro", action = "store_true",
+            help = "make up NKRO bitmap reports instead of boot reports")
+    parser.add_argument("--keys", type = int, default = 6,
+            help = "most keys held at once in made up reports")
+    args = parser.parse_args()
+
+    if args.file:
+        reports = load(args.file)
+    else:
+        reports = synthesize(args.reports, args.nkro, args.keys if args.nkro else min(args.keys, 6))
+
+    decoder = ReportDecoder()
+    changes = 0
+    started = time.perf_counter()
+    for report in reports:
+        changes += len(decoder.changes(report))
+    elapsed = time.perf_counter() - started
+    print("{0} reports, {1} key changes in {2:.2f}s".format(len(reports), changes, elapsed))
+    print("    {0:.0f} reports/s, {1:.2f}us per report".format(
+        len(reports) / elapsed, elapsed * 1000000 / len(reports)))
+
+if __name__ == "__main__":
+    main()
@@ -1,3 +1,13 @@
-fifo = open("palette.pipe", mode = "rt")
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from protocol import KeyReader
+
+def show(key, pressed, stamp, device):
+    print(("+" if pressed else "-") + str(key) + " " + str(stamp) + " device " + str(device))
+
+reader = KeyReader("palette.pipe")
 while True:
-    print(fifo.readline())
+    if not reader.drain(show):
+        reader.reopen()
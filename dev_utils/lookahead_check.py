@@ -0,0 +1,99 @@
+'''
+Check of the drum machine's lookahead against the mock JACK client.
+
+Plays the same pattern, with steps edited along the way, twice: once from
+the lookahead, stepped between callbacks, and once with the drum machine
+rendering every period itself. Does it with palette as timebase master and
+with another client as master, whose bar/beat/tick the metronome rebuilds
+its timeline from. Exits non-zero unless both play exactly the same events
+and most periods with steps come from the lookahead.
+
+    python3 dev_utils/lookahead_check.py
+'''
+import os
+import sys
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, HERE)
+sys.path.insert(0, os.path.join(HERE, ".."))
+
+import mock_jack
+mock_jack.install()
+
+from backend import Backend
+from metronome import Metronome
+from instruments.drummachine import DrumMachine
+
+PERIOD = 256
+CYCLES = 3000
+# cycles between edits of the pattern
+EDIT_EVERY = 97
+# share of the periods with steps that must come from the lookahead
+MIN_HIT_RATE = 0.9
+
+def play(follow, lookahead):
+    '''
+    Every event the drum machine wrote, as (cycle, offset, bytes), and its
+    lookahead.
+    '''
+    client = mock_jack.Client("palette", blocksize = PERIOD)
+    metronome = Metronome(client)
+    backend = Backend(client, metronome, [DrumMachine])
+    if follow:
+        # another client is timebase master with a timeline of its own
+        master = Metronome(client)
+        master.master = True
+        client.set_timebase_callback(master.timemaster)
+
+        def process(no_frames):
+            master.process(no_frames)
+            backend.process(no_frames)
+        client.set_process_callback(process)
+    else:
+        metronome.sync_transport()
+    client.activate()
+    client.transport_start()
+
+    drums = backend.entities[0]
+    drums.lookahead.stop()
+    drums.lookahead.join()
+    if not lookahead:
+        drums.lookahead.find = lambda *args: None
+    drums.key_pressed(30, 0)
+    drums.key_pressed(11, 0)
+    drums.key_released(30, 0)
+    events = []
+    for cycle in range(0, CYCLES):
+        if cycle % EDIT_EVERY == 0:
+            drums.key_pressed(4 + cycle // EDIT_EVERY % 4, 0)
+        drums.lookahead.step()
+        client.cycle(PERIOD)
+        events.extend((cycle, offset, data) for offset, data in drums.midi_port.events)
+    return events, drums.lookahead
+
+def main():
+    failures = []
+    for follow in (False, True):
+        name = "following another master" if follow else "as timebase master"
+        played, lookahead = play(follow, True)
+        expected, reference = play(follow, False)
+        if played != expected:
+            first = next(i for i in range(0, min(len(played), len(expected)) + 1)
+                    if i >= len(played) or i >= len(expected) or played[i] != expected[i])
+            failures.append("{0}: event {1} is {2}, rendering inline plays {3}".format(name, first,
+                played[first] if first < len(played) else None,
+                expected[first] if first < len(expected) else None))
+        total = lookahead.hits + lookahead.misses
+        print("{0}: {1} events, {2} of {3} periods with steps from the lookahead".format(
+            name, len(played), lookahead.hits, total))
+        if total == 0 or lookahead.hits < MIN_HIT_RATE * total:
+            failures.append("{0}: only {1} of {2} periods came from the lookahead".format(
+                name, lookahead.hits, total))
+    for failure in failures:
+        print("FAIL " + failure)
+    if failures:
+        sys.exit(1)
+    print("ok")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+'''
+Check of the MIDI input port against the mock JACK client.
+
+Builds Backend with a MIDI input port, channel 10 routed to the sampler and
+every other channel following the selected instrument, then feeds the port
+notes, controllers and events that are not played. Exits non-zero unless
+every note and controller comes out of the instrument its channel plays in
+the same period, at the offset it came in at, and everything else is left
+out.
+
+    python3 dev_utils/midi_input_check.py
+'''
+import os
+import sys
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, HERE)
+sys.path.insert(0, os.path.join(HERE, ".."))
+
+import mock_jack
+mock_jack.install()
+
+from backend import Backend
+from metronome import Metronome
+from instruments.keyboard import Keyboard
+from instruments.sampler import Sampler
+
+PERIOD = 256
+KEYBOARD = 0
+SAMPLER = 1
+
+def play(client, port, incoming):
+    port.incoming = incoming
+    client.cycle(PERIOD)
+
+def main():
+    client = mock_jack.Client("palette", blocksize = PERIOD)
+    metronome = Metronome(client)
+    backend = Backend(client, metronome, [Keyboard, Sampler], lazy = True, midi_input = True)
+    backend.select(KEYBOARD)
+    backend.route_channel(9, SAMPLER)
+    client.activate()
+    port = backend.midi_in
+    failures = []
+
+    # notes on channel 1 follow the selection, channel 10 goes to the sampler
+    incoming = [(3, b"\x90\x3c\x40"), (100, b"\xb0\x07\x64"), (100, b"\x99\x24\x7f"),
+            (255, b"\x80\x3c\x00")]
+    play(client, port, incoming)
+    keyboard = backend.entities[KEYBOARD].midi_port.events
+    sampler = backend.entities[SAMPLER].midi_port.events
+    if keyboard != [(3, b"\x90\x3c\x40"), (100, b"\xb0\x07\x64"), (255, b"\x80\x3c\x00")]:
+        failures.append("the keyboard played {0}".format(keyboard))
+    if sampler != [(100, b"\x99\x24\x7f")]:
+        failures.append("the sampler played {0}".format(sampler))
+
+    # anything but notes and controllers is left out
+    play(client, port, [(0, b"\xf8"), (1, b"\xc0\x05"), (2, b"\xe0\x00\x40")])
+    if backend.entities[KEYBOARD].midi_port.events:
+        failures.append("the keyboard played {0}".format(backend.entities[KEYBOARD].midi_port.events))
+
+    # selecting another instrument takes the following channels along
+    backend.select(SAMPLER)
+    play(client, port, [(7, b"\x91\x40\x40")])
+    if backend.entities[SAMPLER].midi_port.events != [(7, b"\x91\x40\x40")]:
+        failures.append("the sampler played {0} once selected".format(
+            backend.entities[SAMPLER].midi_port.events))
+    if backend.entities[KEYBOARD].midi_port.events:
+        failures.append("the keyboard still played once deselected")
+    if backend.midi_dropped > 0:
+        failures.append("{0} events dropped".format(backend.midi_dropped))
+
+    for failure in failures:
+        print("FAIL " + failure)
+    if failures:
+        sys.exit(1)
+    print("ok")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,377 @@
+'''
+A local stand-in for the parts of jack-client palette uses, so Backend and
+the instruments can run without a JACK server.
+
+    import mock_jack
+    mock_jack.install() # before anything imports jack
+    client = mock_jack.Client("palette")
+    ...
+    client.cycle(256) # runs one process callback
+
+Clients in several processes can share one transport and frame clock, like
+clients of one server, for palette's process-per-instrument mode. The
+process that drives the cycles calls serve() before starting the others,
+which inherit the server through the environment. Their clients follow:
+once activated they run a process cycle whenever the driving client has
+run one and log the MIDI they write to <server>.<client name>.midi.
+'''
+import mmap
+import os
+from array import array
+import sys
+import threading
+import time
+
+STOPPED = 0
+ROLLING = 1
+STARTING = 3
+
+# file of the shared server, set by serve()
+SERVER_ENV = "MOCK_JACK_SERVER"
+# words of the server file
+SERVER_CYCLES = 0
+SERVER_FRAME_TIME = 1
+SERVER_STATE = 2
+SERVER_FRAME = 3
+SERVER_BLOCKSIZE = 4
+SERVER_DRIVER = 5
+SERVER_WORDS = 8
+# seconds between looks at the cycle counter from a following client
+FOLLOW_POLL = 0.0002
+
+class JackError(Exception):
+    pass
+
+class MidiPort:
+    def __init__(self, name, buffer_size = 4096):
+        self.name = name
+        self.buffer_size = buffer_size
+        self.max_event_size = buffer_size
+        self.lost_midi_events = 0
+        # the port buffer, events are copied in back to back like JACK
+        # does, with the time and start of each, so writing allocates
+        # nothing on the mock's side either
+        self.data = bytearray(buffer_size)
+        self.times = array("l", [0] * buffer_size)
+        self.starts = array("l", [0] * (buffer_size + 1))
+        self.count = 0
+        # events the next cycle will see as input
+        self.incoming = []
+        self.used = 0
+
+    @property
+    def events(self):
+        '''
+        The events written in the current cycle, as (offset, bytes).
+        '''
+        return [(self.times[i], bytes(self.data[self.starts[i]:self.starts[i + 1]]))
+                for i in range(0, self.count)]
+
+    def clear_buffer(self):
+        self.count = 0
+        self.used = 0
+
+    def add(self, time, size):
+        '''
+        Make room for an event, returns where it starts or -1.
+        '''
+        if self.count > 0 and time < self.times[self.count - 1]:
+            return -1
+        if self.used + size > self.buffer_size:
+            self.lost_midi_events += 1
+            return -1
+        start = self.used
+        self.times[self.count] = time
+        self.count += 1
+        self.used += size
+        self.starts[self.count] = self.used
+        return start
+
+    def write_midi_event(self, time, event):
+        # like jack-client: buffers are taken as they are, anything else is
+        # converted first
+        if not isinstance(event, (bytes, bytearray, memoryview)):
+            event = bytes(event)
+        if self.count > 0 and time < self.times[self.count - 1]:
+            raise JackError("Error writing MIDI event: events out of order")
+        start = self.add(time, len(event))
+        if start < 0:
+            raise JackError("Error writing MIDI event: buffer full")
+        self.data[start:start + len(event)] = event
+
+    def reserve_midi_event(self, time, size):
+        start = self.add(time, size)
+        if start < 0:
+            return memoryview(bytearray(0))
+        return memoryview(self.data)[start:start + size]
+
+    def incoming_midi_events(self):
+        for offset, data in self.incoming:
+            yield offset, data
+
+class Ports:
+    def __init__(self):
+        self.ports = []
+
+    def register(self, name):
+        port = MidiPort(name)
+        self.ports.append(port)
+        return port
+
+    def __iter__(self):
+        return iter(self.ports)
+
+    def __len__(self):
+        return len(self.ports)
+
+class Position:
+    '''
+    Stand-in for jack_position_t as returned by transport_query_struct.
+    '''
+    def __init__(self):
+        self.frame = 0
+        self.frame_rate = 0
+        self.usecs = 0
+        self.valid = 0
+        self.bar = 0
+        self.beat = 0
+        self.tick = 0
+        self.bar_start_tick = 0.0
+        self.beats_per_bar = 0.0
+        self.beat_type = 0.0
+        self.ticks_per_beat = 0.0
+        self.beats_per_minute = 0.0
+
+class SharedServer:
+    '''
+    The state clients of several processes share, in a mapped file.
+    '''
+    def __init__(self, path):
+        self.path = path
+        fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+        try:
+            if os.fstat(fd).st_size == 0:
+                os.ftruncate(fd, 8 * SERVER_WORDS)
+            self.map = mmap.mmap(fd, 0)
+        finally:
+            os.close(fd)
+        self.words = memoryview(self.map).cast("Q")
+
+def serve(path):
+    '''
+    Make the clients of this process and of every process started from it
+    share a server, with this process driving the cycles.
+    '''
+    server = SharedServer(path)
+    server.words[SERVER_DRIVER] = os.getpid()
+    os.environ[SERVER_ENV] = path
+    return server
+
+class Client:
+    def __init__(self, name, no_start_server = False, samplerate = 48000, blocksize = 256):
+        self.server = None
+        self.following = False
+        if SERVER_ENV in os.environ:
+            self.server = SharedServer(os.environ[SERVER_ENV])
+            self.following = self.server.words[SERVER_DRIVER] != os.getpid()
+        self.follower = None
+        self.log = None
+        self.name = name
+        self.samplerate = samplerate
+        self.blocksize = blocksize
+        self.midi_outports = Ports()
+        self.midi_inports = Ports()
+        self.process_callback = None
+        self.shutdown_callback = None
+        self.xrun_callback = None
+        self.timebase_callback = None
+        self.active = False
+        if not self.following:
+            self.last_frame_time = 0
+            self.transport_state = STOPPED
+            self.transport_frame = 0
+        # bar/beat/tick only exist while somebody is timebase master
+        self.position = Position()
+        self.new_position = False
+
+    def set_process_callback(self, callback):
+        self.process_callback = callback
+
+    def set_shutdown_callback(self, callback):
+        self.shutdown_callback = callback
+
+    def set_xrun_callback(self, callback):
+        self.xrun_callback = callback
+
+    def set_timebase_callback(self, callback = None, conditional = False):
+        self.timebase_callback = callback
+        return True
+
+    def release_timebase(self):
+        self.timebase_callback = None
+
+    @property
+    def last_frame_time(self):
+        if self.server is not None:
+            return self.server.words[SERVER_FRAME_TIME]
+        return self.local_frame_time
+
+    @last_frame_time.setter
+    def last_frame_time(self, value):
+        if self.server is not None:
+            self.server.words[SERVER_FRAME_TIME] = value
+        else:
+            self.local_frame_time = value
+
+    @property
+    def transport_state(self):
+        if self.server is not None:
+            return self.server.words[SERVER_STATE]
+        return self.local_state
+
+    @transport_state.setter
+    def transport_state(self, value):
+        if self.server is not None:
+            self.server.words[SERVER_STATE] = value
+        else:
+            self.local_state = value
+
+    @property
+    def transport_frame(self):
+        if self.server is not None:
+            return self.server.words[SERVER_FRAME]
+        return self.local_frame
+
+    @transport_frame.setter
+    def transport_frame(self, value):
+        if self.server is not None:
+            self.server.words[SERVER_FRAME] = value
+        else:
+            self.local_frame = value
+
+    def activate(self):
+        self.active = True
+        if self.following:
+            self.log = open(self.server.path + "." + self.name + ".midi", "w")
+            self.follower = threading.Thread(target = self.follow, daemon = True)
+            self.follower.start()
+
+    def follow(self):
+        '''
+        Run a cycle after every cycle of the driving client.
+        '''
+        words = self.server.words
+        cycles = words[SERVER_CYCLES]
+        while self.active:
+            if words[SERVER_CYCLES] == cycles:
+                time.sleep(FOLLOW_POLL)
+                continue
+            cycles = words[SERVER_CYCLES]
+            self.cycle(words[SERVER_BLOCKSIZE])
+
+    def deactivate(self):
+        self.active = False
+        if self.follower is not None and self.follower is not threading.current_thread():
+            self.follower.join()
+            self.follower = None
+
+    def close(self):
+        self.deactivate()
+        if self.log is not None:
+            self.log.close()
+            self.log = None
+
+    @property
+    def frame_time(self):
+        return self.last_frame_time
+
+    @property
+    def frames_since_cycle_start(self):
+        return 0
+
+    def transport_start(self):
+        self.transport_state = ROLLING
+
+    def transport_stop(self):
+        self.transport_state = STOPPED
+
+    def transport_locate(self, frame):
+        self.transport_frame = frame
+
+    def transport_query(self):
+        position = {
+                "usecs": self.last_frame_time * 1000000 // self.samplerate,
+                "frame_rate": self.samplerate,
+                "frame": self.transport_frame
+                }
+        if self.timebase_callback is not None and self.position.valid & 16:
+            for field in ["bar", "beat", "tick", "bar_start_tick", "beats_per_bar",
+                    "beat_type", "ticks_per_beat", "beats_per_minute"]:
+                position[field] = getattr(self.position, field)
+        return self.transport_state, position
+
+    def transport_query_struct(self):
+        '''
+        Fills in and returns the same Position every time, like jack-client
+        does with its jack_position_t.
+        '''
+        self.position.frame = self.transport_frame
+        self.position.frame_rate = self.samplerate
+        if self.timebase_callback is None:
+            # nobody to supply bar/beat/tick
+            self.position.valid = 0
+        return self.transport_state, self.position
+
+    def transport_reposition_struct(self, position):
+        self.transport_frame = position.frame
+        if self.timebase_callback is not None:
+            # the timebase master gets told about the new position
+            self.position = position
+            self.new_position = True
+
+    def cycle(self, no_frames = None):
+        '''
+        Run one process cycle, the way the JACK server would.
+        '''
+        if no_frames is None:
+            no_frames = self.blocksize
+        self.begin_cycle(no_frames)
+        if self.process_callback is not None:
+            self.process_callback(no_frames)
+        self.end_cycle(no_frames)
+
+    def begin_cycle(self, no_frames):
+        # nothing happens before the process callback, the timebase master
+        # runs after it with the next cycle's position like with JACK
+        pass
+
+    def end_cycle(self, no_frames):
+        if self.following:
+            # the driving client moves the clock, only report what was played
+            for port in self.midi_outports:
+                for offset, data in port.events:
+                    self.log.write("{0} {1} {2}\n".format(self.last_frame_time, offset,
+                        bytes(data).hex()))
+            self.log.flush()
+            return
+        self.last_frame_time = (self.last_frame_time + no_frames) & 0xffffffff
+        if self.transport_state == ROLLING:
+            self.transport_frame += no_frames
+        if self.timebase_callback is not None:
+            # the position of the next cycle, like JACK hands it over
+            self.position.frame = self.transport_frame
+            self.position.frame_rate = self.samplerate
+            self.timebase_callback(self.transport_state, no_frames, self.position,
+                    self.new_position)
+            self.new_position = False
+        for port in self.midi_inports:
+            port.incoming = []
+        if self.server is not None:
+            self.server.words[SERVER_BLOCKSIZE] = no_frames
+            self.server.words[SERVER_CYCLES] += 1
+
+def install():
+    '''
+    Make "import jack" pick up this module.
+    '''
+    sys.modules["jack"] = sys.modules[__name__]
@@ -0,0 +1,40 @@
+'''
+An Interface with the same methods that paints nothing, for running palette
+without a terminal.
+'''
+import threading
+
+class NullInterface:
+    def __init__(self, entities):
+        self.lock = threading.Lock()
+        self.entities = entities
+        self.active_entity = 0
+        self.beat_type = 0
+        self.beats_per_bar = 0
+        self.bpm = 0
+
+    def paint_pad(self, active_entity):
+        self.active_entity = active_entity
+
+    def paint_key_on(self, key):
+        pass
+
+    def paint_key_off(self, key):
+        pass
+
+    def change_beat_data(self, beats_per_bar, beat_type, bpm):
+        self.beats_per_bar = beats_per_bar
+        self.beat_type = beat_type
+        self.bpm = bpm
+
+    def paint_active_tick(self, tick_no):
+        pass
+
+    def log(self, msg):
+        pass
+
+    def render(self):
+        pass
+
+    def shutdown(self):
+        pass
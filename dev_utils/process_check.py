@@ -0,0 +1,142 @@
+'''
+End to end check of the process-per-instrument mode against the mock JACK
+client.
+
+Starts Backend with every instrument in a child process, all sharing one
+mock server with this process, which drives the cycles at the period rate
+and owns the transport. It loads the drum machine with a pattern, plays
+keys on the keyboard through the supervisor, then reads back what every
+child wrote to its port. Exits non-zero if a child did not come up, did not
+play what it was sent or did not quit.
+
+    python3 dev_utils/process_check.py --seconds 2
+
+python -m unittest runs it through test_process.py.
+'''
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, HERE)
+sys.path.insert(0, os.path.join(HERE, ".."))
+
+import mock_jack
+mock_jack.install()
+
+from backend import Backend
+from metronome import Metronome
+from supervisor import CLIENT_PREFIX
+from instruments import keyboard
+from instruments.keyboard import Keyboard
+from instruments.sampler import Sampler
+from instruments.drummachine import DrumMachine
+from instruments.push import Push
+
+CONSTRUCTORS = [Keyboard, Sampler, DrumMachine, Push]
+NOTE_ON = 0x90
+# seconds the children get to come up
+STARTUP_TIMEOUT = 30.0
+
+def log_path(server, number):
+    return server + "." + CLIENT_PREFIX + str(number) + ".midi"
+
+def read_log(path):
+    '''
+    Every event a child wrote, as (frame time, offset, bytes).
+    '''
+    events = []
+    with open(path) as f:
+        for line in f:
+            frame_time, offset, data = line.split()
+            events.append((int(frame_time), int(offset), bytes.fromhex(data)))
+    return events
+
+def run_cycles(client, backend, period, cycles):
+    deadline = period / client.samplerate
+    next_cycle = time.perf_counter()
+    for i in range(0, cycles):
+        client.cycle(period)
+        next_cycle += deadline
+        remaining = next_cycle - time.perf_counter()
+        if remaining > 0:
+            time.sleep(remaining)
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(description = "Check the process-per-instrument mode.")
+    parser.add_argument("--period", type = int, default = 256)
+    parser.add_argument("--samplerate", type = int, default = 48000)
+    parser.add_argument("--seconds", type = float, default = 2.0,
+            help = "seconds of playing")
+    args = parser.parse_args(argv)
+
+    directory = tempfile.mkdtemp()
+    server = os.path.join(directory, "server")
+    mock_jack.serve(server)
+    client = mock_jack.Client("palette", samplerate = args.samplerate, blocksize = args.period)
+    metronome = Metronome(client)
+    started = time.perf_counter()
+    backend = Backend(client, metronome, CONSTRUCTORS, processes = True)
+    client.activate()
+    metronome.sync_transport()
+
+    # keep the clock going while the children come up
+    failures = []
+    while not all(os.path.exists(log_path(server, i)) for i in range(0, len(CONSTRUCTORS))):
+        if time.perf_counter() - started > STARTUP_TIMEOUT:
+            failures.append("children did not come up")
+            break
+        run_cycles(client, backend, args.period, 16)
+    print("children up after {0:.0f}ms".format(1000 * (time.perf_counter() - started)))
+
+    # a bar of closed hihats and a bass drum on every quarter
+    drums = backend.entity(2)
+    for key, pressed in [(30, True), (11, True), (30, False), (32, True), (27, True), (32, False)]:
+        if pressed:
+            drums.key_pressed(key, client.frame_time)
+        else:
+            drums.key_released(key, client.frame_time)
+    client.transport_start()
+
+    cycles = int(args.seconds * args.samplerate / args.period)
+    notes = keyboard.layout.keys("note")
+    sent = 0
+    for i in range(0, 8):
+        key = notes[i % len(notes)]
+        backend.entity(0).key_pressed(key, client.frame_time)
+        run_cycles(client, backend, args.period, cycles // 16)
+        backend.entity(0).key_released(key, client.frame_time)
+        run_cycles(client, backend, args.period, cycles // 16)
+        sent += 1
+
+    closing = time.perf_counter()
+    backend.close()
+    print("children quit after {0:.0f}ms".format(1000 * (time.perf_counter() - closing)))
+    for child in backend.children:
+        if child.child.exitcode != 0:
+            failures.append("instrument {0} exited with {1}".format(child.number,
+                child.child.exitcode))
+
+    played = [read_log(log_path(server, i)) if os.path.exists(log_path(server, i)) else []
+            for i in range(0, len(CONSTRUCTORS))]
+    for i in range(0, len(CONSTRUCTORS)):
+        print("{0:<12} {1:5d} midi events".format(CONSTRUCTORS[i].__name__, len(played[i])))
+    note_ons = [event for event in played[0] if event[2][0] & 0xf0 == NOTE_ON]
+    if len(note_ons) != sent:
+        failures.append("keyboard played {0} of {1} notes".format(len(note_ons), sent))
+    if len(played[2]) == 0:
+        failures.append("drum machine played nothing")
+    if len(played[1]) != 0 or len(played[3]) != 0:
+        failures.append("an instrument nobody played made a sound")
+
+    for failure in failures:
+        print("FAIL " + failure)
+    if failures:
+        return 1
+    print("ok")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
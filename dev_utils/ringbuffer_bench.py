@@ -0,0 +1,88 @@
+'''
+Micro-benchmark of the key-event handoff: queue.Queue against RingBuffer.
+
+A producer thread pushes bursts of key events at a fixed rate while the
+consumer drains everything available once per simulated JACK period, the
+same way the instruments' process() does. Reports the cost of each drain
+on the consumer side, which is the part that runs on the realtime thread.
+
+    python3 dev_utils/ringbuffer_bench.py [events per second] [seconds]
+'''
+import os
+import sys
+import threading
+import time
+from queue import Queue
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from ringbuffer import RingBuffer
+
+PERIOD = 64 / 48000 # seconds per simulated period
+BURST = 16 # events per producer wakeup
+
+class QueueAdapter:
+    def __init__(self):
+        self.queue = Queue()
+
+    def push(self, value):
+        self.queue.put(value)
+        return True
+
+    def empty(self):
+        return self.queue.empty()
+
+    def pop(self):
+        return self.queue.get()
+
+def produce(queue, rate, stop):
+    interval = BURST / rate
+    value = 0
+    while not stop.is_set():
+        for i in range(0, BURST):
+            queue.push(value & 127)
+            value += 1
+        time.sleep(interval)
+
+def run(name, queue, rate, seconds):
+    stop = threading.Event()
+    producer = threading.Thread(target = produce, args = (queue, rate, stop))
+    producer.start()
+    drains = []
+    events = 0
+    deadline = time.monotonic() + seconds
+    while time.monotonic() < deadline:
+        started = time.perf_counter_ns()
+        while not queue.empty():
+            queue.pop()
+            events += 1
+        drains.append(time.perf_counter_ns() - started)
+        time.sleep(PERIOD)
+    stop.set()
+    producer.join()
+    drains.sort()
+    print("{0:>10}: {1} events, drain p50 {2:.1f}us p99 {3:.1f}us max {4:.1f}us".format(
+        name, events,
+        drains[len(drains) // 2] / 1000,
+        drains[int(len(drains) * 0.99)] / 1000,
+        drains[-1] / 1000))
+
+def tight_loop(name, queue, count):
+    started = time.perf_counter()
+    for i in range(0, count):
+        queue.push(i & 127)
+        queue.pop()
+    elapsed = time.perf_counter() - started
+    print("{0:>10}: {1:.0f} ns per push/pop pair".format(name, elapsed / count * 1e9))
+
+if __name__ == "__main__":
+    rate = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    seconds = float(sys.argv[2]) if len(sys.argv) > 2 else 3.0
+    print("single thread, push/pop pairs")
+    tight_loop("Queue", QueueAdapter(), 200000)
+    tight_loop("RingBuffer", RingBuffer(), 200000)
+    print("producer at " + str(rate) + " events/s, consumer every "
+            + "{0:.2f}ms".format(PERIOD * 1000))
+    run("Queue", QueueAdapter(), rate, seconds)
+    ring = RingBuffer()
+    run("RingBuffer", ring, rate, seconds)
+    print("RingBuffer overflows: " + str(ring.overflows))
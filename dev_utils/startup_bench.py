@@ -0,0 +1,64 @@
+'''
+Cold start benchmark: time from launching palette to client.activate().
+
+Every run starts a fresh interpreter that builds Main against the mock JACK
+client and a NullInterface, so the time covers interpreter startup, the
+imports and everything Main does before activating. With --eager all the
+instruments are built at startup, as palette did before the registry.
+
+    python3 dev_utils/startup_bench.py --runs 20
+'''
+import argparse
+import os
+import subprocess
+import sys
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+CHILD = """
+import os, sys, tempfile, time
+sys.path.insert(0, {here!r})
+sys.path.insert(0, os.path.join({here!r}, ".."))
+import mock_jack
+mock_jack.install()
+activated = [0]
+activate = mock_jack.Client.activate
+def stamped(self):
+    activated[0] = time.monotonic_ns()
+    activate(self)
+mock_jack.Client.activate = stamped
+import backend
+if {eager!r}:
+    lazy_backend = backend.Backend
+    backend.Backend = lambda client, metronome, entities, lazy = False, **options: lazy_backend(
+            client, metronome, entities, **options)
+import palette
+from null_interface import NullInterface
+palette.Backend = backend.Backend
+palette.Interface = NullInterface
+main = palette.Main(pipe = None)
+main.renderer.stop()
+print(activated[0])
+"""
+
+def main():
+    parser = argparse.ArgumentParser(description = "Benchmark palette's cold start.")
+    parser.add_argument("--runs", type = int, default = 10)
+    parser.add_argument("--eager", action = "store_true",
+            help = "build every instrument at startup")
+    args = parser.parse_args()
+
+    child = CHILD.format(here = HERE, eager = args.eager)
+    times = []
+    for i in range(0, args.runs):
+        launched = time.monotonic_ns()
+        output = subprocess.run([sys.executable, "-c", child], check = True,
+                capture_output = True, text = True).stdout
+        times.append((int(output.split()[-1]) - launched) / 1000000)
+    times.sort()
+    print("launch to activate over {0} runs: min {1:.1f}ms median {2:.1f}ms max {3:.1f}ms".format(
+        args.runs, times[0], times[len(times) // 2], times[-1]))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,23 @@
+'''
+Runs dev_utils/alloc_check.py under unittest, so that a callback that starts
+allocating fails the test run.
+'''
+import contextlib
+import io
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import alloc_check
+
+class AllocationTest(unittest.TestCase):
+    def test_callback_does_not_allocate(self):
+        output = io.StringIO()
+        with contextlib.redirect_stdout(output):
+            status = alloc_check.main([])
+        self.assertEqual(status, 0, output.getvalue())
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,50 @@
+'''
+Runs dev_utils/capture_check.py under unittest: the MIDI file a capture
+writes against what the instruments played, for the built-in key log and
+for one read from a file.
+'''
+import contextlib
+import io
+import os
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import capture_check
+
+# cycle, instrument, key, pressed
+KEY_LOG = """\
+# keyboard chord, sampler pads, a drum step
+10 0 29 1
+10 0 6 1
+10 0 5 1
+40 0 29 0
+40 0 6 0
+40 0 5 0
+60 1 30 1
+62 1 30 0
+64 1 31 1
+66 1 31 0
+80 2 4 1
+"""
+
+class CaptureTest(unittest.TestCase):
+    def check(self, *argv):
+        output = io.StringIO()
+        with contextlib.redirect_stdout(output):
+            status = capture_check.main(list(argv))
+        self.assertEqual(status, 0, output.getvalue())
+
+    def test_built_in_key_log(self):
+        self.check("--cycles", "3000")
+
+    def test_key_log_file(self):
+        with tempfile.NamedTemporaryFile("w", suffix = ".keys") as keys:
+            keys.write(KEY_LOG)
+            keys.flush()
+            self.check("--cycles", "1000", "--keys", keys.name)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,25 @@
+'''
+Runs dev_utils/process_check.py under unittest: every instrument in a
+process of its own, end to end against the mock JACK server.
+
+The check runs as a script of its own. The child processes are spawned
+and pick up the mock JACK client by importing the main module again,
+which under unittest would be unittest itself.
+'''
+import os
+import subprocess
+import sys
+import unittest
+
+CHECK = os.path.join(os.path.dirname(os.path.abspath(__file__)), "process_check.py")
+# seconds the whole check may take
+TIMEOUT = 120
+
+class ProcessTest(unittest.TestCase):
+    def test_instruments_in_processes(self):
+        result = subprocess.run([sys.executable, CHECK, "--seconds", "1"],
+                capture_output = True, text = True, timeout = TIMEOUT)
+        self.assertEqual(result.returncode, 0, result.stdout + result.stderr)
+
+if __name__ == "__main__":
+    unittest.main()
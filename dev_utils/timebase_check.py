@@ -0,0 +1,101 @@
+'''
+Check of the metronome as JACK timebase master against the mock JACK
+client.
+
+Rolls the transport, nudges the tempo and changes the meter, and checks
+every period that
+
+    the transport is never relocated, the timeline stays continuous,
+    the position moves on by exactly the frames played at the tempo they
+    were played at, whatever the tempo was before,
+    the bar/beat/tick published to JACK for the next period matches where
+    the timeline gets to, and
+    a new meter starts on the bar line the old one put down.
+
+    python3 dev_utils/timebase_check.py
+'''
+import os
+import sys
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, HERE)
+sys.path.insert(0, os.path.join(HERE, ".."))
+
+import mock_jack
+mock_jack.install()
+
+from metronome import Metronome, TICKS_PER_BEAT
+
+PERIOD = 256
+SAMPLERATE = 48000
+CYCLES = 3000
+# when the tempo is nudged up and down and the meter changed
+NUDGE_UP_AT = (500, 900, 1700)
+NUDGE_DOWN_AT = (501,)
+METER_AT = 1200
+METER = 3
+# beats of slack for floating point error
+EPSILON = 1e-9
+
+def main():
+    client = mock_jack.Client("palette", samplerate = SAMPLERATE, blocksize = PERIOD)
+    metronome = Metronome(client)
+    client.set_process_callback(metronome.process)
+    client.activate()
+    metronome.sync_transport()
+    client.transport_start()
+    failures = []
+
+    expected = 0.0
+    meter_line = None
+    for cycle in range(0, CYCLES):
+        if cycle in NUDGE_UP_AT:
+            metronome.increment_bpm()
+        if cycle in NUDGE_DOWN_AT:
+            metronome.decrement_bpm()
+        if cycle == METER_AT:
+            metronome.set_meter(METER)
+        before = metronome.beats_per_bar
+        client.cycle(PERIOD)
+        if cycle > 0 and not metronome.continuous:
+            failures.append("period {0} is not continuous".format(cycle))
+        if abs(metronome.beat_position - expected) > EPSILON:
+            failures.append("period {0} is at beat {1}, not {2}".format(cycle,
+                metronome.beat_position, expected))
+        expected += PERIOD / metronome.frames_per_beat
+        # what was published is where the next period starts
+        position = client.position
+        beats = ((position.bar_start_tick + position.tick) / TICKS_PER_BEAT
+                + position.beat - 1)
+        if not abs(beats - expected) < 1 / TICKS_PER_BEAT:
+            failures.append("period {0} published beat {1} for the next one, it starts at {2}".format(
+                cycle, beats, expected))
+        if position.beats_per_minute != metronome.bpm:
+            failures.append("period {0} published {1} bpm".format(cycle, position.beats_per_minute))
+        if before != metronome.beats_per_bar:
+            meter_line = metronome.meter_beat
+            if abs(meter_line / before - round(meter_line / before)) > EPSILON:
+                failures.append("the new meter starts on beat {0}, not on a bar line".format(
+                    meter_line))
+            if not meter_line <= metronome.beat_position < meter_line + PERIOD / metronome.frames_per_beat:
+                failures.append("the new meter started late, at beat {0}".format(
+                    metronome.beat_position))
+        if len(failures) > 10:
+            break
+
+    if meter_line is None:
+        failures.append("the meter never changed")
+    elif metronome.beats_per_bar != METER or client.position.beats_per_bar != METER:
+        failures.append("the meter is {0}".format(metronome.beats_per_bar))
+    if client.transport_frame != CYCLES * PERIOD:
+        failures.append("the transport was relocated to frame {0}".format(client.transport_frame))
+    if metronome.bpm != 122:
+        failures.append("the tempo ended at {0} bpm".format(metronome.bpm))
+    for failure in failures:
+        print("FAIL " + failure)
+    if failures:
+        sys.exit(1)
+    print("ok")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+'''
+Turns USB keyboard HID reports into key press and release batches.
+
+Both report layouts keyboards use are understood:
+
+    boot protocol  modifiers, reserved, up to six key codes (8 bytes)
+    NKRO bitmap    modifiers, then one bit per key code, bit n of byte k
+                   standing for key code 8 * k + n
+
+Pressed keys are tracked as a 256-bit bitmap held in a Python int, so
+working out what changed between two reports is an xor and two ands, no
+matter how many keys are down.
+'''
+
+BOOT_REPORT_SIZE = 8
+BOOT_KEYS_START = 2
+
+# key codes 1-3 are error codes, 1 meaning more keys are down than the
+# report can carry; such a report says nothing about which keys changed
+ERROR_ROLL_OVER = 1
+ERROR_CODES = 0xf
+
+class ReportDecoder:
+    def __init__(self, bitmap_start = 1):
+        '''
+        bitmap_start: int
+        Byte of an NKRO report the key bitmap starts at.
+        '''
+        self.bitmap_start = bitmap_start
+        # bit n set means key code n is down
+        self.state = 0
+
+    def bitmap(self, report):
+        '''
+        The set of keys a report says are down, or None for a roll over
+        error report.
+        '''
+        if len(report) > BOOT_REPORT_SIZE:
+            return int.from_bytes(report[self.bitmap_start:], "little") & ~ERROR_CODES
+        keys = 0
+        for i in range(BOOT_KEYS_START, len(report)):
+            code = report[i]
+            if code == ERROR_ROLL_OVER:
+                return None
+            keys |= 1 << code
+        return keys & ~ERROR_CODES
+
+    def decode(self, report):
+        '''
+        Returns the bitmaps of the keys released and pressed since the last
+        report.
+        '''
+        keys = self.bitmap(report)
+        if keys is None:
+            return 0, 0
+        changed = keys ^ self.state
+        self.state = keys
+        return changed & ~keys, changed & keys
+
+    def changes(self, report):
+        '''
+        The key changes in a report as (key, pressed) pairs, releases
+        first, ready for protocol.encode_binary.
+        '''
+        released, pressed = self.decode(report)
+        batch = []
+        while released:
+            lowest = released & -released
+            batch.append((lowest.bit_length() - 1, False))
+            released ^= lowest
+        while pressed:
+            lowest = pressed & -pressed
+            batch.append((lowest.bit_length() - 1, True))
+            pressed ^= lowest
+        return batch
+
+    def release_all(self):
+        '''
+        Release every key still down, for when the keyboard goes away.
+        '''
+        return self.changes(bytes(BOOT_REPORT_SIZE))
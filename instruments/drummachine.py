@@ -1,129 +1,196 @@
+from array import array
+
 import jack
 
+from instruments import midi
 from instruments.instrument import Instrument
+from instruments.lookahead import Lookahead
+from instruments.scheduler import StepScheduler
+from layout import Layout, NO_VALUE
 
 BEATS_PER_BAR=16
+STEPS_PER_BEAT=4
 ACCENT_INCREMENT=50
 PLAY_NOTE_EVENT=144
 DEFAULT_NOTE=60
 DEFAULT_VEL=63
+# bit of a step's bitmask that marks it accented, bits 0-15 are channels
+ACCENT=16
+CHANNELS=16
+# what the control keys do while held, indices into DrumMachine.controls
+FILL_ALL=0
+FILL_HALF=1
+FILL_QUARTER=2
+FILL_EIGHTH=3
+MUTE=4
+UNMUTE=5
+CLEAR=6
 
 class DrumMachine(Instrument):
-    def __init__(self, port, samplerate):
-        super().__init__(port, samplerate)
-        self.beat_bindings = []
-        for i in range(0, BEATS_PER_BAR):
-            self.beat_bindings.append(set())
-        self.muted = set()
+    def __init__(self, port, samplerate, metronome):
+        super().__init__(port, samplerate, metronome)
+        # one bitmask of channels (and the accent) per step
+        self.beat_bindings = [0] * BEATS_PER_BAR
+        self.muted = 0
+        # the midi bytes each step plays, rebuilt whenever the step changes
+        self.compiled = [b""] * BEATS_PER_BAR
         self.current_beat = 0
-        self.bpm = 30.0
-        self.frames_since = 0
-        self.frames_per_beat = 60 / self.bpm / BEATS_PER_BAR * samplerate
-        self.frames_until = self.frames_per_beat
+        self.scheduler = StepScheduler(metronome, STEPS_PER_BEAT)
         self.current_function = self.bind_sample
-        self.control = {
-            30: self.fill_all,
-            31: self.fill_half,
-            32: self.fill_quarter,
-            33: self.fill_eighth,
-            20: self.mute,
-            26: self.unmute,
-            8: self.clear
-        }
-        self.channels = {
-                4: 0, # rim shot
-                22: 1, # clap
-                7: 2, # cowbell
-                9: 3, # cymbal
-                10: 4, # open hihat
-                11: 5, # closed hihat
-                13: 6, # claves
-                14: 7, # maracas
-                29: -1, # ACCENT
-                27: 8, # bass kick
-                6: 9, # snare
-                25: 10, # low tom
-                5: 11, # med tom
-                17: 12, # high tom
-                16: 13, # low conga
-                54: 14, # mid conga
-                55: 15 # high conga
-        }
+        self.controls = (self.fill_all, self.fill_half, self.fill_quarter,
+                self.fill_eighth, self.mute, self.unmute, self.clear)
+        # renders the pattern of the coming periods off the JACK thread
+        self.lookahead = Lookahead(samplerate, STEPS_PER_BEAT, BEATS_PER_BAR, self.compiled)
+        self.lookahead.start()
 
     def process(self, no_frames):
-        self.midi_port.clear_buffer()
-        # if the beat falls within this round
-        if (self.frames_until < no_frames):
-            samples_to_play = self.beat_bindings[self.current_beat]
-            
-            # check if there is an accent on this beat
-            accent = False
-            if -1 in samples_to_play:
-                accent = True
-                samples_to_play.remove(-1)
-
-            for sample in samples_to_play:
-                if sample not in self.muted:
-                    if accent:
-                        self.midi_port.write_midi_event(self.frames_until, 
-                                (PLAY_NOTE_EVENT + sample, DEFAULT_NOTE, DEFAULT_VEL + ACCENT_INCREMENT))
-                    else:
-                        self.midi_port.write_midi_event(self.frames_until, 
-                                (PLAY_NOTE_EVENT + sample, DEFAULT_NOTE, DEFAULT_VEL))
-
-            # set the counts to what they will be at the beginning of next round
-            self.frames_since = int(no_frames - self.frames_until)
-            self.frames_until = int(self.frames_per_beat - self.frames_since)
-            self.current_beat = int((self.current_beat + 1) % BEATS_PER_BAR)
-        else:
-            self.frames_since += no_frames
-            self.frames_until -= no_frames
+        self.clear_buffer()
+        scheduler = self.scheduler
+        count = scheduler.advance(no_frames)
+        if count > 0:
+            found = self.lookahead.find(self.metronome, no_frames, scheduler.steps[0], count)
+            if found is None or not self.play_slot(*found):
+                # every step that falls within this round
+                for i in range(0, count):
+                    offset = scheduler.offsets[i]
+                    step = self.compiled[scheduler.steps[i] % BEATS_PER_BAR]
+                    for j in range(0, len(step), 3):
+                        self.write_event(offset, step[j], step[j + 1], step[j + 2])
+            self.current_beat = scheduler.steps[count - 1] % BEATS_PER_BAR
+        self.lookahead.publish(self.metronome, no_frames, scheduler.last_step)
+        self.flush(no_frames)
+
+    def play_slot(self, slot, sequence):
+        '''
+        Play the period the lookahead rendered, at the offsets the
+        scheduler found for its steps. False, with nothing played, if the
+        worker rewrote the slot while it was being copied.
+        '''
+        output = self.output
+        start = output.count
+        offsets = self.scheduler.offsets
+        indices = slot.indices
+        data = slot.data
+        for i in range(0, slot.count):
+            output.insert(offsets[indices[i]], data[3 * i], data[3 * i + 1], data[3 * i + 2])
+        if not self.lookahead.intact(slot, sequence):
+            # the pattern is the first thing written in a period
+            output.count = start
+            return False
+        for i in range(start, output.count):
+            message = output.messages[i]
+            self.looper.record(output.offsets[i], message[0], message[1], message[2])
+        return True
+
+    def compile_step(self, beat):
+        '''
+        Turn the bitmask of a step into the bytes process() plays. Runs on
+        the control thread, the new bytes replace the old ones in one go.
+        '''
+        playing = self.beat_bindings[beat] & ~self.muted
+        velocity = DEFAULT_VEL
+        if playing & (1 << ACCENT):
+            velocity = DEFAULT_VEL + ACCENT_INCREMENT
+        messages = bytearray()
+        for sample in range(0, CHANNELS):
+            if playing & (1 << sample):
+                messages += midi.message(PLAY_NOTE_EVENT + sample, DEFAULT_NOTE, velocity)
+        self.compiled[beat] = bytes(messages)
+        self.lookahead.invalidate(beat)
+
+    def save_state(self):
+        # one word per step, then the mutes
+        return array("I", self.beat_bindings + [self.muted]).tobytes()
+
+    def restore_state(self, view):
+        words = view[0:4 * (BEATS_PER_BAR + 1)].cast("I")
+        self.beat_bindings[:] = words[0:BEATS_PER_BAR].tolist()
+        self.muted = words[BEATS_PER_BAR]
+        for beat in range(0, BEATS_PER_BAR):
+            self.compile_step(beat)
+
+    def set_bits(self, sample, first, spacing):
+        for i in range(0, BEATS_PER_BAR, spacing):
+            beat = (first + i) % BEATS_PER_BAR
+            if not self.beat_bindings[beat] & (1 << sample):
+                self.beat_bindings[beat] |= 1 << sample
+                self.compile_step(beat)
     
-    def key_pressed(self, key):
-        if key in self.control:
-            self.current_function = self.control[key]
-        if key in self.channels:
-            self.current_function(self.channels[key])
-
-    def key_released(self, key):
-        if key in self.control:
+    def key_pressed(self, key, frame, device = 0):
+        control = layout.control[key]
+        if control != NO_VALUE:
+            self.current_function = self.controls[control]
+        channel = layout.channel[key]
+        if channel != NO_VALUE:
+            self.current_function(channel)
+
+    def key_released(self, key, frame, device = 0):
+        if layout.control[key] != NO_VALUE:
             self.current_function = self.bind_sample
 
     def bind_sample(self, sample):
-        set_in_question = None
-        if self.frames_since < self.frames_until:
-            set_in_question = self.beat_bindings[self.current_beat]
-        else:
-            set_in_question = self.beat_bindings[(self.current_beat + 1) % BEATS_PER_BAR]
-        if sample in set_in_question:
-            set_in_question.remove(sample)
-        else:
-            set_in_question.add(sample)
+        # bind to whichever step the key was closest to
+        beat = self.scheduler.nearest_step() % BEATS_PER_BAR
+        self.beat_bindings[beat] ^= 1 << sample
+        self.compile_step(beat)
 
     def fill_all(self, sample):
-        for i in range(0, BEATS_PER_BAR):
-            self.beat_bindings[(self.current_beat + i) % BEATS_PER_BAR].add(sample)
+        self.set_bits(sample, self.current_beat, 1)
 
     def fill_half(self, sample):
-        for i in range(0, BEATS_PER_BAR, 2):
-            self.beat_bindings[(self.current_beat + i) % BEATS_PER_BAR].add(sample)
+        self.set_bits(sample, self.current_beat, 2)
 
     def fill_quarter(self, sample):
-        for i in range(0, BEATS_PER_BAR, 4):
-            self.beat_bindings[(self.current_beat + i) % BEATS_PER_BAR].add(sample)
+        self.set_bits(sample, self.current_beat, 4)
 
     def fill_eighth(self, sample):
-        for i in range(0, BEATS_PER_BAR, 8):
-            self.beat_bindings[(self.current_beat + i) % BEATS_PER_BAR].add(sample)
+        self.set_bits(sample, self.current_beat, 8)
 
     def mute(self, sample):
-        self.muted.add(sample)
+        self.set_muted(self.muted | (1 << sample))
 
     def unmute(self, sample):
-        if sample in self.muted:
-            self.muted.remove(sample)
+        self.set_muted(self.muted & ~(1 << sample))
+
+    def set_muted(self, muted):
+        changed = self.muted ^ muted
+        self.muted = muted
+        # only the steps that use the sample sound any different
+        for beat in range(0, BEATS_PER_BAR):
+            if self.beat_bindings[beat] & changed:
+                self.compile_step(beat)
 
     def clear(self, sample):
-        for beat in self.beat_bindings:
-            if sample in beat:
-                beat.remove(sample)
+        for beat in range(0, BEATS_PER_BAR):
+            if self.beat_bindings[beat] & (1 << sample):
+                self.beat_bindings[beat] &= ~(1 << sample)
+                self.compile_step(beat)
+
+# label of every key, the channel the sample keys play (or the accent) and
+# what the control keys do
+layout = Layout(("channel", "control"), {
+        30: (" 1/1", None, FILL_ALL),
+        31: (" 1/2", None, FILL_HALF),
+        32: (" 1/4", None, FILL_QUARTER),
+        33: (" 1/8", None, FILL_EIGHTH),
+        20: (" mu ", None, MUTE),
+        26: (" um ", None, UNMUTE),
+        8: (" cl ", None, CLEAR),
+        4: (" RS ", 0, None), # rim shot
+        22: (" CP ", 1, None), # clap
+        7: (" CB ", 2, None), # cowbell
+        9: (" CY ", 3, None), # cymbal
+        10: (" OH ", 4, None), # open hihat
+        11: (" CH ", 5, None), # closed hihat
+        13: (" CL ", 6, None), # claves
+        14: (" MA ", 7, None), # maracas
+        29: (" AC ", ACCENT, None),
+        27: (" BD ", 8, None), # bass kick
+        6: (" SD ", 9, None), # snare
+        25: (" LT ", 10, None), # low tom
+        5: (" MT ", 11, None), # med tom
+        17: (" HT ", 12, None), # high tom
+        16: (" LC ", 13, None), # low conga
+        54: (" MC ", 14, None), # mid conga
+        55: (" HC ", 15, None) # high conga
+        })
@@ -1,6 +1,22 @@
 from abc import ABC, abstractmethod
 from enum import Enum
 
+from instruments import looper
+from instruments import midi
+from instruments.looper import Looper
+from instruments.output import OutputBuffer
+from protocol import MAX_DEVICES
+from ringbuffer import RingBuffer
+
+# jack frame times are unsigned 32 bit and wrap around
+FRAME_TIME_MASK = 0xffffffff
+FRAME_TIME_HALF = 0x80000000
+
+# fields of a queued event: status, data1, data2, jack frame time of the key
+EVENT_WIDTH = 4
+# fields of an event from a MIDI input port: offset, status, data1, data2
+INPUT_WIDTH = 4
+
 class LooperMode(Enum):
     NORMAL = 0,
     RECORD = 1,
@@ -9,10 +25,32 @@ class LooperMode(Enum):
     DOUBLE = 4
 
 class Instrument(ABC):
-    def __init__(self, port, samplerate):
+    def __init__(self, port, samplerate, metronome):
         self.midi_port = port
         self.samplerate = samplerate
+        self.metronome = metronome
+        # midi events handed from the control thread to process(), one
+        # queue for every device routed here so a burst on one device
+        # cannot fill up the queue of another
+        self.events = RingBuffer(width = EVENT_WIDTH)
+        self.queues = [self.events]
+        # index into queues for every device id
+        self.device_queues = bytearray(MAX_DEVICES)
+        # events Backend routed here from its MIDI input port this period,
+        # written and read on the JACK thread
+        self.midi_input = RingBuffer(width = INPUT_WIDTH)
+        # offset of the last event written in the current period
+        self.last_offset = 0
+        # events that arrived too late to be played at their offset
+        self.late_events = 0
+        # everything written in the current period, in offset order
+        self.output = OutputBuffer()
+        # capture.Capture everything written goes to, under track number
+        # track, or None
+        self.capture = None
+        self.track = 0
         # looper stuff
+        self.looper = Looper(metronome, self.output)
         self.looper_mode = LooperMode.NORMAL
         self.looper_functions = {
                 LooperMode.NORMAL: self.toggle_loop,
@@ -27,30 +65,149 @@ class Instrument(ABC):
         pass
 
     @abstractmethod
-    def key_pressed(self, key):
+    def key_pressed(self, key, frame, device = 0):
+        '''
+        frame: int
+        JACK frame time at which the key was captured by the driver.
+
+        device: int
+        Id of the input device the key came from.
+        '''
         pass
 
     @abstractmethod
-    def key_released(self, key):
+    def key_released(self, key, frame, device = 0):
+        pass
+
+    def midi_event(self, offset, status, data1, data2):
+        '''
+        JACK thread: a note or controller event from a MIDI input port,
+        at its offset in the current period. Played as it is.
+        '''
+        self.write_event(offset, status, data1, data2)
+
+    def save_state(self):
+        '''
+        What the instrument keeps between sessions besides its loops, as
+        bytes. Called from the control thread.
+        '''
+        return b""
+
+    def restore_state(self, view):
+        '''
+        Take back what save_state() returned, from a view of a session
+        file. Called from the control thread before the JACK client is
+        active.
+        '''
         pass
 
+    def overflows(self):
+        '''
+        Number of events dropped because a queue to process() was full.
+        '''
+        return sum(queue.overflows for queue in self.queues) + self.midi_input.overflows
+
+    def attach(self, device):
+        '''
+        Give a device a queue of its own. Called from the control thread
+        when a device is routed to this instrument, the new queue is only
+        published once it is complete.
+        '''
+        if self.device_queues[device] == 0 and device != 0:
+            self.queues.append(RingBuffer(width = EVENT_WIDTH))
+            self.device_queues[device] = len(self.queues) - 1
+
+    def queue_event(self, status, data1, data2, frame, device = 0):
+        # encode the message here rather than on the JACK thread
+        midi.message(status, data1, data2)
+        self.queues[self.device_queues[device]].push(status, data1, data2, frame)
+
+    def clear_buffer(self):
+        '''
+        Start a new period. Every process() begins with this and ends with
+        flush().
+        '''
+        self.midi_port.clear_buffer()
+        self.output.clear()
+        self.last_offset = 0
+
+    def write_event(self, offset, status, data1, data2):
+        '''
+        Play a live event, recording it if a loop is being recorded.
+        '''
+        self.output.insert(offset, status, data1, data2)
+        self.looper.record(offset, status, data1, data2)
+
+    def flush(self, no_frames):
+        '''
+        Mix in the MIDI input and the loops and write the whole period to
+        the port.
+        '''
+        midi_input = self.midi_input
+        while not midi_input.empty():
+            self.midi_event(midi_input.peek(0), midi_input.peek(1),
+                    midi_input.peek(2), midi_input.peek(3))
+            midi_input.advance()
+        self.looper.process(no_frames)
+        self.output.write_to(self.midi_port)
+        if self.capture is not None:
+            self.capture.record(self.track, self.metronome.period_start, self.output)
+
+    def frame_offset(self, frame, no_frames):
+        '''
+        Map the JACK frame time of a key to an offset in the current period.
+
+        Keys are played exactly one period after they were captured, which
+        keeps the spacing between them intact. Keys older than that are
+        clamped to the start of the period and counted as late. The offsets
+        of one queue never go backwards within a period, so a key is never
+        played before the key it followed.
+        '''
+        offset = ((frame + no_frames - self.metronome.period_start
+                + FRAME_TIME_HALF) & FRAME_TIME_MASK) - FRAME_TIME_HALF
+        if offset < 0:
+            self.late_events += 1
+            offset = 0
+        elif offset >= no_frames:
+            offset = no_frames - 1
+        if offset < self.last_offset:
+            offset = self.last_offset
+        self.last_offset = offset
+        return offset
+
+    def play_events(self, no_frames):
+        '''
+        Write every queued event at the offset its key was captured at.
+        Events of different devices are merged in offset order by the
+        output buffer.
+        '''
+        for events in self.queues:
+            self.last_offset = 0
+            while not events.empty():
+                offset = self.frame_offset(events.peek(3), no_frames)
+                self.write_event(offset, events.peek(0), events.peek(1), events.peek(2))
+                events.advance()
+
     def set_looper_mode(self, mode):
         self.looper_mode = mode
 
+    def normal_mode(self):
+        self.looper_mode = LooperMode.NORMAL
+
     def toggle_loop(self, loop):
-        pass
+        self.looper.command(looper.TOGGLE, loop)
 
     def record_loop(self, loop):
-        pass
+        self.looper.command(looper.RECORD, loop)
 
     def delete_loop(self, loop):
-        pass
+        self.looper.command(looper.DELETE, loop)
 
     def half_loop(self, loop):
-        pass
+        self.looper.command(looper.HALF, loop)
 
     def double_loop(self, loop):
-        pass
+        self.looper.command(looper.DOUBLE, loop)
 
     def loop(self, loop_number):
         self.looper_functions[self.looper_mode](loop_number)
@@ -1,113 +1,98 @@
 import jack
-from queue import Queue
 
 from instruments.instrument import Instrument
+from layout import Layout, NO_VALUE
 
 PLAY_NOTE_EVENT = 144
 STOP_NOTE_EVENT = 128
 DEFAULT_VEL = 63
 
 class Keyboard(Instrument):
-    def __init__(self, port, samplerate):
-        super().__init__(port, samplerate)
-        self.toBePlayed = Queue()
-        self.toBeStopped = Queue()
-
     def process(self, no_frames):
-        self.midi_port.clear_buffer()
-        while not self.toBePlayed.empty():
-            note = self.toBePlayed.get()
-            # note 0 means all notes off
-            if note == 0:
-                self.midi_port.write_midi_event(0, (176, 123, 0))
-            else:
-                self.midi_port.write_midi_event(0, 
-                        (PLAY_NOTE_EVENT, note, DEFAULT_VEL))
-        while not self.toBeStopped.empty():
-            self.midi_port.write_midi_event(0, 
-                    (STOP_NOTE_EVENT, self.toBeStopped.get(), DEFAULT_VEL))
+        self.clear_buffer()
+        self.play_events(no_frames)
+        self.flush(no_frames)
 
-    def key_pressed(self, key):
-        try:
-            self.toBePlayed.put(keyboard_mappings[key])
-        except KeyError:
-            pass
+    def key_pressed(self, key, frame, device = 0):
+        note = layout.note[key]
+        if note != NO_VALUE:
+            self.queue_event(PLAY_NOTE_EVENT, note, DEFAULT_VEL, frame, device)
 
-    def key_released(self, key):
-        try:
-            self.toBeStopped.put(keyboard_mappings[key])
-        except KeyError:
-            pass
+    def key_released(self, key, frame, device = 0):
+        note = layout.note[key]
+        if note != NO_VALUE:
+            self.queue_event(STOP_NOTE_EVENT, note, DEFAULT_VEL, frame, device)
 
-keyboard_mappings = {
+# label and midi note of every key
+layout = Layout(("note",), {
         # C-z
-        29: 36,
+        29: (" C  ", 36),
         # C#-s
-        22: 37,
+        22: (" C# ", 37),
         # D-x
-        27: 38,
+        27: (" D  ", 38),
         # D#-d
-        7: 39,
+        7: (" D# ", 39),
         # E-c
-        6: 40,
+        6: (" E  ", 40),
         # F-v
-        25: 41,
+        25: (" F  ", 41),
         # F#-g
-        10: 42,
+        10: (" F# ", 42),
         # G-b
-        5: 43,
+        5: (" G  ", 43),
         # G#-h
-        11: 44,
+        11: (" G# ", 44),
         # A-n
-        17: 45,
+        17: (" A  ", 45),
         # A#-j
-        13: 46,
+        13: (" A# ", 46),
         # B-m
-        16: 47,
+        16: (" B  ", 47),
         # C-,
-        54: 48,
+        54: (" C  ", 48),
         # C#-l
-        15: 49,
+        15: (" C# ", 49),
         # D-.
-        55: 50,
+        55: (" D  ", 50),
         # D#-;
-        51: 51,
+        51: (" D# ", 51),
         # E-/
-        56: 52,
+        56: (" E  ", 52),
         # upper keyboard
         # F-q
-        20: 53,
+        20: (" F  ", 53),
         # F#-2
-        31: 54,
+        31: (" F# ", 54),
         # G-w
-        26: 55,
+        26: (" G  ", 55),
         # G#-3
-        32: 56,
+        32: (" G# ", 56),
         # A-e
-        8: 57,
+        8: (" A  ", 57),
         # A#-4
-        33: 58,
+        33: (" A# ", 58),
         # B-r
-        21: 59,
+        21: (" B  ", 59),
         # C-t
-        23: 60,
+        23: (" C  ", 60),
         # C#-6
-        35: 61,
+        35: (" C# ", 61),
         # D-y
-        28: 62,
+        28: (" D  ", 62),
         # D#-7
-        36: 63,
+        36: (" D# ", 63),
         # E-u
-        24: 64,
+        24: (" E  ", 64),
         # F-i
-        12: 65,
+        12: (" F  ", 65),
         # F#-9
-        38: 66,
+        38: (" F# ", 66),
         # G-o
-        18: 67,
+        18: (" G  ", 67),
         # G#-0
-        39: 68,
+        39: (" G# ", 68),
         # A-p
-        19: 69
-}
+        19: (" A  ", 69)
+        })
 
@@ -0,0 +1,242 @@
+'''
+Render-ahead of pattern instruments.
+
+A worker thread predicts the timeline of the next few periods, assuming the
+transport keeps rolling at the tempo the last one was played at, and renders
+the pattern steps that fall into each of them into a preallocated slot. The
+JACK thread then only has to find the slot of the period it is in and copy
+its events out, however many samples the pattern has.
+
+A slot is keyed on the transport frame of its period, the period size and
+the range of steps the worker predicted for it. It is only used if the
+period actually being played starts on the same frame and the scheduler
+puts the same steps into it. The offsets are not part of the prediction:
+a slot holds, for every event, which of the period's steps it belongs to,
+and the instrument takes the offsets from its own scheduler. A timeline
+that is rebuilt from another timebase master's bar/beat/tick every period
+never matches a prediction to the last bit, but it does play the same
+steps. Anything else (a relocation, the worker falling behind) means the
+instrument renders the period itself, as it always did, and the worker
+starts over from there. Editing a step invalidates only the slots that
+play that step.
+'''
+import threading
+import time
+from array import array
+
+from instruments.scheduler import schedule, MAX_STEPS_PER_PERIOD
+
+# periods rendered ahead
+LOOKAHEAD_PERIODS = 8
+# events one slot holds
+SLOT_CAPACITY = 256
+# how long the worker sleeps while the transport is stopped, in seconds
+IDLE_INTERVAL = 0.01
+
+# fields of the anchor, the period the JACK thread played last
+FRAME = 0
+BEAT_POSITION = 1
+FRAMES_PER_BEAT = 2
+NO_FRAMES = 3
+LAST_STEP = 4
+ROLLING = 5
+ANCHOR_FIELDS = 6
+
+class Slot:
+    def __init__(self, capacity = SLOT_CAPACITY):
+        self.capacity = capacity
+        # the period the slot was rendered for: its transport frame, size,
+        # first step and number of steps
+        self.frame = -1
+        self.no_frames = 0
+        self.first_step = -1
+        self.step_count = 0
+        # index of the step within the period, and midi bytes, of every
+        # event, three bytes each
+        self.indices = array("l", [0] * capacity)
+        self.data = bytearray(3 * capacity)
+        self.count = 0
+        # bit n set if pattern step n plays in this slot
+        self.steps = 0
+        self.valid = False
+        # odd while the worker is writing the slot
+        self.sequence = 0
+        # bumped by every edit, a render that raced one is thrown away
+        self.generation = 0
+
+    def matches(self, frame, no_frames, first_step, step_count):
+        return (self.valid and self.frame == frame
+                and self.no_frames == no_frames
+                and self.first_step == first_step
+                and self.step_count == step_count)
+
+class Lookahead(threading.Thread):
+    def __init__(self, samplerate, steps_per_beat, pattern_steps, compiled,
+            periods = LOOKAHEAD_PERIODS):
+        '''
+        pattern_steps: int
+        Length of the pattern in steps.
+
+        compiled: list
+        The midi bytes every pattern step plays, shared with the instrument
+        and replaced step by step when it is edited.
+        '''
+        super().__init__(daemon = True)
+        self.samplerate = samplerate
+        self.steps_per_beat = steps_per_beat
+        self.pattern_steps = pattern_steps
+        self.compiled = compiled
+        self.slots = [Slot() for i in range(0, periods)]
+        # written by the JACK thread, odd sequence while a write is in
+        # progress
+        self.anchor = array("d", [0.0] * ANCHOR_FIELDS)
+        self.sequence = 0
+        self.stopped = False
+        # periods with steps in them played from a slot, and rendered by
+        # the instrument
+        self.hits = 0
+        self.misses = 0
+        self.offsets = array("l", [0] * MAX_STEPS_PER_PERIOD)
+        self.step_numbers = array("l", [0] * MAX_STEPS_PER_PERIOD)
+
+    def publish(self, metronome, no_frames, last_step):
+        '''
+        JACK thread: the period just played, for the worker to predict from.
+        '''
+        anchor = self.anchor
+        self.sequence += 1
+        anchor[FRAME] = metronome.frame
+        anchor[BEAT_POSITION] = metronome.beat_position
+        anchor[FRAMES_PER_BEAT] = metronome.frames_per_beat
+        anchor[NO_FRAMES] = no_frames
+        anchor[LAST_STEP] = -1 if last_step is None else last_step
+        anchor[ROLLING] = 1 if metronome.rolling else 0
+        self.sequence += 1
+
+    def find(self, metronome, no_frames, first_step, step_count):
+        '''
+        JACK thread: the slot rendered for the current period, in which the
+        scheduler put step_count steps from first_step on, and its
+        sequence, to be checked with intact() once it has been copied, or
+        None.
+        '''
+        if metronome.continuous:
+            for slot in self.slots:
+                sequence = slot.sequence
+                if not sequence & 1 and slot.matches(metronome.frame, no_frames,
+                        first_step, step_count):
+                    return slot, sequence
+        self.misses += 1
+        return None
+
+    def intact(self, slot, sequence):
+        '''
+        JACK thread: True if the worker left the slot alone while it was
+        being copied.
+        '''
+        if slot.sequence == sequence:
+            self.hits += 1
+            return True
+        self.misses += 1
+        return False
+
+    def invalidate(self, step):
+        '''
+        Control thread: a pattern step has been edited.
+        '''
+        for slot in self.slots:
+            if slot.steps & (1 << step):
+                slot.generation += 1
+                slot.valid = False
+
+    def read_anchor(self):
+        while True:
+            sequence = self.sequence
+            anchor = self.anchor.tolist()
+            if not sequence & 1 and self.sequence == sequence:
+                return anchor
+
+    def run(self):
+        while not self.stopped:
+            time.sleep(self.step())
+
+    def step(self):
+        '''
+        One round of rendering from the latest anchor. Returns how long to
+        wait before the next one.
+        '''
+        anchor = self.read_anchor()
+        no_frames = int(anchor[NO_FRAMES])
+        if not anchor[ROLLING] or no_frames == 0:
+            return IDLE_INTERVAL
+        self.render_ahead(anchor, no_frames)
+        # twice a period keeps a full window ahead of the JACK thread
+        return no_frames / self.samplerate / 2
+
+    def render_ahead(self, anchor, no_frames):
+        frame = int(anchor[FRAME])
+        beat_position = anchor[BEAT_POSITION]
+        frames_per_beat = anchor[FRAMES_PER_BEAT]
+        last_step = None if anchor[LAST_STEP] < 0 else int(anchor[LAST_STEP])
+        for k in range(0, len(self.slots)):
+            # advance as Metronome.update_timeline does for a continuous
+            # period
+            beat_position += no_frames / frames_per_beat
+            frame += no_frames
+            count = schedule(beat_position * self.steps_per_beat,
+                    frames_per_beat / self.steps_per_beat, no_frames, last_step,
+                    self.offsets, self.step_numbers)
+            first_step = self.step_numbers[0] if count > 0 else -1
+            slot = self.slot_for(frame)
+            if not slot.matches(frame, no_frames, first_step, count):
+                self.render(slot, frame, no_frames, count)
+            if count > 0:
+                last_step = self.step_numbers[count - 1]
+
+    def slot_for(self, frame):
+        '''
+        The slot rendered for frame if there is one, otherwise the one with
+        the oldest period, which has been played already.
+        '''
+        oldest = self.slots[0]
+        for slot in self.slots:
+            if slot.frame == frame:
+                return slot
+            if slot.frame < oldest.frame:
+                oldest = slot
+        return oldest
+
+    def render(self, slot, frame, no_frames, count):
+        '''
+        Render the count steps schedule() left in step_numbers.
+        '''
+        generation = slot.generation
+        slot.sequence += 1
+        slot.valid = False
+        slot.frame = frame
+        slot.no_frames = no_frames
+        slot.first_step = self.step_numbers[0] if count > 0 else -1
+        slot.step_count = count
+        # the steps the slot plays are published before their bytes are
+        # read, so an edit of one of them from now on invalidates the slot
+        steps = 0
+        for i in range(0, count):
+            steps |= 1 << (self.step_numbers[i] % self.pattern_steps)
+        slot.steps = steps
+        events = 0
+        for i in range(0, count):
+            step = self.step_numbers[i] % self.pattern_steps
+            messages = self.compiled[step]
+            for j in range(0, len(messages), 3):
+                if events == slot.capacity:
+                    break
+                slot.indices[events] = i
+                slot.data[3 * events:3 * events + 3] = messages[j:j + 3]
+                events += 1
+        slot.count = events
+        # an edit while rendering leaves the slot invalid for the next round
+        slot.valid = slot.generation == generation
+        slot.sequence += 1
+
+    def stop(self):
+        self.stopped = True
@@ -0,0 +1,339 @@
+import math
+import struct
+from array import array
+from bisect import bisect_left
+
+from instruments import midi
+from ringbuffer import RingBuffer
+
+LOOP_SLOTS = 9
+# events one loop slot can hold
+LOOP_CAPACITY = 2048
+
+# commands sent from the control thread to the JACK thread
+TOGGLE = 0
+RECORD = 1
+DELETE = 2
+HALF = 3
+DOUBLE = 4
+
+NOTE_ON = midi.NOTE_ON
+NOTE_OFF = midi.NOTE_OFF
+CHANNELS = 16
+NOTES = 128
+
+# note ons without their note off, by channel and note, while a loop is
+# being cut. Only used on the JACK thread and always left zeroed.
+held = bytearray(CHANNELS * NOTES)
+
+# a saved loop: events, length, start, channels, playing, followed by its
+# frames, statuses and data bytes
+LOOP_STATE = struct.Struct("<IqqIB")
+
+# encode the note offs silence() and close_notes() send up front
+for channel in range(0, CHANNELS):
+    for note in range(0, NOTES):
+        midi.message(NOTE_OFF + channel, note, 0)
+
+class Loop:
+    '''
+    One looper slot: a preallocated array of MIDI events sorted by their
+    position in the loop, in frames from the bar the recording started in.
+    '''
+    def __init__(self, capacity = LOOP_CAPACITY):
+        self.capacity = capacity
+        self.frames = array("q", bytes(8 * capacity))
+        self.status = array("B", bytes(capacity))
+        self.data1 = array("B", bytes(capacity))
+        self.data2 = array("B", bytes(capacity))
+        self.count = 0
+        # length in frames, always a whole number of bars once recorded
+        self.length = 0
+        # transport frame the loop is anchored to
+        self.start = 0
+        self.playing = False
+        self.recording = False
+        # next event to play and the loop position it was sought for
+        self.cursor = 0
+        self.position = -1
+        # bitmask of the midi channels the loop plays on
+        self.channels = 0
+        # note ons played without their note off yet, by channel and note
+        self.sounding = bytearray(CHANNELS * NOTES)
+        # events dropped because the slot was full
+        self.overflows = 0
+
+    def clear(self):
+        self.count = 0
+        self.length = 0
+        self.playing = False
+        self.recording = False
+        self.position = -1
+        self.channels = 0
+
+    def append(self, position, status, data1, data2):
+        if self.count == self.capacity:
+            self.overflows += 1
+            return
+        i = self.count
+        frames = self.frames
+        # live events of one period can arrive out of order, one device
+        # queue after the other, so insert from the end like OutputBuffer.
+        # Events at the same position keep the order they came in.
+        while i > 0 and frames[i - 1] > position:
+            frames[i] = frames[i - 1]
+            self.status[i] = self.status[i - 1]
+            self.data1[i] = self.data1[i - 1]
+            self.data2[i] = self.data2[i - 1]
+            i -= 1
+        frames[i] = position
+        self.status[i] = status
+        self.data1[i] = data1
+        self.data2[i] = data2
+        self.channels |= 1 << (status & 15)
+        self.count += 1
+
+    def save(self):
+        '''
+        The loop as bytes, for a session file. Called from the control
+        thread, a loop still being recorded is saved empty.
+        '''
+        count = 0 if self.recording else self.count
+        return b"".join((
+            LOOP_STATE.pack(count, self.length if count else 0, self.start,
+                self.channels, self.playing and count > 0),
+            memoryview(self.frames)[0:count].tobytes(),
+            memoryview(self.status)[0:count].tobytes(),
+            memoryview(self.data1)[0:count].tobytes(),
+            memoryview(self.data2)[0:count].tobytes()))
+
+    def restore(self, view):
+        '''
+        Copy a saved loop back in from a view of a session file, before the
+        JACK client is active. Returns the bytes the loop took up.
+        '''
+        count, length, start, channels, playing = LOOP_STATE.unpack_from(view)
+        count = min(count, self.capacity)
+        position = LOOP_STATE.size
+        memoryview(self.frames)[0:count] = view[position:position + 8 * count].cast("q")
+        position += 8 * count
+        for events in (self.status, self.data1, self.data2):
+            memoryview(events)[0:count] = view[position:position + count]
+            position += count
+        self.count = count
+        self.length = length
+        self.start = start
+        self.channels = channels
+        self.playing = bool(playing)
+        self.recording = False
+        self.position = -1
+        return position
+
+    def half(self):
+        self.length //= 2
+        self.count = bisect_left(self.frames, self.length, 0, self.count)
+        self.position = -1
+        self.close_notes()
+
+    def close_notes(self):
+        '''
+        End every note the loop leaves held with a note off on its last
+        frame, so a note whose note off was cut away does not hang on every
+        repeat.
+        '''
+        status = self.status
+        data1 = self.data1
+        kept = self.count
+        for i in range(0, kept):
+            kind = status[i] & 0xf0
+            note = (status[i] & 15) * NOTES + data1[i]
+            if kind == NOTE_ON and self.data2[i] > 0:
+                if held[note] < 255:
+                    held[note] += 1
+            elif (kind == NOTE_OFF or kind == NOTE_ON) and held[note] > 0:
+                held[note] -= 1
+        for i in range(0, kept):
+            if status[i] & 0xf0 == NOTE_ON and self.data2[i] > 0:
+                note = (status[i] & 15) * NOTES + data1[i]
+                if held[note] > 0:
+                    held[note] -= 1
+                    self.append(self.length - 1, NOTE_OFF + (status[i] & 15), data1[i], 0)
+
+    def double(self):
+        count = self.count
+        if 2 * count > self.capacity:
+            self.overflows += 1
+            return
+        for i in range(0, count):
+            self.frames[count + i] = self.frames[i] + self.length
+            self.status[count + i] = self.status[i]
+            self.data1[count + i] = self.data1[i]
+            self.data2[count + i] = self.data2[i]
+        self.count = 2 * count
+        self.length *= 2
+        self.position = -1
+
+    def play(self, position, no_frames, output):
+        '''
+        Insert every event between position and position + no_frames into
+        output, wrapping around the end of the loop. Only a jump in position
+        costs a binary search, otherwise the cursor carries on from where
+        the last period left it.
+        '''
+        if position != self.position:
+            self.cursor = bisect_left(self.frames, position, 0, self.count)
+        frames = self.frames
+        status = self.status
+        data1 = self.data1
+        data2 = self.data2
+        sounding = self.sounding
+        cursor = self.cursor
+        end = position + no_frames
+        base = -position
+        while True:
+            stop = end if end < self.length else self.length
+            while cursor < self.count and frames[cursor] < stop:
+                output.insert(frames[cursor] + base,
+                        status[cursor], data1[cursor], data2[cursor])
+                kind = status[cursor] & 0xf0
+                if kind == NOTE_ON or kind == NOTE_OFF:
+                    note = (status[cursor] & 15) * NOTES + data1[cursor]
+                    if kind == NOTE_ON and data2[cursor] > 0:
+                        if sounding[note] < 255:
+                            sounding[note] += 1
+                    elif sounding[note] > 0:
+                        sounding[note] -= 1
+                cursor += 1
+            if end < self.length:
+                break
+            # wrap around to the start of the loop
+            end -= self.length
+            base += self.length
+            cursor = 0
+        self.cursor = cursor
+        self.position = end
+
+class Looper:
+    '''
+    The loop slots of one instrument. The control thread only queues
+    commands, every change to the slots happens on the JACK thread at the
+    end of a period.
+    '''
+    def __init__(self, metronome, output):
+        self.metronome = metronome
+        self.output = output
+        self.loops = []
+        for i in range(0, LOOP_SLOTS):
+            self.loops.append(Loop())
+        self.commands = RingBuffer(width = 2)
+        # the slot currently being recorded into
+        self.recording = None
+
+    def save(self):
+        return b"".join(loop.save() for loop in self.loops)
+
+    def restore(self, view):
+        '''
+        Restore every slot from a view of a session file, returns the bytes
+        they took up.
+        '''
+        position = 0
+        for loop in self.loops:
+            position += loop.restore(view[position:])
+        return position
+
+    def command(self, command, slot):
+        self.commands.push(command, slot)
+
+    def record(self, offset, status, data1, data2):
+        '''
+        Called for every live event the instrument writes.
+        '''
+        loop = self.recording
+        if loop is None or not self.metronome.rolling:
+            return
+        loop.append(self.metronome.frame + offset - loop.start, status, data1, data2)
+
+    def process(self, no_frames):
+        commands = self.commands
+        while not commands.empty():
+            self.apply(commands.peek(0), commands.peek(1))
+            commands.advance()
+
+        metronome = self.metronome
+        if not metronome.rolling:
+            return
+        for loop in self.loops:
+            if loop.playing:
+                loop.play((metronome.frame - loop.start) % loop.length,
+                        no_frames, self.output)
+
+    def apply(self, command, slot):
+        loop = self.loops[slot]
+        if command == RECORD:
+            if loop is self.recording:
+                self.stop_recording()
+                return
+            if self.recording is not None:
+                self.stop_recording()
+            self.silence(loop)
+            loop.clear()
+            loop.start = self.metronome.bar_start()
+            loop.recording = True
+            self.recording = loop
+        elif command == TOGGLE:
+            if loop is self.recording:
+                self.stop_recording()
+            elif loop.length > 0:
+                if loop.playing:
+                    self.silence(loop)
+                loop.playing = not loop.playing
+                loop.position = -1
+        elif command == DELETE:
+            if loop is self.recording:
+                self.recording = None
+            self.silence(loop)
+            loop.clear()
+        elif loop is self.recording or loop.length == 0:
+            # halving or doubling only makes sense for a finished loop
+            return
+        elif command == HALF:
+            self.silence(loop)
+            loop.half()
+            if loop.length == 0:
+                loop.clear()
+        elif command == DOUBLE:
+            loop.double()
+
+    def stop_recording(self):
+        '''
+        Round the recording to the nearest bar line and start playing it.
+        The loop is at least a bar long and never cuts off the last event
+        recorded, so a stop pressed just after the downbeat does not add an
+        empty bar.
+        '''
+        loop = self.recording
+        self.recording = None
+        loop.recording = False
+        frames_per_bar = self.metronome.frames_per_bar()
+        bars = max(1, round((self.metronome.frame - loop.start) / frames_per_bar))
+        if loop.count > 0:
+            bars = max(bars, math.ceil((loop.frames[loop.count - 1] + 1) / frames_per_bar))
+        loop.length = round(bars * frames_per_bar)
+        loop.playing = loop.count > 0
+        loop.position = -1
+        if not loop.playing:
+            loop.clear()
+
+    def silence(self, loop):
+        '''
+        End every note the loop played and has not ended yet. Notes played
+        live on the same channels are left alone.
+        '''
+        sounding = loop.sounding
+        for channel in range(0, CHANNELS):
+            if loop.channels & (1 << channel):
+                for note in range(channel * NOTES, (channel + 1) * NOTES):
+                    if sounding[note] > 0:
+                        sounding[note] = 0
+                        self.output.insert(0, NOTE_OFF + channel, note - channel * NOTES, 0)
@@ -0,0 +1,23 @@
+'''
+Encoded MIDI messages, shared by every instrument.
+
+Each (status, data1, data2) is turned into an immutable bytes object once
+and reused from then on, so writing an event to a JACK port never builds a
+tuple or converts one. Instruments warm the cache from the control thread
+(queue_event, DrumMachine.compile_step) before the JACK thread asks for a
+message, a message first seen on the JACK thread costs one allocation.
+'''
+NOTE_OFF = 128
+NOTE_ON = 144
+CONTROL_CHANGE = 176
+
+# the cache, keyed by the message's three bytes as one int
+messages = {}
+
+def message(status, data1, data2):
+    key = status << 16 | data1 << 8 | data2
+    encoded = messages.get(key)
+    if encoded is None:
+        encoded = bytes((status, data1, data2))
+        messages[key] = encoded
+    return encoded
@@ -0,0 +1,66 @@
+from array import array
+
+from instruments.midi import message
+
+# events one instrument can write in a single period
+OUTPUT_CAPACITY = 512
+
+class OutputBuffer:
+    '''
+    Collects the MIDI events of one period in offset order before they are
+    written to the JACK port, which only accepts events in time order.
+    Live events arrive already sorted, loop playback is merged in with an
+    insertion from the end, so the cost stays proportional to the number
+    of events in the period.
+
+    Events are kept as the cached bytes of their message, which the port
+    takes as they are.
+    '''
+    def __init__(self, capacity = OUTPUT_CAPACITY, reserve = False):
+        '''
+        reserve: bool
+        Write through reserve_midi_event instead of write_midi_event.
+        '''
+        self.capacity = capacity
+        self.offsets = array("l", [0] * capacity)
+        self.messages = [b""] * capacity
+        self.count = 0
+        self.reserve = reserve
+        # events dropped because the buffer was full
+        self.overflows = 0
+
+    def clear(self):
+        self.count = 0
+
+    def insert(self, offset, status, data1, data2):
+        if self.count == self.capacity:
+            self.overflows += 1
+            return
+        i = self.count
+        offsets = self.offsets
+        messages = self.messages
+        # events at the same offset keep the order they were inserted in
+        while i > 0 and offsets[i - 1] > offset:
+            offsets[i] = offsets[i - 1]
+            messages[i] = messages[i - 1]
+            i -= 1
+        offsets[i] = offset
+        messages[i] = message(status, data1, data2)
+        self.count += 1
+
+    def write_to(self, port):
+        '''
+        Write the whole period in one pass.
+        '''
+        offsets = self.offsets
+        messages = self.messages
+        if self.reserve:
+            reserve = port.reserve_midi_event
+            for i in range(0, self.count):
+                buffer = reserve(offsets[i], len(messages[i]))
+                if buffer:
+                    buffer[:] = messages[i]
+        else:
+            write = port.write_midi_event
+            for i in range(0, self.count):
+                write(offsets[i], messages[i])
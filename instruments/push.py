@@ -1,73 +1,78 @@
 import jack
-from queue import Queue
 
 from instruments.instrument import Instrument
+from instruments.scheduler import StepScheduler
+from layout import Layout, NO_VALUE
 
 PLAY_NOTE_EVENT = 144
 STOP_NOTE_EVENT = 128
 DEFAULT_VEL = 63
 BASE_NOTE = 60
-BEATS_PER_BAR=8
+STEPS_PER_BEAT=2
 
 class Push(Instrument):
 
-    def __init__(self, port, samplerate):
-        super().__init__(port, samplerate)
-        self.bpm = 30.0
-        self.frames_since = 0
-        self.frames_per_beat = 60 / self.bpm / BEATS_PER_BAR * samplerate
-        self.frames_until = self.frames_per_beat
+    def __init__(self, port, samplerate, metronome):
+        super().__init__(port, samplerate, metronome)
+        self.scheduler = StepScheduler(metronome, STEPS_PER_BEAT)
         self.active_samples = []
-        self.toBePlayed = Queue()
-        self.toBeStopped = Queue()
 
     def process(self, no_frames):
-        self.midi_port.clear_buffer()
-        if self.frames_until >= no_frames:
-            self.frames_since += no_frames
-            self.frames_until -= no_frames
-            return
-        while not self.toBePlayed.empty():
-            channel = self.toBePlayed.get()
-            self.midi_port.write_midi_event(self.frames_until, 
-                    (PLAY_NOTE_EVENT + channel, BASE_NOTE, DEFAULT_VEL))
-        while not self.toBeStopped.empty():
-            channel = self.toBeStopped.get()
-            self.midi_port.write_midi_event(self.frames_until,
-                    (STOP_NOTE_EVENT + channel, BASE_NOTE, DEFAULT_VEL))
-        self.frames_since = int(no_frames - self.frames_until)
-        self.frames_until = int(self.frames_per_beat - self.frames_since)
+        self.clear_buffer()
+        if self.scheduler.advance(no_frames) > 0:
+            # launches are quantised to the next step, the key timestamp is not used
+            offset = self.scheduler.offsets[0]
+            for events in self.queues:
+                while not events.empty():
+                    self.write_event(offset, events.peek(0), events.peek(1), events.peek(2))
+                    events.advance()
+        self.flush(no_frames)
 
-    def key_pressed(self, key):
+    def key_pressed(self, key, frame, device = 0):
+        sample = layout.sample[key]
+        if sample == NO_VALUE:
+            return
         if key not in self.active_samples:
-            self.toBePlayed.put(sample_mappings[key])
+            self.queue_event(PLAY_NOTE_EVENT + sample,
+                    BASE_NOTE, DEFAULT_VEL, frame, device)
             self.active_samples.append(key)
         else:
-            self.toBeStopped.put(sample_mappings[key])
+            self.queue_event(STOP_NOTE_EVENT + sample,
+                    BASE_NOTE, DEFAULT_VEL, frame, device)
             self.active_samples.remove(key)
 
-    def key_released(self, key):
+    def key_released(self, key, frame, device = 0):
         pass
 
-sample_mappings = {
+    def save_state(self):
+        # the keys of the samples playing
+        return bytes(self.active_samples)
+
+    def restore_state(self, view):
+        # launch them again at the first step
+        for key in view:
+            self.key_pressed(key, 0)
+
+# label of every key and the channel of the sample it launches
+layout = Layout(("sample",), {
         # first row
-        30: 0,
-        31: 1,
-        32: 2,
-        33: 3,
+        30: (" 1  ", 0),
+        31: (" 2  ", 1),
+        32: (" 3  ", 2),
+        33: (" 4  ", 3),
         # second row
-        20: 4,
-        26: 5,
-        8: 6,
-        21: 7,
+        20: (" 5  ", 4),
+        26: (" 6  ", 5),
+        8: (" 7  ", 6),
+        21: (" 8  ", 7),
         # third row
-        4: 8,
-        22: 9,
-        7: 10,
-        9: 11,
+        4: (" 9  ", 8),
+        22: (" 10 ", 9),
+        7: (" 11 ", 10),
+        9: (" 12 ", 11),
         # forth row
-        29: 12,
-        27: 13,
-        6: 14,
-        25: 15
-}
+        29: (" 13 ", 12),
+        27: (" 14 ", 13),
+        6: (" 15 ", 14),
+        25: (" 16 ", 15)
+        })
@@ -0,0 +1,104 @@
+'''
+The instruments palette can play, in headboard order.
+
+They are declared in instruments.ini, one section each:
+
+    [keyboard]
+    label = Keyboard
+    constructor = instruments.keyboard:Keyboard
+    layout = instruments.keyboard:layout
+
+label is what the headboard shows, constructor the class to build and
+layout the layout.Layout of its keys. Without a layout the class's layout
+attribute is used. Instruments installed as packages can add themselves
+through the palette.instruments entry point group, naming their class.
+
+Nothing is imported until an instrument is first selected, so starting
+palette only costs the instruments that are actually played.
+'''
+import configparser
+import importlib
+import os
+
+REGISTRY_FILE = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+        "instruments.ini")
+ENTRY_POINT_GROUP = "palette.instruments"
+
+def resolve(path):
+    '''
+    Import "module:attribute" and return the attribute.
+    '''
+    module, attribute = path.split(":")
+    return getattr(importlib.import_module(module), attribute)
+
+class InstrumentSpec:
+    def __init__(self, name, label, constructor, layout = None):
+        '''
+        constructor: str
+        "module:Class" of the instrument.
+
+        layout: str
+        "module:attribute" of its Layout, or None.
+        '''
+        self.name = name
+        self.label = label
+        self.constructor_path = constructor
+        self.layout_path = layout
+        self.loaded_constructor = None
+        self.loaded_layout = None
+
+    def constructor(self):
+        if self.loaded_constructor is None:
+            self.loaded_constructor = resolve(self.constructor_path)
+        return self.loaded_constructor
+
+    def layout(self):
+        if self.loaded_layout is None:
+            if self.layout_path is not None:
+                self.loaded_layout = resolve(self.layout_path)
+            else:
+                self.loaded_layout = self.constructor().layout
+        return self.loaded_layout
+
+    def __call__(self, port, samplerate, metronome):
+        '''
+        Build the instrument, an InstrumentSpec stands in for its
+        constructor.
+        '''
+        return self.constructor()(port, samplerate, metronome)
+
+def load_registry(path = REGISTRY_FILE):
+    '''
+    Returns the InstrumentSpecs declared in path followed by those of the
+    installed entry points.
+    '''
+    config = configparser.ConfigParser()
+    if not config.read(path):
+        raise FileNotFoundError(path)
+    specs = []
+    for name in config.sections():
+        section = config[name]
+        specs.append(InstrumentSpec(name, section.get("label", name),
+                section["constructor"], section.get("layout")))
+
+    try:
+        from importlib.metadata import entry_points
+        installed = entry_points(group = ENTRY_POINT_GROUP)
+    except (ImportError, TypeError):
+        installed = []
+    declared = set(spec.name for spec in specs)
+    for entry in installed:
+        if entry.name not in declared:
+            specs.append(InstrumentSpec(entry.name, entry.name, entry.value))
+    return specs
+
+def find(specs, name):
+    '''
+    Index of an instrument by name or headboard number.
+    '''
+    if name.isdigit():
+        return int(name)
+    for i in range(0, len(specs)):
+        if specs[i].name == name:
+            return i
+    raise KeyError(name)
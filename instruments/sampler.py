@@ -1,7 +1,7 @@
 import jack
-from queue import Queue
 
 from instruments.instrument import Instrument
+from layout import Layout, NO_VALUE
 
 PLAY_NOTE_EVENT = 144
 STOP_NOTE_EVENT = 128
@@ -10,76 +10,69 @@ DEFAULT_VEL = 63
 
 class Sampler(Instrument):
 
-    def __init__(self, port, samplerate):
-        super().__init__(port, samplerate)
-        self.toBePlayed = Queue()
-        self.toBeStopped = Queue()
+    def __init__(self, port, samplerate, metronome):
+        super().__init__(port, samplerate, metronome)
         self.current_note = DEFAULT_NOTE
 
     def process(self, no_frames):
-        self.midi_port.clear_buffer()
-        while not self.toBePlayed.empty():
-            channel = self.toBePlayed.get()
-            # note 0 means all notes off
-            if channel == -1:
-                self.midi_port.write_midi_event(0, (176, 123, 0))
-            else:
-                self.midi_port.write_midi_event(0, 
-                        (PLAY_NOTE_EVENT + channel, self.current_note, DEFAULT_VEL))
-        while not self.toBeStopped.empty():
-            self.midi_port.write_midi_event(0, 
-                    (STOP_NOTE_EVENT + self.toBeStopped.get(), self.current_note, DEFAULT_VEL))
+        self.clear_buffer()
+        self.play_events(no_frames)
+        self.flush(no_frames)
 
-    def key_pressed(self, key):
-        if key in note_mappings:
-            self.current_note = note_mappings[key]
-        if key in channel_mappings:
-            self.toBePlayed.put(channel_mappings[key])
+    def key_pressed(self, key, frame, device = 0):
+        note = layout.note[key]
+        if note != NO_VALUE:
+            self.current_note = note
+        channel = layout.channel[key]
+        if channel != NO_VALUE:
+            self.queue_event(PLAY_NOTE_EVENT + channel,
+                    self.current_note, DEFAULT_VEL, frame, device)
 
-    def key_released(self, key):
-        if key in note_mappings:
+    def key_released(self, key, frame, device = 0):
+        if layout.note[key] != NO_VALUE:
             self.current_note = DEFAULT_NOTE
-        if key in channel_mappings:
-            self.toBeStopped.put(channel_mappings[key])
+        channel = layout.channel[key]
+        if channel != NO_VALUE:
+            self.queue_event(STOP_NOTE_EVENT + channel,
+                    self.current_note, DEFAULT_VEL, frame, device)
 
-channel_mappings = {
+# label of every key, the channel the sample keys play on and the note the
+# note keys switch the samples to
+layout = Layout(("channel", "note"), {
         # first line
-        30: 0,
-        31: 1,
-        32: 2,
-        33: 3,
+        30: (" 1  ", 0, None),
+        31: (" 2  ", 1, None),
+        32: (" 3  ", 2, None),
+        33: (" 4  ", 3, None),
+        36: (" C4 ", None, DEFAULT_NOTE),
+        37: (" C#4", None, DEFAULT_NOTE + 1),
+        38: (" D4 ", None, DEFAULT_NOTE + 2),
+        39: (" D#4", None, DEFAULT_NOTE + 3),
         # second line
-        20: 4,
-        26: 5,
-        8: 6,
-        21: 7,
+        20: (" 5  ", 4, None),
+        26: (" 6  ", 5, None),
+        8: (" 7  ", 6, None),
+        21: (" 8  ", 7, None),
+        24: (" E4 ", None, DEFAULT_NOTE + 4),
+        12: (" F4 ", None, DEFAULT_NOTE + 5),
+        18: (" F#4", None, DEFAULT_NOTE + 6),
+        19: (" G4 ", None, DEFAULT_NOTE + 7),
         # third line
-        4: 8,
-        22: 9,
-        7: 10,
-        9: 11,
+        4: (" 9  ", 8, None),
+        22: (" 10 ", 9, None),
+        7: (" 11 ", 10, None),
+        9: (" 12 ", 11, None),
+        13: (" G#4", None, DEFAULT_NOTE + 8),
+        14: (" A4 ", None, DEFAULT_NOTE + 9),
+        15: (" A#4", None, DEFAULT_NOTE + 10),
+        51: (" B4 ", None, DEFAULT_NOTE + 11),
         # forth line
-        29: 12,
-        27: 13,
-        6: 14,
-        25: 15,
-}
-
-note_mappings = {
-        36: DEFAULT_NOTE,
-        37: DEFAULT_NOTE + 1,
-        38: DEFAULT_NOTE + 2,
-        39: DEFAULT_NOTE + 3,
-        24: DEFAULT_NOTE + 4,
-        12: DEFAULT_NOTE + 5,
-        18: DEFAULT_NOTE + 6,
-        19: DEFAULT_NOTE + 7,
-        13: DEFAULT_NOTE + 8,
-        14: DEFAULT_NOTE + 9,
-        15: DEFAULT_NOTE + 10,
-        51: DEFAULT_NOTE + 11,
-        16: DEFAULT_NOTE + 12,
-        54: DEFAULT_NOTE + 13,
-        55: DEFAULT_NOTE + 14,
-        56: DEFAULT_NOTE + 15,
-}
+        29: (" 13 ", 12, None),
+        27: (" 14 ", 13, None),
+        6: (" 15 ", 14, None),
+        25: (" 16 ", 15, None),
+        16: (" C5 ", None, DEFAULT_NOTE + 12),
+        54: (" C#5", None, DEFAULT_NOTE + 13),
+        55: (" D5 ", None, DEFAULT_NOTE + 14),
+        56: (" D#5", None, DEFAULT_NOTE + 15)
+        })
@@ -0,0 +1,88 @@
+import math
+from array import array
+
+# more steps than this in one period means the tempo is absurd
+MAX_STEPS_PER_PERIOD = 64
+# slack for floating point error when rounding a boundary up to a frame
+EPSILON = 1e-6
+
+def schedule(position, frames_per_step, no_frames, last_step, offsets, steps):
+    '''
+    Fill offsets and steps with the step boundaries inside a period and
+    return how many there are.
+
+    position: float
+    Position in steps at the start of the period.
+
+    last_step: int
+    Last step handed out by the period before, if this one carries on
+    where it ended, otherwise None.
+    '''
+    step = math.ceil(position)
+    if last_step is not None:
+        # rounding of the transport position can put a boundary on
+        # both sides of a period edge, never play it twice or not at all
+        if step <= last_step:
+            step = last_step + 1
+        elif step == last_step + 2:
+            step = last_step + 1
+
+    count = 0
+    while count < MAX_STEPS_PER_PERIOD:
+        # a step plays on the first frame at or after its boundary
+        offset = math.ceil((step - position) * frames_per_step - EPSILON)
+        if offset >= no_frames:
+            break
+        if offset < 0:
+            offset = 0
+        offsets[count] = offset
+        steps[count] = step
+        count += 1
+        step += 1
+    return count
+
+class StepScheduler:
+    '''
+    Turns the metronome's transport position into the integer frame
+    offsets of every step boundary inside the current period.
+
+    The position is read from the metronome every period, so tempo changes
+    apply at the next period and there is no local counter to drift. After
+    advance() the first count entries of offsets and steps hold the offset
+    and the step number (counted from the start of the transport) of each
+    boundary.
+    '''
+    def __init__(self, metronome, steps_per_beat):
+        self.metronome = metronome
+        self.steps_per_beat = steps_per_beat
+        self.offsets = array("l", [0] * MAX_STEPS_PER_PERIOD)
+        self.steps = array("l", [0] * MAX_STEPS_PER_PERIOD)
+        self.count = 0
+        # last step handed out, None after a stop or a relocation
+        self.last_step = None
+
+    def advance(self, no_frames):
+        '''
+        Called once per period, after the metronome. Returns the number of
+        step boundaries that fall inside the period.
+        '''
+        metronome = self.metronome
+        self.count = 0
+        if not metronome.rolling:
+            self.last_step = None
+            return 0
+
+        self.count = schedule(metronome.beat_position * self.steps_per_beat,
+                metronome.frames_per_beat / self.steps_per_beat, no_frames,
+                self.last_step if metronome.continuous else None,
+                self.offsets, self.steps)
+        if self.count > 0:
+            self.last_step = self.steps[self.count - 1]
+        return self.count
+
+    def nearest_step(self):
+        '''
+        Number of the step boundary closest to the current position, for
+        binding keys to the step they were played on.
+        '''
+        return round(self.metronome.beat_position * self.steps_per_beat)
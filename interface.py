@@ -1,387 +1,198 @@
 import curses
+import threading
 
-from enum import Enum
+from layout import PAD_KEYS, ROWS, COLUMNS
 
 SUBBEATS_PER_BEAT = 4
 
-x_mappings = {
-        30: 1,
-        31: 1,
-        32: 1,
-        33: 1,
-        34: 1,
-        35: 1,
-        36: 1,
-        37: 1,
-        38: 1,
-        39: 1,
-        20: 2,
-        26: 2,
-        8: 2,
-        21: 2,
-        23: 2,
-        28: 2,
-        24: 2,
-        12: 2,
-        18: 2,
-        19: 2,
-        4: 3,
-        22: 3,
-        7: 3,
-        9: 3,
-        10: 3,
-        11: 3,
-        13: 3,
-        14: 3,
-        15: 3,
-        51: 3,
-        29: 4,
-        27: 4,
-        6: 4,
-        25: 4,
-        5: 4,
-        17: 4,
-        16: 4,
-        54: 4,
-        55: 4,
-        56: 4
-}
+# screen layout
+SCREEN_HEIGHT = 11
+SCREEN_WIDTH = 80
+HEADER_ROW = 0
+PAD_LAST_ROW = 4
+BEAT_ROW = 6
+TICK_ROW = 8
+CURSOR_ROW = 10
+LOG_ROW = 10
 
-y_mappings = {
-        30: 1,
-        31: 6,
-        32: 11,
-        33: 16,
-        34: 21,
-        35: 26,
-        36: 31,
-        37: 36,
-        38: 41,
-        39: 46,
-        20: 2,
-        26: 7,
-        8: 12,
-        21: 17,
-        23: 22,
-        28: 27,
-        24: 32,
-        12: 37,
-        18: 42,
-        19: 47,
-        4: 3,
-        22: 8,
-        7: 13,
-        9: 18,
-        10: 23,
-        11: 28,
-        13: 33,
-        14: 38,
-        15: 43,
-        51: 48,
-        29: 4,
-        27: 9,
-        6: 14,
-        25: 19,
-        5: 24,
-        17: 29,
-        16: 34,
-        54: 39,
-        55: 44,
-        56: 49
-}
-
-keyboard_mappings = {
-        30: "    ",
-        31: " F# ",
-        32: " G# ",
-        33: " A# ",
-        34: "    ",
-        35: " C# ",
-        36: " D# ",
-        37: "    ",
-        38: " F# ",
-        39: " G#",
-        20: " F  ",
-        26: " G  ",
-        8: " A  ",
-        21: " B  ",
-        23: " C  ",
-        28: " D  ",
-        24: " E  ",
-        12: " F  ",
-        18: " G  ",
-        19: " A  ",
-        4: "    ",
-        22: " C# ",
-        7: " D# ",
-        9: "    ",
-        10: " F# ",
-        11: " G# ",
-        13: " A# ",
-        14: "    ",
-        15: " C# ",
-        51: " D# ",
-        29: " C  ",
-        27: " D  ",
-        6: " E  ",
-        25: " F  ",
-        5: " G  ",
-        17: " A  ",
-        16: " B  ",
-        54: " C  ",
-        55: " D  ",
-        56: " E  "
-}
-
-sampler_mappings = {
-        30: " 1  ",
-        31: " 2  ",
-        32: " 3  ",
-        33: " 4  ",
-        34: "    ",
-        35: "    ",
-        36: " C4 ",
-        37: " C#4",
-        38: " D4 ",
-        39: " D#4",
-        20: " 5  ",
-        26: " 6  ",
-        8: " 7  ",
-        21: " 8  ",
-        23: "    ",
-        28: "    ",
-        24: " E4 ",
-        12: " F4 ",
-        18: " F#4",
-        19: " G4 ",
-        4: " 9  ",
-        22: " 10 ",
-        7: " 11 ",
-        9: " 12 ",
-        10: "    ",
-        11: "    ",
-        13: " G#4",
-        14: " A4 ",
-        15: " A#4",
-        51: " B4 ",
-        29: " 13 ",
-        27: " 14 ",
-        6: " 15 ",
-        25: " 16 ",
-        5: "    ",
-        17: "    ",
-        16: " C5 ",
-        54: " C#5",
-        55: " D5 ",
-        56: " D#5"
-}
-
-drummachine_mappings = {
-        30: " 1/1",
-        31: " 1/2",
-        32: " 1/4",
-        33: " 1/8",
-        34: "    ",
-        35: "    ",
-        36: "    ",
-        37: "    ",
-        38: "    ",
-        39: "    ",
-        20: " mu ",
-        26: " um ",
-        8: " cl ",
-        21: "    ",
-        23: "    ",
-        28: "    ",
-        24: "    ",
-        12: "    ",
-        18: "    ",
-        19: "    ",
-        4: " RS ",
-        22: " CP ",
-        7: " CB ",
-        9: " CY ",
-        10: " OH ",
-        11: " CH ",
-        13: " CL ",
-        14: " MA ",
-        15: "    ",
-        51: "    ",
-        29: " AC ",
-        27: " BD ",
-        6: " SD ",
-        25: " LT ",
-        5: " MT ",
-        17: " HT ",
-        16: " LC ",
-        54: " MC ",
-        55: " HC ",
-        56: "    "
-}
-
-push_mappings = {
-        30: " 1  ",
-        31: " 2  ",
-        32: " 3  ",
-        33: " 4  ",
-        34: "    ",
-        35: "    ",
-        36: "    ",
-        37: "    ",
-        38: "    ",
-        39: "    ",
-        20: " 5  ",
-        26: " 6  ",
-        8: " 7  ",
-        21: " 8  ",
-        23: "    ",
-        28: "    ",
-        24: "    ",
-        12: "    ",
-        18: "    ",
-        19: "    ",
-        4: " 9  ",
-        22: " 10 ",
-        7: " 11 ",
-        9: " 12 ",
-        10: "    ",
-        11: "    ",
-        13: "    ",
-        14: "    ",
-        15: "    ",
-        51: "    ",
-        29: " 13 ",
-        27: " 14 ",
-        6: " 15 ",
-        25: " 16 ",
-        5: "    ",
-        17: "    ",
-        16: "    ",
-        54: "    ",
-        55: "    ",
-        56: "    "
-}
-
-class Entity(Enum):
-    DRUM_MACHINE = 1,
-    KEYBOARD = 2,
-    SAMPLER = 3,
-    PUSH = 4
-
-entity_names = {
-        Entity.DRUM_MACHINE: " DrumMac ",
-        Entity.KEYBOARD: " Keyboard",
-        Entity.SAMPLER: " Sampler ",
-        Entity.PUSH: "  Push   "
-}
-
-entity_mappings = {
-        Entity.DRUM_MACHINE: drummachine_mappings,
-        Entity.KEYBOARD: keyboard_mappings,
-        Entity.SAMPLER: sampler_mappings,
-        Entity.PUSH: push_mappings
-}
+# width of an instrument's name on the headboard
+NAME_WIDTH = 9
 
 class Interface:
+    '''
+    Paints into a framebuffer model of the screen. Nothing here talks to
+    the terminal except render(), which the render thread calls at a
+    bounded rate: it diffs the framebuffer against what was last drawn and
+    only writes the cells that changed.
+    '''
     def __init__(self, entities):
+        '''
+        entities: list
+        InstrumentSpecs of the instruments, in headboard order.
+        '''
         self.screen = curses.initscr()
         curses.noecho()
         curses.start_color()
 
         self.screen.clear()
         curses.init_pair(1, curses.COLOR_BLACK, curses.COLOR_GREEN)
+        self.highlight = curses.color_pair(1)
+        self.width = min(SCREEN_WIDTH, self.screen.getmaxyx()[1])
+
+        # the framebuffer is shared by the main thread and the render thread
+        self.lock = threading.Lock()
+        # what the next frame should look like and what the terminal shows
+        self.back_chars, self.back_attrs = self.blank_frame()
+        self.front_chars, self.front_attrs = self.blank_frame()
+        self.dirty = False
 
         self.entities = entities
         self.active_entity = 0
+        # pad labels of the active entity
+        self.labels = None
 
         # metronome stuff
         self.beat_type = 0
         self.beats_per_bar = 0
         self.bpm = 0
+        self.active_tick = -1
+
+    def blank_frame(self):
+        chars = []
+        attrs = []
+        for i in range(0, SCREEN_HEIGHT):
+            chars.append([" "] * self.width)
+            attrs.append([0] * self.width)
+        return chars, attrs
+
+    def put(self, y, x, text, attr = 0):
+        '''
+        Write text into the framebuffer, clipped to the screen width.
+        '''
+        chars = self.back_chars[y]
+        attrs = self.back_attrs[y]
+        for i in range(0, min(len(text), self.width - x)):
+            chars[x + i] = text[i]
+            attrs[x + i] = attr
+        self.dirty = True
+
+    def clear_rows(self, first, last):
+        for y in range(first, last + 1):
+            self.put(y, 0, " " * self.width)
 
     def paint_pad(self, active_entity):
-        self.screen.clear()
-        self.active_entity = active_entity
-        # paint the headbar with the active entity highlighted
-        for i in range(0, active_entity):
-            self.screen.addstr("|")
-            self.screen.addstr(entity_names[self.entities[i]])
-        self.screen.addstr(entity_names[self.entities[active_entity]], 
-                curses.color_pair(1))
-        for i in range(active_entity + 1, len(self.entities)):
-            self.screen.addstr("|")
-            self.screen.addstr(entity_names[self.entities[i]])
-        self.screen.addstr("|")
-        
-        # paint the pad
-        maps = entity_mappings[self.entities[active_entity]]
-        for key in maps:
-            self.screen.addstr(x_mappings[key], y_mappings[key], "|" + maps[key])
-
-        # paint the beat and the bpm
-        self.screen.move(5,0)
-        self.screen.addstr("\n")
-        self.screen.addstr("Beat: " + str(self.beats_per_bar) + "/" + str(self.beat_type) + " ")
-        self.screen.addstr("BPM: " + str(self.bpm) + "\n")
-        
-        # paint the ticks
-        self.screen.addstr("-" * (self.beats_per_bar * SUBBEATS_PER_BEAT * 2 + 1))
-        self.screen.addstr("\n")
-        for i in range(0, self.beats_per_bar * SUBBEATS_PER_BEAT):
-            self.screen.addstr("| ")
-        self.screen.addstr("|\n")
-        self.screen.addstr("-" * (self.beats_per_bar * SUBBEATS_PER_BEAT * 2 + 1))
-        self.screen.move(10, 0)
-        self.screen.refresh()
+        with self.lock:
+            self.clear_rows(HEADER_ROW, PAD_LAST_ROW)
+            self.active_entity = active_entity
+            # paint the headbar with the active entity highlighted
+            x = 0
+            for i in range(0, len(self.entities)):
+                self.put(HEADER_ROW, x, "|")
+                name = self.entities[i].label[:NAME_WIDTH - 1].center(NAME_WIDTH)
+                self.put(HEADER_ROW, x + 1, name,
+                        self.highlight if i == active_entity else 0)
+                x += 1 + len(name)
+            self.put(HEADER_ROW, x, "|")
+
+            # paint the pad
+            self.labels = self.entities[active_entity].layout().labels
+            for key in PAD_KEYS:
+                self.put(ROWS[key], COLUMNS[key], "|" + self.labels[key])
+
+            self.paint_beat_data()
+            self.paint_ticks()
 
     def paint_key_on(self, key):
-        maps = entity_mappings[self.entities[self.active_entity]]
-        self.screen.addstr(x_mappings[key], y_mappings[key] + 1, 
-                maps[key], curses.color_pair(1))
-        self.screen.move(10,0)
-        self.screen.refresh()
+        with self.lock:
+            self.put(ROWS[key], COLUMNS[key] + 1, self.labels[key], self.highlight)
 
     def paint_key_off(self, key):
-        maps = entity_mappings[self.entities[self.active_entity]]
-        self.screen.addstr(x_mappings[key], y_mappings[key] + 1, 
-                maps[key], curses.color_pair(0))
-        self.screen.move(10,0)
-        self.screen.refresh()
+        with self.lock:
+            self.put(ROWS[key], COLUMNS[key] + 1, self.labels[key])
 
     def change_beat_data(self, beats_per_bar, beat_type, bpm):
-        if beats_per_bar == self.beats_per_bar and beat_type == self.beat_type and bpm == self.bpm:
-            return
-        self.beats_per_bar = beats_per_bar
-        self.beat_type = beat_type
-        self.bpm = bpm
-        self.screen.move(6,0)
-        self.screen.addstr("Beat: ")
-        self.screen.addstr(str(self.beats_per_bar))
-        self.screen.addstr("/")
-        self.screen.addstr(str(self.beat_type))
-        self.screen.addstr(" BPM: ")
-        self.screen.addstr(str(self.bpm))
-        self.screen.addstr(" " * 10) # wipe the rest of the line
-        self.screen.move(10, 0)
-        self.screen.refresh()
+        with self.lock:
+            if beats_per_bar == self.beats_per_bar and beat_type == self.beat_type and bpm == self.bpm:
+                return
+            resized = beats_per_bar != self.beats_per_bar
+            self.beats_per_bar = beats_per_bar
+            self.beat_type = beat_type
+            self.bpm = bpm
+            self.paint_beat_data()
+            if resized:
+                self.paint_ticks()
 
     def paint_active_tick(self, tick_no):
-        self.screen.move(8,0)
-        for i in range(0, tick_no):
-            self.screen.addstr("| ")
-        self.screen.addstr("|")
-        self.screen.addstr(" ", curses.color_pair(1))
-        for i in range(tick_no + 1, SUBBEATS_PER_BEAT * self.beats_per_bar):
-            self.screen.addstr("| ")
-        self.screen.addstr("|")
-        self.screen.move(10,0)
-        self.screen.refresh()
+        with self.lock:
+            if tick_no == self.active_tick:
+                return
+            if 0 <= self.active_tick < SUBBEATS_PER_BEAT * self.beats_per_bar:
+                self.put(TICK_ROW, 2 * self.active_tick + 1, " ")
+            self.active_tick = tick_no
+            if 0 <= tick_no < SUBBEATS_PER_BEAT * self.beats_per_bar:
+                self.put(TICK_ROW, 2 * tick_no + 1, " ", self.highlight)
+
+    def paint_beat_data(self):
+        self.clear_rows(BEAT_ROW, BEAT_ROW)
+        self.put(BEAT_ROW, 0, "Beat: " + str(self.beats_per_bar) + "/" + str(self.beat_type)
+                + " BPM: " + str(self.bpm))
+
+    def paint_ticks(self):
+        ticks = self.beats_per_bar * SUBBEATS_PER_BEAT
+        self.clear_rows(TICK_ROW - 1, TICK_ROW + 1)
+        self.put(TICK_ROW - 1, 0, "-" * (ticks * 2 + 1))
+        self.put(TICK_ROW, 0, "| " * ticks + "|")
+        self.put(TICK_ROW + 1, 0, "-" * (ticks * 2 + 1))
+        self.active_tick = -1
 
     def log(self, msg):
-        self.screen.addstr(msg)
-        self.screen.move(10,0)
-        self.screen.refresh()
+        with self.lock:
+            self.clear_rows(LOG_ROW, LOG_ROW)
+            self.put(LOG_ROW, 0, msg)
+
+    def render(self):
+        '''
+        Bring the terminal up to date with the framebuffer. Only the render
+        thread calls this.
+        '''
+        with self.lock:
+            if not self.dirty:
+                return
+            for y in range(0, SCREEN_HEIGHT):
+                self.render_row(y)
+            self.dirty = False
+            self.screen.move(CURSOR_ROW, 0)
+            self.screen.noutrefresh()
+        curses.doupdate()
+
+    def render_row(self, y):
+        back_chars = self.back_chars[y]
+        back_attrs = self.back_attrs[y]
+        front_chars = self.front_chars[y]
+        front_attrs = self.front_attrs[y]
+        if back_chars == front_chars and back_attrs == front_attrs:
+            return
+        x = 0
+        while x < self.width:
+            if back_chars[x] == front_chars[x] and back_attrs[x] == front_attrs[x]:
+                x += 1
+                continue
+            # one write for a run of changed cells sharing an attribute
+            start = x
+            attr = back_attrs[x]
+            while (x < self.width and back_attrs[x] == attr
+                    and (back_chars[x] != front_chars[x] or back_attrs[x] != front_attrs[x])):
+                x += 1
+            try:
+                self.screen.addstr(y, start, "".join(back_chars[start:x]), attr)
+            except curses.error:
+                # writing the bottom right corner of the window moves the
+                # cursor off screen, the cell is drawn anyway
+                pass
+        front_chars[:] = back_chars
+        front_attrs[:] = back_attrs
 
     def shutdown(self):
-        curses.echo()
-        curses.endwin()
+        with self.lock:
+            curses.echo()
+            curses.endwin()
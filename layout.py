@@ -0,0 +1,67 @@
+'''
+Where the pad keys are on screen, and what every instrument does with them.
+
+Each instrument declares its keys once, as a Layout: the label painted on
+the key and the values the instrument plays with it. The layout is compiled
+into tables of KEY_CODES slots indexed by key code, which the interface
+paints from and the instruments look their notes and channels up in, with
+NO_VALUE in the slots of keys the instrument does not use.
+'''
+from array import array
+
+# usb hid key codes fit in a byte
+KEY_CODES = 256
+
+# value of a key that does nothing in an instrument
+NO_VALUE = -1
+
+BLANK_LABEL = "    "
+
+# the pad, row by row from the top, as key codes
+PAD = [
+        [30, 31, 32, 33, 34, 35, 36, 37, 38, 39],
+        [20, 26, 8, 21, 23, 28, 24, 12, 18, 19],
+        [4, 22, 7, 9, 10, 11, 13, 14, 15, 51],
+        [29, 27, 6, 25, 5, 17, 16, 54, 55, 56]
+        ]
+PAD_KEYS = [key for row in PAD for key in row]
+# every key is as wide as a label and its border, rows are staggered by one
+KEY_WIDTH = len(BLANK_LABEL) + 1
+
+# screen row and column of every pad key
+ROWS = bytearray(KEY_CODES)
+COLUMNS = bytearray(KEY_CODES)
+for row in range(0, len(PAD)):
+    for i in range(0, len(PAD[row])):
+        ROWS[PAD[row][i]] = row + 1
+        COLUMNS[PAD[row][i]] = i * KEY_WIDTH + row + 1
+
+class Layout:
+    def __init__(self, fields, keys):
+        '''
+        fields: tuple
+        Names of the values every key carries. Each becomes an array
+        attribute of the layout, indexed by key code.
+
+        keys: dict
+        (label, value, ...) for every key the instrument uses, one value per
+        field, None for a field the key does not use.
+        '''
+        self.fields = fields
+        self.labels = [BLANK_LABEL] * KEY_CODES
+        tables = [array("h", [NO_VALUE] * KEY_CODES) for field in fields]
+        for key in keys:
+            self.labels[key] = keys[key][0]
+            for i in range(0, len(fields)):
+                value = keys[key][i + 1]
+                if value is not None:
+                    tables[i][key] = value
+        for i in range(0, len(fields)):
+            setattr(self, fields[i], tables[i])
+
+    def keys(self, field):
+        '''
+        The key codes that have a value for field.
+        '''
+        table = getattr(self, field)
+        return [key for key in range(0, KEY_CODES) if table[key] != NO_VALUE]
@@ -1,11 +1,65 @@
+import math
+
 import jack
 
 from interface import SUBBEATS_PER_BEAT
+from render import TransportSnapshot
+
+DEFAULT_BPM = 120
+DEFAULT_BEATS_PER_BAR = 4
+DEFAULT_BEAT_TYPE = 4
+# JackPositionBBT, set in jack_position_t.valid while bar/beat/tick are valid
+POSITION_BBT = 0x10
+TICKS_PER_BEAT = 1920.0
 
 class Metronome:
-    def __init__(self, display, client):
-        self.display = display
+    '''
+    Keeps the timeline every instrument plays to and, once sync_transport()
+    is called, publishes it to JACK as the timebase master.
+
+    The timeline is worked out incrementally on the JACK thread: while the
+    transport rolls on, each period adds the frames since the last one at
+    the tempo they were played at, so nothing is recomputed from frame 0
+    and tempo changes never move what has already been played. Tempo and
+    meter are asked for from the control thread (set_tempo, set_meter) and
+    taken on by the JACK thread, the tempo at the start of the next period,
+    the meter at the next bar line, both on an exact frame. A relocation
+    starts over from the new frame at the current tempo.
+
+    If another client is timebase master the timeline follows its
+    bar/beat/tick instead.
+    '''
+    def __init__(self, client):
         self.client = client
+        # written on the JACK thread, painted by the render thread
+        self.snapshot = TransportSnapshot()
+        # jack frame time at the start of the current period
+        self.period_start = 0
+        # True once this client is timebase master
+        self.master = False
+
+        # tempo and meter asked for, written by the control thread
+        self.target_bpm = DEFAULT_BPM
+        self.target_beats_per_bar = DEFAULT_BEATS_PER_BAR
+
+        # timeline shared with the instruments, updated every period
+        self.bpm = DEFAULT_BPM
+        self.beats_per_bar = DEFAULT_BEATS_PER_BAR
+        self.beat_type = DEFAULT_BEAT_TYPE
+        self.frames_per_beat = 60.0 * client.samplerate / self.bpm
+        # beats since the start of the transport at the start of the period
+        self.beat_position = 0.0
+        # beat at which the current meter took over, and the bars before it
+        self.meter_beat = 0.0
+        self.meter_bars = 0
+        # bar the meter asked for starts at, None if there is no change
+        self.meter_change = None
+        self.rolling = False
+        # True if this period carries on exactly where the last one ended
+        self.continuous = False
+        # transport frame at the start of the period
+        self.frame = 0
+        self.next_frame = 0
 
     def transport_on(self):
         return self.client.transport_state != jack.STOPPED
@@ -16,47 +70,138 @@ class Metronome:
         else:
             self.client.transport_start()
 
-    def process(self):
-        state, position = self.client.transport_query()
-        self.display.log(str(position))
+    def process(self, no_frames):
+        '''
+        Runs on the JACK thread: only publishes a snapshot, never paints.
+        The position is read into the client's own jack_position_t rather
+        than a fresh dict, so a period allocates no containers here.
+        '''
+        self.period_start = self.client.last_frame_time
+        state, position = self.client.transport_query_struct()
+        self.update_timeline(state, position, no_frames)
 
-        if not self.transport_on():
-            self.display.change_beat_data(0,0,0)
+        if state == jack.STOPPED:
+            self.snapshot.publish(0, 0, 0, 0, -1)
             return
+        bars, into_bar = self.bar_position(self.beat_position)
+        self.snapshot.publish(1,
+                int(self.beats_per_bar),
+                int(self.beat_type),
+                self.bpm,
+                int(into_bar * SUBBEATS_PER_BEAT))
 
-        try:
-            self.display.change_beat_data(int(position["beats_per_bar"]),
-                    int(position["beat_type"]),
-                    position["beats_per_minute"])
-
-            beat = int(position["beat"]) - 1 # -1 to compensate for enumeration starting at 1
-            tick_in_beat = int(position["tick"])
-            ticks_per_beat = position["ticks_per_beat"]
-            current_sub_beat = tick_in_beat // (ticks_per_beat / SUBBEATS_PER_BEAT)
-            self.display.paint_active_tick(int(beat * SUBBEATS_PER_BEAT + current_sub_beat))
-        except KeyError:
-            return
+    def update_timeline(self, state, position, no_frames):
+        frame = position.frame
+        rolling = state == jack.ROLLING
+        self.continuous = rolling and self.rolling and frame == self.next_frame
+        self.rolling = rolling
 
-    def timemaster(state, blocksize, position, is_new):
-        pass
+        if not self.master and position.valid & POSITION_BBT:
+            # somebody else is timebase master, trust their bar/beat/tick
+            self.bpm = position.beats_per_minute
+            self.beats_per_bar = position.beats_per_bar
+            self.beat_type = position.beat_type
+            self.frames_per_beat = 60.0 * self.client.samplerate / self.bpm
+            self.beat_position = ((position.bar - 1) * position.beats_per_bar
+                    + position.beat - 1
+                    + position.tick / position.ticks_per_beat)
+            self.meter_beat = 0.0
+            self.meter_bars = 0
+        else:
+            if self.continuous:
+                # advance at the tempo the last period was played at
+                self.beat_position += (frame - self.frame) / self.frames_per_beat
+            elif frame != self.frame:
+                # relocated, start over at the current tempo
+                self.beat_position = frame / self.frames_per_beat
+                self.meter_beat = 0.0
+                self.meter_bars = 0
+                self.meter_change = None
+            self.apply_changes()
+        self.frame = frame
+        self.next_frame = frame + no_frames if rolling else frame
+
+    def apply_changes(self):
+        '''
+        JACK thread: take on the tempo and meter asked for. A new tempo
+        starts with this period, a new meter with the next bar, or with the
+        current one if the transport is stopped.
+        '''
+        if self.target_bpm != self.bpm:
+            self.bpm = self.target_bpm
+            self.frames_per_beat = 60.0 * self.client.samplerate / self.bpm
+        if self.target_beats_per_bar != self.beats_per_bar:
+            bars, into_bar = self.bar_position(self.beat_position)
+            if self.rolling and self.meter_change is None:
+                self.meter_change = bars + 1
+            if not self.rolling or bars >= self.meter_change:
+                # the new meter starts with the current bar, on the frame
+                # the old one had it start at
+                self.meter_beat = self.beat_position - into_bar
+                self.meter_bars = bars
+                self.beats_per_bar = self.target_beats_per_bar
+                self.meter_change = None
+        else:
+            self.meter_change = None
+
+    def bar_position(self, beats):
+        '''
+        Number of whole bars before a position in beats, and how many
+        beats into its bar the position is.
+        '''
+        bars = math.floor((beats - self.meter_beat) / self.beats_per_bar)
+        return self.meter_bars + bars, beats - self.meter_beat - bars * self.beats_per_bar
+
+    def timemaster(self, state, blocksize, position, new_position):
+        '''
+        JACK thread, timebase callback: fill in the bar/beat/tick of the
+        next period for the other clients. JACK calls it right after the
+        process callback with the frame the next period starts at, which
+        the timeline reaches at the current tempo unless the transport was
+        relocated.
+        '''
+        if new_position or position.frame != self.next_frame:
+            # start over, like update_timeline() will
+            beats = position.frame / self.frames_per_beat
+        else:
+            beats = self.beat_position + (position.frame - self.frame) / self.frames_per_beat
+        bars, into_bar = self.bar_position(beats)
+        beat = int(into_bar)
+        position.valid = POSITION_BBT
+        position.bar = bars + 1
+        position.beat = beat + 1
+        position.tick = int((into_bar - beat) * TICKS_PER_BEAT)
+        position.bar_start_tick = (beats - into_bar) * TICKS_PER_BEAT
+        position.beats_per_bar = self.beats_per_bar
+        position.beat_type = self.beat_type
+        position.ticks_per_beat = TICKS_PER_BEAT
+        position.beats_per_minute = self.bpm
+
+    def frames_per_bar(self):
+        return self.beats_per_bar * self.frames_per_beat
+
+    def bar_start(self):
+        '''
+        Transport frame at which the current bar started.
+        '''
+        bars, into_bar = self.bar_position(self.beat_position)
+        return self.frame - round(into_bar * self.frames_per_beat)
 
     def sync_transport(self):
-        state, struct = self.client.transport_query_struct()
-        struct.bar = 1
-        struct.beat = 1
-        struct.beat_type = 4
-        struct.beats_per_bar = 4
-        struct.beats_per_minute = 120
-        struct.ticks_per_beat = 1920
-        struct.valid = 16
-        self.client.transport_reposition_struct(struct)
+        '''
+        Become timebase master, from the next period on the transport
+        carries this timeline.
+        '''
+        self.master = self.client.set_timebase_callback(self.timemaster, False)
+
+    def set_tempo(self, bpm):
+        self.target_bpm = bpm
+
+    def set_meter(self, beats_per_bar):
+        self.target_beats_per_bar = beats_per_bar
 
     def decrement_bpm(self):
-        state, struct = self.client.transport_query_struct()
-        struct.beats_per_minute = struct.beats_per_minute - 1
-        self.client.transport_reposition_struct(struct)
+        self.set_tempo(self.target_bpm - 1)
 
     def increment_bpm(self):
-        state, struct = self.client.transport_query_struct()
-        struct.beats_per_minute = struct.beats_per_minute + 1
-        self.client.transport_reposition_struct(struct)
+        self.set_tempo(self.target_bpm + 1)
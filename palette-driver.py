@@ -1,8 +1,38 @@
+import argparse
+import os
+import time
+
 from usb import core as usb
 import usb.util as util
 
-# set up the usb magic
-keyboard = usb.find(bDeviceClass=0)
+import hidreport
+import protocol
+import shmring
+
+parser = argparse.ArgumentParser(description = "Feed USB keyboard events to palette.")
+parser.add_argument("--text", action = "store_true",
+        help = "use the old line based format instead of binary records")
+parser.add_argument("--ring", metavar = "NAME",
+        help = "write to the shared memory ring NAME instead of palette.pipe")
+parser.add_argument("--device", type = int, default = 0,
+        help = "which of the attached keyboards to read, also the id palette routes it by")
+parser.add_argument("--list", action = "store_true",
+        help = "list the attached keyboards and exit")
+parser.add_argument("--record", metavar = "FILE",
+        help = "also save every raw report to FILE, for dev_utils/hid_replay_bench.py")
+args = parser.parse_args()
+encode = protocol.encode_text if args.text else protocol.encode_binary
+
+# set up the usb magic, in the same order every run so device numbers stay put
+keyboards = sorted(usb.find(find_all = True, bDeviceClass=0),
+        key = lambda device: (device.bus, device.address))
+if args.list:
+    for i in range(0, len(keyboards)):
+        print(str(i) + ": bus " + str(keyboards[i].bus) + " address "
+                + str(keyboards[i].address) + " " + hex(keyboards[i].idVendor)
+                + ":" + hex(keyboards[i].idProduct))
+    raise SystemExit
+keyboard = keyboards[args.device]
 firstInt = keyboard[0][(0,0)].bInterfaceNumber
 
 for config in keyboard:
@@ -14,37 +44,45 @@ for config in keyboard:
 keyboard.set_configuration()
 endpoint = keyboard[0][(0,0)][0]
 
-# open the fifo for writing
-fifo = open("palette.pipe", mode="w")
+if args.ring:
+    ring = shmring.RingWriter(args.ring, device = args.device)
+else:
+    # open the fifo for writing
+    ring = None
+    fifo = os.open("palette.pipe", os.O_WRONLY)
+# each report saved as its length followed by its bytes
+recording = open(args.record, "wb") if args.record else None
 
 attempts = 10
 data = None
-pressed_keys = []
+decoder = hidreport.ReportDecoder()
 while attempts > 0:
     try:
         data = keyboard.read(endpoint.bEndpointAddress, endpoint.wMaxPacketSize)
         if data == None:
             continue
-        # clean up the keys that have been released
-        for key in pressed_keys:
-            if key not in data:
-                pressed_keys.remove(key)
-                try:
-                    print("-" + str(key), file=fifo, flush=True)
-                except BrokenPipeError:
-                    continue
-        # trigger the pressed keys
-        for i in range(2, len(data)):
-            if data[i] == 0:
-                continue
-            if data[i] not in pressed_keys:
-                pressed_keys.append(data[i])
-                try:
-                    print("+" + str(data[i]), file=fifo, flush=True)
-                except BrokenPipeError:
-                    continue
+        # every key change in this report happened at the same time
+        stamp = time.monotonic_ns()
+        if recording is not None:
+            recording.write(bytes([len(data)]) + bytes(data))
+        changes = decoder.changes(data)
+        if len(changes) == 0:
+            continue
+        if ring is not None:
+            ring.write(changes, stamp)
+            continue
+        # the whole report goes out in one write
+        try:
+            os.write(fifo, encode(changes, stamp, args.device))
+        except BrokenPipeError:
+            continue
     except usb.USBError as e:
         data = None
         if e.args == ("Operation timed out",):
             attempts -= 1
             print("timeout")
+
+if recording is not None:
+    recording.close()
+if ring is not None:
+    ring.close()
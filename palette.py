@@ -1,13 +1,21 @@
+import argparse
+import time
+
 import jack
 
 from backend import Backend
-from interface import Interface, Entity
+from capture import Capture
+from control import ControlLoop
+from interface import Interface
 from metronome import Metronome
-from instruments.keyboard import Keyboard
-from instruments.sampler import Sampler
-from instruments.drummachine import DrumMachine
-from instruments.push import Push
+from protocol import KeyReader, MAX_DEVICES
+from realtime import CollectorControl, YOUNG_INTERVAL
+from render import RenderThread
+from shmring import RingReader, RING_POLL
+import session
+from stats import CallbackStats, StatsReport
 from instruments.instrument import LooperMode
+from instruments import registry
 
 # main pad
 pad = list(range(4, 40))
@@ -28,84 +36,364 @@ looper_mode_mappings = {
 # headboard with instrument selection
 headboard = list(range(58, 70))
 
+# usb hid key codes fit in a byte
+KEY_CODES = 256
+
+# seconds between refreshes of the latency line
+STATS_INTERVAL = 1.0
+
 class Main:
-    def __init__(self):
+    def __init__(self, pipe = "palette.pipe", rings = (), routes = None,
+            instruments = registry.REGISTRY_FILE, stats_file = None, stats_socket = None,
+            processes = False, realtime = False, session_file = None,
+            capture_file = None, midi_routes = None):
+        '''
+        pipe: str
+        FIFO a driver writes to, or None.
+
+        rings: list
+        Names of shared memory rings, one per driver.
+
+        routes: dict
+        Instrument each device id starts out playing, by name or number.
+        Devices not listed start on the first instrument.
+
+        instruments: str
+        Registry file declaring the instruments.
+
+        stats_file, stats_socket: str
+        Where to publish the timing of the JACK callback, which is only
+        recorded if one of them is given.
+
+        processes: bool
+        Run every instrument in a process and JACK client of its own.
+
+        realtime: bool
+        Realtime-safe mode: no automatic garbage collection, the control
+        thread collects at safe points instead (see realtime.py).
+
+        session_file: str
+        Session to restore at startup and to autosave to, or None. Only
+        covers instruments running in this process.
+
+        capture_file: str
+        Standard MIDI File to record everything played to, one track per
+        instrument, or None. Only covers instruments running in this process.
+
+        midi_routes: dict
+        Instrument every MIDI channel (1 to 16) plays, by name or number, for
+        a MIDI input port, or None for no port. Channels not listed play
+        whichever instrument device 0 has selected. Only for instruments
+        running in this process.
+        '''
         # jack client
         self.client = jack.Client("palette", no_start_server = True)
         
         # interface
-        entities = [Entity.KEYBOARD, Entity.SAMPLER, Entity.DRUM_MACHINE, Entity.PUSH]
-        self.display = Interface(entities)
+        self.instruments = registry.load_registry(instruments)
+        self.display = Interface(self.instruments)
 
         # metronome
-        self.metronome = Metronome(self.display, self.client)
+        self.metronome = Metronome(self.client)
+        self.renderer = RenderThread(self.display, self.metronome.snapshot)
 
-        # backend
-        constructors = [Keyboard, Sampler, DrumMachine, Push]
-        self.be = Backend(self.client, self.metronome, constructors)
+        # backend, instruments are built when a device first selects them, or
+        # all started up front in processes of their own
+        self.stats_file = stats_file
+        self.stats_socket = stats_socket
+        self.stats = None
+        if stats_file is not None or stats_socket is not None:
+            self.stats = CallbackStats(len(self.instruments))
+            self.stats_report = StatsReport(self.stats,
+                    [spec.label for spec in self.instruments], self.client.samplerate)
+        self.be = Backend(self.client, self.metronome, self.instruments, lazy = True,
+                stats = self.stats, processes = processes, realtime = realtime,
+                midi_input = midi_routes is not None)
+        self.collector = CollectorControl(self.metronome) if realtime else None
 
         # misc
         self.pressed_keys = []
-        self.fifo = open("palette.pipe", mode = "rt")
-        self.current_inst_number = 0
+        self.readers = []
+        if pipe is not None:
+            self.readers.append(KeyReader(pipe, nonblocking = True))
+        self.rings = [RingReader(name) for name in rings]
+        self.control = ControlLoop()
+        # instrument number every device plays, and its key tables, built
+        # when the device is first routed
+        self.routes = [0] * MAX_DEVICES
+        self.dispatch = [None] * MAX_DEVICES
+        self.route(0, 0)
+        if routes is not None:
+            for device in routes:
+                self.route(device, registry.find(self.instruments, str(routes[device])))
+        if midi_routes is not None:
+            for channel in midi_routes:
+                self.be.route_channel(channel - 1,
+                        registry.find(self.instruments, str(midi_routes[channel])))
+
+        # the last session, before anything plays
+        self.autosave = None
+        if session_file is not None:
+            session.load(session_file, self.metronome, self.session_instrument)
+            self.autosave = session.Autosave(session_file, self.metronome, self.session_instruments)
+
+        # capture at the tempo the session left
+        self.capture = None
+        if capture_file is not None:
+            self.capture = Capture(capture_file, self.client.samplerate, self.metronome.target_bpm,
+                    [spec.label for spec in self.instruments])
+            self.be.capture_to(self.capture)
+            self.capture.start()
 
         # let's go
         self.client.activate()
-        self.display.paint_pad(0)
+        self.display.paint_pad(self.routes[0])
+        self.renderer.start()
         self.metronome.sync_transport()
 
-    def key_released(self, key):
-        if key in pad:
-            self.be.entities[self.current_inst_number].key_released(key)
-            self.display.paint_key_off(key)
-        elif key in range(84, 88):
-            self.be.entities[self.current_inst_number].normal_mode()
-
-    def key_pressed(self, key):
-        if key in pad:
-            self.be.entities[self.current_inst_number].key_pressed(key)
-            self.display.paint_key_on(key)
-        elif key in looper:
-            self.be.entities[self.current_inst_number].loop(key - 89)
-        elif key in looper_mode_mappings:
-            self.be.entities[self.current_inst_number].set_looper_mode(looper_mode_mappings[key])
-            # numpad /
-        elif key == 84:
-            self.be.entities[self.current_inst_number].delete_mode()
-            # numpad *
-        elif key == 85:
-            self.be.entities[self.current_inst_number].record_mode()
-            # numpad -
-        elif key == 86:
-            self.be.entities[self.current_inst_number].half_mode()
-            # numpad +
-        elif key == 87:
-            self.be.entities[self.current_inst_number].double_mode()
-            # space
-        elif key == 44:
-            self.metronome.toggle_transport()
-            # esc
-        elif key == 41:
-            self.fifo.close()
-            self.display.shutdown()
-            quit()
-            # instrument selection
-        elif key in headboard:
-            if key - 58 < len(self.be.entities):
-                self.current_inst_number = key - 58
-                self.display.paint_pad(self.current_inst_number)
-            # left arrow, decrement bpm
-        elif key == 80:
-            self.metronome.decrement_bpm()
-            # right arrow, increment bpm
-        elif key == 79:
-            self.metronome.increment_bpm()
+    def stamp_to_frame(self, stamp):
+        '''
+        Convert a driver timestamp (time.monotonic_ns) to a JACK frame time.
+        '''
+        age = time.monotonic_ns() - stamp
+        if age < 0:
+            age = 0
+        return (self.client.frame_time
+                - age * self.client.samplerate // 1000000000) & 0xffffffff
 
-if __name__ == "__main__":
-    palette = Main()
-    while True:
-        line = palette.fifo.readline()
-        if line[0] == '+':
-            palette.key_pressed(int(line[1:]))
+    def run(self):
+        for reader in self.readers:
+            self.control.add_source(reader, self.key_event)
+        for ring in self.rings:
+            self.control.add_source(ring, self.key_event, RING_POLL)
+        self.control.every(STATS_INTERVAL, self.show_latency)
+        if self.stats is not None:
+            self.control.every(STATS_INTERVAL, self.publish_stats)
+        if self.stats_socket is not None:
+            self.control.serve(self.stats_socket, self.stats_report.render)
+        if self.autosave is not None:
+            self.control.every(session.AUTOSAVE_INTERVAL, self.autosave.save)
+        if self.collector is not None:
+            self.control.every(YOUNG_INTERVAL, self.collector.collect)
+            self.collector.start()
+        self.control.run()
+
+    def session_instrument(self, name):
+        try:
+            return self.be.entity(registry.find(self.instruments, name))
+        except (KeyError, IndexError):
+            return None
+
+    def session_instruments(self):
+        return [(self.instruments[i].name, self.be.entities[i])
+                for i in range(0, len(self.instruments)) if self.be.entities[i] is not None]
+
+    def publish_stats(self):
+        if self.stats_file is not None:
+            self.stats_report.write(self.stats_file)
+        else:
+            # keep up with the ring between connections to the socket
+            self.stats_report.update()
+
+    def show_latency(self):
+        handler = self.control.handler_latency.percentiles(0.5, 0.99)
+        if handler is None:
+            return
+        total = self.control.input_latency.percentiles(0.5, 0.99)
+        self.display.log("key handling p50 {0:.0f}us p99 {1:.0f}us, from driver p50 {2:.0f}us p99 {3:.0f}us"
+                .format(handler[0] / 1000, handler[1] / 1000, total[0] / 1000, total[1] / 1000))
+
+    def key_event(self, key, pressed, stamp, device = 0):
+        if pressed:
+            self.key_pressed(key, stamp, device)
         else:
-            palette.key_released(int(line[1:]))
+            self.key_released(key, stamp, device)
+
+    def key_released(self, key, stamp, device = 0):
+        dispatch = self.dispatch[device]
+        if dispatch is None:
+            dispatch = self.route(device, 0)
+        dispatch[1][key](key, stamp)
+
+    def key_pressed(self, key, stamp, device = 0):
+        dispatch = self.dispatch[device]
+        if dispatch is None:
+            dispatch = self.route(device, 0)
+        dispatch[0][key](key, stamp)
+
+    def route(self, device, inst_number):
+        '''
+        Make a device play an instrument, giving it a queue of its own in
+        that instrument. Returns the device's new key tables.
+        '''
+        self.routes[device] = inst_number
+        self.be.entity(inst_number).attach(device)
+        if device == 0:
+            self.be.select(inst_number)
+        self.dispatch[device] = self.compile_dispatch(device)
+        return self.dispatch[device]
+
+    def compile_dispatch(self, device):
+        '''
+        Build the key tables of a device for the instrument it is routed
+        to: one handler per key code for presses and one for releases,
+        bound to the instrument and device up front so a keystroke is a
+        single list index. The pair is swapped in as a whole when the
+        device changes instrument.
+
+        The screen shows the instrument of device 0, the one the MIDI input
+        follows too, so only its keys are painted.
+        '''
+        entity = self.be.entity(self.routes[device])
+        display = self.display
+        stamp_to_frame = self.stamp_to_frame
+
+        if device == 0:
+            def pad_pressed(key, stamp):
+                entity.key_pressed(key, stamp_to_frame(stamp), device)
+                display.paint_key_on(key)
+
+            def pad_released(key, stamp):
+                entity.key_released(key, stamp_to_frame(stamp), device)
+                display.paint_key_off(key)
+        else:
+            def pad_pressed(key, stamp):
+                entity.key_pressed(key, stamp_to_frame(stamp), device)
+
+            def pad_released(key, stamp):
+                entity.key_released(key, stamp_to_frame(stamp), device)
+
+        def loop(key, stamp):
+            entity.loop(key - looper[0])
+
+        def looper_mode(key, stamp):
+            entity.set_looper_mode(looper_mode_mappings[key])
+
+        def normal_mode(key, stamp):
+            entity.normal_mode()
+
+        def select(key, stamp):
+            if key - headboard[0] < len(self.instruments):
+                self.route(device, key - headboard[0])
+                if device == 0:
+                    self.display.paint_pad(key - headboard[0])
+
+        pressed = [ignore_key] * KEY_CODES
+        released = [ignore_key] * KEY_CODES
+        for key in pad:
+            pressed[key] = pad_pressed
+            released[key] = pad_released
+        for key in looper:
+            pressed[key] = loop
+        for key in looper_mode_mappings:
+            pressed[key] = looper_mode
+            released[key] = normal_mode
+        for key in headboard:
+            pressed[key] = select
+        # space
+        pressed[44] = self.toggle_transport
+        # esc
+        pressed[41] = self.quit
+        # left arrow, decrement bpm
+        pressed[80] = self.decrement_bpm
+        # right arrow, increment bpm
+        pressed[79] = self.increment_bpm
+        return (pressed, released)
+
+    def toggle_transport(self, key, stamp):
+        self.metronome.toggle_transport()
+
+    def decrement_bpm(self, key, stamp):
+        self.metronome.decrement_bpm()
+
+    def increment_bpm(self, key, stamp):
+        self.metronome.increment_bpm()
+
+    def quit(self, key, stamp):
+        self.control.stop()
+        for reader in self.readers + self.rings:
+            self.control.remove_source(reader)
+            reader.close()
+        self.renderer.stop()
+        self.display.shutdown()
+        if self.autosave is not None:
+            self.autosave.save()
+        for entity in self.be.active:
+            if entity.overflows() > 0:
+                print(type(entity).__name__ + " dropped "
+                        + str(entity.overflows()) + " key events")
+            if entity.late_events > 0:
+                print(type(entity).__name__ + " played "
+                        + str(entity.late_events) + " key events late")
+        for child in self.be.children:
+            if child.overflows() > 0:
+                print(self.instruments[child.number].label + " dropped "
+                        + str(child.overflows()) + " commands")
+        if self.be.midi_dropped > 0:
+            print("midi input dropped " + str(self.be.midi_dropped) + " events")
+        self.be.close()
+        if self.capture is not None:
+            self.capture.close()
+            if self.capture.dropped() > 0:
+                print("capture dropped " + str(self.capture.dropped()) + " events")
+        if self.collector is not None:
+            self.collector.stop()
+            print("{0} garbage collections, longest {1:.0f}us".format(
+                self.collector.collections, self.collector.longest / 1000))
+        for ring in self.rings:
+            if ring.dropped() > 0:
+                print("ring " + ring.name + " dropped "
+                        + str(ring.dropped()) + " key events")
+
+def ignore_key(key, stamp):
+    pass
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = "Run palette.")
+    parser.add_argument("--ring", metavar = "NAME", action = "append", default = [],
+            help = "read a driver's shared memory ring, can be given once per driver")
+    parser.add_argument("--no-pipe", action = "store_true",
+            help = "do not read palette.pipe")
+    parser.add_argument("--route", metavar = "DEVICE=INSTRUMENT", action = "append", default = [],
+            help = "start a device on an instrument, by name or numbered like the headboard from 0")
+    parser.add_argument("--instruments", metavar = "FILE", default = registry.REGISTRY_FILE,
+            help = "registry of the instruments to play")
+    parser.add_argument("--stats-file", metavar = "FILE",
+            help = "write the timing of the JACK callback to FILE every second")
+    parser.add_argument("--stats-socket", metavar = "PATH",
+            help = "serve the timing of the JACK callback on a Unix socket at PATH")
+    parser.add_argument("--processes", action = "store_true",
+            help = "run every instrument in a process and JACK client of its own")
+    parser.add_argument("--realtime", action = "store_true",
+            help = "realtime-safe mode, garbage is only collected from the control thread")
+    parser.add_argument("--session", metavar = "FILE",
+            help = "restore the set from FILE and keep saving it there")
+    parser.add_argument("--capture", metavar = "FILE",
+            help = "record everything played to FILE, a Standard MIDI File")
+    parser.add_argument("--midi-in", action = "store_true",
+            help = "play the instruments from a MIDI input port")
+    parser.add_argument("--midi-route", metavar = "CHANNEL=INSTRUMENT", action = "append", default = [],
+            help = "play an instrument from a MIDI channel, 1 to 16, implies --midi-in")
+    args = parser.parse_args()
+    if args.session is not None and args.processes:
+        parser.error("--session needs the instruments in this process")
+    if args.capture is not None and args.processes:
+        parser.error("--capture needs the instruments in this process")
+    midi_routes = None
+    if args.midi_in or args.midi_route:
+        if args.processes:
+            parser.error("--midi-in needs the instruments in this process")
+        midi_routes = {}
+        for route in args.midi_route:
+            channel, instrument = route.split("=")
+            if not 1 <= int(channel) <= 16:
+                parser.error("midi channels go from 1 to 16")
+            midi_routes[int(channel)] = instrument
+    routes = {}
+    for route in args.route:
+        device, instrument = route.split("=")
+        routes[int(device)] = instrument
+    palette = Main(None if args.no_pipe else "palette.pipe", args.ring, routes, args.instruments,
+            args.stats_file, args.stats_socket, args.processes, args.realtime, args.session,
+            args.capture, midi_routes)
+    palette.run()
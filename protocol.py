@@ -0,0 +1,169 @@
+'''
+Wire format of palette.pipe, shared by palette-driver.py and palette.py.
+
+The driver sends fixed-size binary records, all the key changes of one USB
+report in a single write. Every record carries the id of the device it came
+from, so several drivers can share one pipe; version 1 records, which have
+no device id, come from device 0. The older text format, one
+"+key stamp [device]" or "-key stamp [device]" line per change, is still
+understood: the reader detects it from the first byte of every read that
+starts on a record boundary.
+'''
+import os
+import struct
+import time
+
+PROTOCOL_VERSION = 2
+# versions the readers still accept
+PROTOCOL_VERSIONS = (1, 2)
+
+# version, flags, key, device, timestamp (time.monotonic_ns)
+RECORD = struct.Struct("<BBBBQ")
+RECORD_SIZE = RECORD.size
+FLAG_PRESSED = 1
+
+TEXT_PRESSED = ord("+")
+TEXT_RELEASED = ord("-")
+
+# how many records a single read can pick up
+READ_RECORDS = 256
+
+# device ids fit in a byte
+MAX_DEVICES = 256
+
+def encode_binary(changes, stamp, device = 0):
+    '''
+    changes: list
+    (key, pressed) pairs from one report.
+
+    device: int
+    Id of the device the report came from.
+    '''
+    batch = bytearray(RECORD_SIZE * len(changes))
+    for i in range(0, len(changes)):
+        key, pressed = changes[i]
+        RECORD.pack_into(batch, i * RECORD_SIZE, PROTOCOL_VERSION,
+                FLAG_PRESSED if pressed else 0, key, device, stamp)
+    return bytes(batch)
+
+def encode_text(changes, stamp, device = 0):
+    lines = []
+    for key, pressed in changes:
+        lines.append(("+" if pressed else "-") + str(key) + " " + str(stamp)
+                + " " + str(device) + "\n")
+    return "".join(lines).encode()
+
+class KeyReader:
+    '''
+    Reads key events from the pipe. Every drain() does one read into a
+    buffer that is reused for the lifetime of the reader and hands all the
+    complete records in it to the handler.
+
+    A nonblocking reader opens the pipe without waiting for the driver and
+    keeps a write end of its own open, so the pipe never reports end of
+    file: the driver can go away and come back without the reader noticing.
+    Every write the driver makes is smaller than PIPE_BUF and so arrives
+    whole, a disconnect never leaves half a record behind.
+    '''
+    def __init__(self, path, read_records = READ_RECORDS, nonblocking = False):
+        self.path = path
+        self.buffer = bytearray(RECORD_SIZE * read_records)
+        self.view = memoryview(self.buffer)
+        # bytes of an incomplete record or line left over from the last read
+        self.pending = 0
+        self.text = False
+        # records with a protocol version we do not understand
+        self.bad_records = 0
+        self.nonblocking = nonblocking
+        self.keepalive = None
+        self.open()
+
+    def open(self):
+        if self.nonblocking:
+            self.fd = os.open(self.path, os.O_RDONLY | os.O_NONBLOCK)
+            self.keepalive = os.open(self.path, os.O_WRONLY | os.O_NONBLOCK)
+        else:
+            self.fd = os.open(self.path, os.O_RDONLY)
+
+    def fileno(self):
+        return self.fd
+
+    def reopen(self):
+        '''
+        Wait for the driver to connect again after it has gone away.
+        '''
+        self.close()
+        self.pending = 0
+        self.open()
+
+    def close(self):
+        os.close(self.fd)
+        if self.keepalive is not None:
+            os.close(self.keepalive)
+            self.keepalive = None
+
+    def drain(self, handler):
+        '''
+        handler: function
+        Called as handler(key, pressed, stamp, device) for every complete
+        event.
+
+        Returns False once the driver has closed its end of the pipe, which
+        a nonblocking reader never does.
+        '''
+        try:
+            received = os.readv(self.fd, [self.view[self.pending:]])
+        except BlockingIOError:
+            return True
+        if received == 0:
+            return False
+        end = self.pending + received
+        if self.pending == 0:
+            self.text = self.buffer[0] in (TEXT_PRESSED, TEXT_RELEASED)
+        if self.text:
+            used = self.parse_text(end, handler)
+        else:
+            used = self.parse_binary(end, handler)
+        # keep the incomplete tail for the next read
+        self.pending = end - used
+        if self.pending > 0:
+            self.buffer[0:self.pending] = self.buffer[used:end]
+        return True
+
+    def parse_binary(self, end, handler):
+        offset = 0
+        while offset + RECORD_SIZE <= end:
+            version, flags, key, device, stamp = RECORD.unpack_from(self.buffer, offset)
+            offset += RECORD_SIZE
+            if version not in PROTOCOL_VERSIONS:
+                self.bad_records += 1
+                continue
+            handler(key, bool(flags & FLAG_PRESSED), stamp, device)
+        return offset
+
+    def parse_text(self, end, handler):
+        offset = 0
+        while True:
+            newline = self.buffer.find(b"\n", offset, end)
+            if newline < 0:
+                break
+            line = self.buffer[offset:newline]
+            offset = newline + 1
+            if len(line) < 2:
+                continue
+            fields = line[1:].split()
+            key = int(fields[0])
+            if key < 0 or key > 255:
+                self.bad_records += 1
+                continue
+            # older drivers send no stamp and no device
+            stamp = int(fields[1]) if len(fields) > 1 else time.monotonic_ns()
+            device = int(fields[2]) if len(fields) > 2 else 0
+            if device < 0 or device >= MAX_DEVICES:
+                self.bad_records += 1
+                continue
+            handler(key, line[0] == TEXT_PRESSED, stamp, device)
+        if offset == 0 and end == len(self.buffer):
+            # a line longer than the whole buffer, drop it
+            return end
+        return offset
@@ -0,0 +1,63 @@
+'''
+Garbage collector control for the realtime-safe mode.
+
+CPython runs a cyclic collection on whichever thread happens to allocate
+the container that crosses the threshold, which can be the JACK thread, and
+a full collection walks every object palette ever made. In realtime-safe
+mode everything built at startup is frozen into the permanent generation,
+automatic collection is switched off, and the control thread collects at
+points of its own choosing instead: the young generation on a timer, the
+older ones only while the transport is stopped. A collection still holds
+the GIL, so the JACK thread waits for it, which is why the expensive ones
+wait for a stopped transport.
+
+The JACK thread's own path keeps no containers alive from one period to the
+next (see dev_utils/alloc_check.py), so it never adds to the young
+generation and whatever builds up comes from the control thread.
+'''
+import gc
+import time
+
+# seconds between collections of the young generation
+YOUNG_INTERVAL = 0.5
+# seconds between full collections, when the transport allows one
+FULL_INTERVAL = 10.0
+
+class CollectorControl:
+    def __init__(self, metronome, full_interval = FULL_INTERVAL):
+        self.metronome = metronome
+        self.full_interval = full_interval
+        self.last_full = time.monotonic()
+        self.collections = 0
+        # longest collection, in nanoseconds
+        self.longest = 0
+
+    def start(self):
+        '''
+        Call once everything is built, before the transport starts.
+        '''
+        gc.collect()
+        gc.freeze()
+        gc.disable()
+
+    def stop(self):
+        gc.unfreeze()
+        gc.enable()
+
+    def collect(self):
+        '''
+        Control thread: a safe point. Collects the young generation if
+        anything is in it, and everything once in a while if the transport
+        is stopped.
+        '''
+        started = time.monotonic_ns()
+        now = time.monotonic()
+        if not self.metronome.rolling and now - self.last_full > self.full_interval:
+            gc.collect()
+            self.last_full = now
+        elif gc.get_count()[0] > 0:
+            gc.collect(0)
+        else:
+            return
+        self.collections += 1
+        self.longest = max(self.longest, time.monotonic_ns() - started)
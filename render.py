@@ -0,0 +1,92 @@
+import threading
+import time
+
+# how many times per second the render thread may repaint the screen
+FRAME_RATE = 30
+
+# field indices inside a transport snapshot
+ROLLING = 0
+BEATS_PER_BAR = 1
+BEAT_TYPE = 2
+BPM = 3
+TICK = 4
+SNAPSHOT_SIZE = 5
+
+class TransportSnapshot:
+    '''
+    Small transport/tick state shared between the JACK thread and the
+    render thread. The JACK thread publishes into it every cycle without
+    blocking; the render thread copies it out with a sequence check so it
+    never sees a half-written snapshot.
+    '''
+    def __init__(self):
+        self.sequence = 0
+        self.fields = [0] * SNAPSHOT_SIZE
+
+    def publish(self, rolling, beats_per_bar, beat_type, bpm, tick):
+        # an odd sequence number marks a write in progress
+        self.sequence += 1
+        fields = self.fields
+        fields[ROLLING] = rolling
+        fields[BEATS_PER_BAR] = beats_per_bar
+        fields[BEAT_TYPE] = beat_type
+        fields[BPM] = bpm
+        fields[TICK] = tick
+        self.sequence += 1
+
+    def read(self, into):
+        '''
+        Copy the latest snapshot into the list into and return its sequence
+        number.
+        '''
+        while True:
+            sequence = self.sequence
+            if sequence & 1:
+                time.sleep(0)
+                continue
+            into[:] = self.fields
+            if sequence == self.sequence:
+                return sequence
+
+class RenderThread(threading.Thread):
+    '''
+    Repaints the transport part of the interface from the snapshots
+    published by the metronome and flushes the interface to the terminal,
+    at most FRAME_RATE times a second.
+    '''
+    def __init__(self, display, snapshot, frame_rate = FRAME_RATE):
+        super().__init__(name = "palette-render", daemon = True)
+        self.display = display
+        self.snapshot = snapshot
+        self.period = 1.0 / frame_rate
+        self.running = threading.Event()
+        self.running.set()
+
+    def run(self):
+        fields = [0] * SNAPSHOT_SIZE
+        painted = None
+        last_sequence = -1
+        while self.running.is_set():
+            started = time.monotonic()
+            sequence = self.snapshot.read(fields)
+            # the metronome publishes every cycle, only repaint on real changes
+            if sequence != last_sequence and fields != painted:
+                painted = list(fields)
+                self.repaint(fields)
+            last_sequence = sequence
+            self.display.render()
+            remaining = self.period - (time.monotonic() - started)
+            if remaining > 0:
+                time.sleep(remaining)
+
+    def repaint(self, fields):
+        if not fields[ROLLING]:
+            self.display.change_beat_data(0, 0, 0)
+            return
+        self.display.change_beat_data(fields[BEATS_PER_BAR], fields[BEAT_TYPE], fields[BPM])
+        if fields[TICK] >= 0:
+            self.display.paint_active_tick(fields[TICK])
+
+    def stop(self):
+        self.running.clear()
+        self.join()
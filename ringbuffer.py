@@ -0,0 +1,75 @@
+from array import array
+
+DEFAULT_CAPACITY = 128
+
+class RingBuffer:
+    '''
+    Fixed-capacity single-producer/single-consumer queue of int records.
+
+    Every record is width ints wide. Storage is preallocated at
+    construction, so the consumer never allocates and neither side ever
+    takes a lock. Only the producer moves tail and only the consumer moves
+    head, which is enough to make the handoff safe between one reader
+    thread and the JACK thread. Both counters wrap at twice the capacity
+    so that a full buffer can be told apart from an empty one.
+    '''
+    def __init__(self, capacity = DEFAULT_CAPACITY, width = 1):
+        size = 1
+        while size < capacity:
+            size <<= 1
+        self.capacity = size
+        self.width = width
+        self.mask = size - 1
+        self.wrap = 2 * size - 1
+        self.buffer = array("q", bytes(8 * size * width))
+        self.head = 0
+        self.tail = 0
+        # number of records dropped because the buffer was full
+        self.overflows = 0
+
+    def __len__(self):
+        return (self.tail - self.head) & self.wrap
+
+    def empty(self):
+        return self.head == self.tail
+
+    def full(self):
+        return (self.tail - self.head) & self.wrap == self.capacity
+
+    def push(self, *fields):
+        '''
+        Producer side. Returns False and counts an overflow if the buffer
+        is full.
+        '''
+        tail = self.tail
+        if (tail - self.head) & self.wrap == self.capacity:
+            self.overflows += 1
+            return False
+        start = (tail & self.mask) * self.width
+        for i in range(0, self.width):
+            self.buffer[start + i] = fields[i]
+        self.tail = (tail + 1) & self.wrap
+        return True
+
+    def peek(self, field = 0):
+        '''
+        Consumer side. Read one field of the oldest record without removing
+        it. Must only be called when the buffer is not empty.
+        '''
+        return self.buffer[(self.head & self.mask) * self.width + field]
+
+    def advance(self):
+        '''
+        Consumer side. Drop the oldest record.
+        '''
+        self.head = (self.head + 1) & self.wrap
+
+    def pop(self):
+        '''
+        Consumer side. Remove the oldest record and return its first field.
+        Must only be called when the buffer is not empty.
+        '''
+        head = self.head
+        value = self.buffer[(head & self.mask) * self.width]
+        self.head = (head + 1) & self.wrap
+        return value
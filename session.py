@@ -0,0 +1,126 @@
+'''
+Session files: the patterns, loops and tempo of a set, so it survives
+palette quitting.
+
+A session file is a fixed header followed by one section per instrument,
+found through a table of names right after the header:
+
+    header      magic, version, number of sections, bpm, beats per bar
+    sections    length of the instrument name, offset and size of its
+                section, then the name itself
+    ...         per instrument: size of its state, number of loop slots,
+                the state (pattern bitmaps and the like, see
+                Instrument.save_state), then every loop slot (see
+                Loop.save) with its events as packed arrays
+
+Sections are matched to instruments by name, so a session still loads when
+the registry gains, loses or reorders instruments. Loading maps the file
+and copies the arrays straight out of the mapping. Saving builds the whole
+file in memory on the control thread, then replaces the old file in one
+go, so a crash never leaves half a session behind.
+'''
+import mmap
+import os
+import struct
+
+SESSION_MAGIC = b"PLTS"
+SESSION_VERSION = 2
+HEADER = struct.Struct("<4sHHdd")
+SECTION = struct.Struct("<HII")
+INSTRUMENT = struct.Struct("<II")
+
+# seconds between autosaves
+AUTOSAVE_INTERVAL = 30.0
+
+def snapshot(metronome, instruments):
+    '''
+    The session as bytes.
+
+    instruments: list
+    (name, instrument) pairs of the instruments to save.
+    '''
+    sections = []
+    for name, instrument in instruments:
+        state = instrument.save_state()
+        sections.append((name.encode(), b"".join((
+            INSTRUMENT.pack(len(state), len(instrument.looper.loops)),
+            state,
+            instrument.looper.save()))))
+    parts = [HEADER.pack(SESSION_MAGIC, SESSION_VERSION, len(sections),
+        metronome.target_bpm, metronome.target_beats_per_bar)]
+    offset = HEADER.size + sum(SECTION.size + len(name) for name, section in sections)
+    for name, section in sections:
+        parts.append(SECTION.pack(len(name), offset, len(section)))
+        parts.append(name)
+        offset += len(section)
+    parts.extend(section for name, section in sections)
+    return b"".join(parts)
+
+def write(path, data):
+    partial = path + ".tmp"
+    with open(partial, "wb") as f:
+        f.write(data)
+    os.replace(partial, path)
+
+def load(path, metronome, instrument):
+    '''
+    Restore a session, before the JACK client is activated. Returns False
+    if there is no session file yet.
+
+    instrument: function
+    Returns the instrument of a name, building it if need be, or None if
+    there is no such instrument any more.
+    '''
+    try:
+        f = open(path, "rb")
+    except FileNotFoundError:
+        return False
+    with f, mmap.mmap(f.fileno(), 0, access = mmap.ACCESS_READ) as mapping:
+        view = memoryview(mapping)
+        try:
+            magic, version, sections, bpm, beats_per_bar = HEADER.unpack_from(view)
+            if magic != SESSION_MAGIC or version != SESSION_VERSION:
+                raise ValueError(path + " is not a palette session")
+            metronome.set_tempo(bpm)
+            metronome.set_meter(beats_per_bar)
+            entry = HEADER.size
+            for i in range(0, sections):
+                length, offset, size = SECTION.unpack_from(view, entry)
+                entry += SECTION.size
+                name = bytes(view[entry:entry + length]).decode()
+                entry += length
+                target = instrument(name)
+                if target is None:
+                    continue
+                section = view[offset:offset + size]
+                state_size, loops = INSTRUMENT.unpack_from(section)
+                start = INSTRUMENT.size
+                target.restore_state(section[start:start + state_size])
+                if loops == len(target.looper.loops):
+                    target.looper.restore(section[start + state_size:])
+                section.release()
+        finally:
+            view.release()
+    return True
+
+class Autosave:
+    '''
+    Saves the session from the control thread whenever it has changed.
+    Building the snapshot only reads the instruments, the JACK thread never
+    waits for it.
+    '''
+    def __init__(self, path, metronome, instruments):
+        '''
+        instruments: function
+        Returns the (name, instrument) pairs to save.
+        '''
+        self.path = path
+        self.metronome = metronome
+        self.instruments = instruments
+        self.saved = None
+
+    def save(self):
+        data = snapshot(self.metronome, self.instruments())
+        if data != self.saved:
+            write(self.path, data)
+            self.saved = data
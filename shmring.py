@@ -0,0 +1,251 @@
+'''
+Shared memory transport between palette-driver.py and palette.py, an
+alternative to palette.pipe.
+
+Every driver, one per device, gets a ring of its own: a file under /dev/shm
+that both sides map, holding the same fixed-size records as the pipe
+protocol. The driver
+packs records straight into the mapping and the palette reader unpacks them
+straight out of it, so nothing is copied through the kernel.
+
+The ring file starts with a header of 64-bit words:
+
+    magic         RING_MAGIC, with the protocol version in the low byte
+    capacity      number of record slots, a power of two
+    waiting       set by the reader when it has drained the ring and waits
+    dropped       records the writer threw away because the ring was full
+    head          records written so far, only the writer stores it
+    tail          records read so far, only the reader stores it
+
+head and tail sit on separate cache lines. A record is only read once head
+has moved past it, and head is only stored after the record is written.
+
+The reader waits on a small FIFO next to the ring, the bell. The writer only
+rings it when the reader has said it is waiting, so a burst of keys costs
+one wakeup at most. The header words are stored through a memoryview cast to
+unsigned 64-bit, which makes each store a single aligned write.
+'''
+import mmap
+import os
+
+from protocol import RECORD, RECORD_SIZE, FLAG_PRESSED, PROTOCOL_VERSION, READ_RECORDS
+
+RING_DIR = "/dev/shm"
+RING_MAGIC = 0x70616c6574746500 | PROTOCOL_VERSION
+RING_CAPACITY = 1024
+
+# header words
+MAGIC = 0
+CAPACITY = 1
+WAITING = 2
+DROPPED = 3
+HEAD = 8
+TAIL = 16
+HEADER_SIZE = 24 * 8
+
+# how many wakeups one read of the bell clears
+BELL_READ = 64
+
+# seconds between checks of a ring whose wakeup went missing, for hardware
+# that lets the header stores of the two sides pass each other
+RING_POLL = 0.05
+
+def ring_path(name):
+    return os.path.join(RING_DIR, "palette-" + name + ".ring")
+
+def bell_path(name):
+    return os.path.join(RING_DIR, "palette-" + name + ".bell")
+
+def remove(name):
+    '''
+    Delete the files of a ring nobody uses any more.
+    '''
+    for path in (ring_path(name), bell_path(name)):
+        try:
+            os.unlink(path)
+        except FileNotFoundError:
+            pass
+
+class ShmRing:
+    '''
+    A mapped ring file, created by whichever side opens it first.
+    '''
+    def __init__(self, name, capacity = RING_CAPACITY):
+        if capacity & (capacity - 1):
+            raise ValueError("ring capacity must be a power of two")
+        self.name = name
+        size = HEADER_SIZE + capacity * RECORD_SIZE
+        fd = os.open(ring_path(name), os.O_RDWR | os.O_CREAT, 0o600)
+        try:
+            if os.fstat(fd).st_size == 0:
+                os.ftruncate(fd, size)
+            self.map = mmap.mmap(fd, 0)
+        finally:
+            os.close(fd)
+        self.header = memoryview(self.map).cast("Q")
+        if self.header[MAGIC] == 0:
+            self.header[CAPACITY] = capacity
+            self.header[MAGIC] = RING_MAGIC
+        elif self.header[MAGIC] != RING_MAGIC:
+            self.close()
+            raise ValueError(ring_path(name) + " is not a palette ring")
+        self.capacity = self.header[CAPACITY]
+        self.mask = self.capacity - 1
+        try:
+            os.mkfifo(bell_path(name), 0o600)
+        except FileExistsError:
+            pass
+
+    def slot(self, index):
+        return HEADER_SIZE + (index & self.mask) * RECORD_SIZE
+
+    def close(self):
+        self.header.release()
+        self.map.close()
+
+class RingWriter(ShmRing):
+    '''
+    The driver's end of a ring.
+    '''
+    def __init__(self, name, capacity = RING_CAPACITY, device = 0):
+        super().__init__(name, capacity)
+        self.head = self.header[HEAD]
+        self.bell = None
+        self.device = device
+
+    def space(self):
+        return self.capacity - (self.head - self.header[TAIL])
+
+    def write(self, changes, stamp):
+        '''
+        changes: list
+        (key, pressed) pairs from one report, published together.
+        '''
+        if len(changes) > self.space():
+            self.header[DROPPED] += len(changes)
+            return
+        head = self.head
+        for key, pressed in changes:
+            self.pack(head, FLAG_PRESSED if pressed else 0, key, self.device, stamp)
+            head += 1
+        self.publish(head)
+
+    def pack(self, index, flags, key, device, stamp):
+        RECORD.pack_into(self.map, self.slot(index), PROTOCOL_VERSION, flags, key, device, stamp)
+
+    def publish(self, head):
+        '''
+        Hand every record packed up to head over to the reader.
+        '''
+        self.header[HEAD] = head
+        self.head = head
+        if self.header[WAITING]:
+            self.header[WAITING] = 0
+            self.ring()
+
+    def ring(self):
+        if self.bell is None:
+            try:
+                self.bell = os.open(bell_path(self.name), os.O_WRONLY | os.O_NONBLOCK)
+            except OSError:
+                # palette is not running, it skips these records when
+                # it opens the ring
+                return
+        try:
+            os.write(self.bell, b"\0")
+        except BlockingIOError:
+            # the bell is full of wakeups already
+            pass
+        except BrokenPipeError:
+            os.close(self.bell)
+            self.bell = None
+
+    def close(self):
+        if self.bell is not None:
+            os.close(self.bell)
+            self.bell = None
+        super().close()
+
+class RingReader(ShmRing):
+    '''
+    palette's end of a ring, a source for ControlLoop like KeyReader. The
+    bell is opened nonblocking with a write end of our own kept open, so
+    drivers can come and go.
+
+    A drain hands over at most read_records records, like a read of the
+    pipe, and rings the bell itself if there are more: a burst on one
+    device waits its turn behind the other sources instead of holding up
+    the control loop.
+    '''
+    def __init__(self, name, capacity = RING_CAPACITY, read_records = READ_RECORDS,
+            stale = False):
+        '''
+        stale: bool
+        Also read the records left in the ring from before it was opened.
+        By default they are skipped, keys a driver wrote while palette was
+        not running are not played at startup.
+        '''
+        super().__init__(name, capacity)
+        self.read_records = read_records
+        if not stale:
+            self.header[TAIL] = self.header[HEAD]
+        self.tail = self.header[TAIL]
+        self.bad_records = 0
+        self.fd = os.open(bell_path(name), os.O_RDONLY | os.O_NONBLOCK)
+        self.keepalive = os.open(bell_path(name), os.O_WRONLY | os.O_NONBLOCK)
+        self.header[WAITING] = 1
+
+    def fileno(self):
+        return self.fd
+
+    def dropped(self):
+        return self.header[DROPPED]
+
+    def drain(self, handler):
+        '''
+        handler: function
+        Called as handler(key, pressed, stamp, device) for every record.
+
+        Always returns True, a ring has no end of file.
+        '''
+        try:
+            os.read(self.fd, BELL_READ)
+        except BlockingIOError:
+            pass
+        tail = self.tail
+        budget = self.read_records
+        while True:
+            self.header[WAITING] = 0
+            head = self.header[HEAD]
+            if head - tail > budget:
+                head = tail + budget
+            budget -= head - tail
+            while tail != head:
+                version, flags, key, device, stamp = RECORD.unpack_from(self.map, self.slot(tail))
+                tail += 1
+                if version != PROTOCOL_VERSION:
+                    self.bad_records += 1
+                    continue
+                self.dispatch(handler, flags, key, device, stamp)
+            self.header[TAIL] = tail
+            self.tail = tail
+            if budget == 0:
+                # come back once the other sources had their turn
+                try:
+                    os.write(self.keepalive, b"\0")
+                except BlockingIOError:
+                    pass
+                return True
+            # say we are waiting, then look once more for records written
+            # before the writer could see it
+            self.header[WAITING] = 1
+            if self.header[HEAD] == tail:
+                return True
+
+    def dispatch(self, handler, flags, key, device, stamp):
+        handler(key, bool(flags & FLAG_PRESSED), stamp, device)
+
+    def close(self):
+        os.close(self.fd)
+        os.close(self.keepalive)
+        super().close()
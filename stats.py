@@ -0,0 +1,139 @@
+'''
+Timing of the JACK process callback, for watching DSP load during a set.
+
+CallbackStats is written by Backend on the JACK thread: one sample per
+callback with the period size, the total duration, the duration of every
+entity and the number of MIDI events written, stored into a preallocated
+ring of ints. Nothing on that side builds a container or takes a lock, a
+reader that falls behind by more than the ring just loses the oldest
+samples. xruns come in on JACK's notification thread and are only counted.
+
+StatsReport runs on the control thread: it drains the ring into histograms
+and renders a plain text report, which palette writes to a stats file or
+serves on a Unix socket.
+'''
+import os
+from array import array
+
+# callbacks the ring holds, about 5s at 48kHz and 256 frames
+STATS_CAPACITY = 1024
+
+# fields of a sample before the per-entity durations
+PERIOD = 0
+TOTAL = 1
+EVENTS = 2
+ENTITY_FIELDS = 3
+
+# histogram buckets, in tenths of the deadline, the last one is overruns
+BUCKETS = 11
+
+class CallbackStats:
+    def __init__(self, entities, capacity = STATS_CAPACITY):
+        '''
+        entities: int
+        Number of entities whose durations are recorded.
+        '''
+        size = 1
+        while size < capacity:
+            size <<= 1
+        self.capacity = size
+        self.mask = size - 1
+        self.width = ENTITY_FIELDS + entities
+        self.samples = array("q", bytes(8 * size * self.width))
+        # samples written so far, only the JACK thread moves it
+        self.written = 0
+        self.xruns = 0
+
+    def xrun(self, delay):
+        self.xruns += 1
+
+class StatsReport:
+    def __init__(self, stats, names, samplerate):
+        '''
+        names: list
+        Name of every entity, in the order their durations are recorded.
+        '''
+        self.stats = stats
+        self.names = names
+        self.samplerate = samplerate
+        self.read = 0
+        self.lost = 0
+        self.callbacks = 0
+        self.events = 0
+        self.max_events = 0
+        # histograms of the total duration and of every entity's, as
+        # fractions of the deadline
+        self.histograms = [[0] * BUCKETS for i in range(0, 1 + len(names))]
+        self.period = 0
+
+    def update(self):
+        '''
+        Drain the ring. Call from the control thread often enough to keep
+        up, at least once a second.
+        '''
+        stats = self.stats
+        written = stats.written
+        if written - self.read > stats.capacity:
+            self.lost += written - self.read - stats.capacity
+            self.read = written - stats.capacity
+        samples = stats.samples
+        while self.read < written:
+            start = (self.read & stats.mask) * stats.width
+            self.read += 1
+            self.period = samples[start + PERIOD]
+            deadline = self.period * 1000000000 / self.samplerate
+            self.callbacks += 1
+            events = samples[start + EVENTS]
+            self.events += events
+            self.max_events = max(self.max_events, events)
+            for i in range(0, len(self.histograms)):
+                duration = samples[start + (TOTAL if i == 0 else ENTITY_FIELDS + i - 1)]
+                bucket = min(BUCKETS - 1, int(duration * (BUCKETS - 1) / deadline))
+                self.histograms[i][bucket] += 1
+
+    def recent(self, field):
+        '''
+        The durations of a field over the callbacks still in the ring,
+        sorted.
+        '''
+        stats = self.stats
+        count = min(stats.written, stats.capacity)
+        return sorted(stats.samples[i * stats.width + field] for i in range(0, count))
+
+    def render(self):
+        '''
+        The report, as text. Percentiles cover the callbacks still in the
+        ring, the histograms everything since palette started.
+        '''
+        self.update()
+        deadline = self.period * 1000000 / self.samplerate if self.samplerate else 0
+        lines = ["callbacks {0} period {1} frames deadline {2:.0f}us xruns {3} lost samples {4}"
+                .format(self.callbacks, self.period, deadline, self.stats.xruns, self.lost)]
+        lines.append("midi events per callback avg {0:.1f} max {1}".format(
+            self.events / self.callbacks if self.callbacks else 0, self.max_events))
+        lines.append("{0:<10} {1:>8} {2:>8} {3:>8} {4:>6}  {5}".format(
+            "", "p50 us", "p99 us", "max us", "load", "histogram by tenth of deadline"))
+        names = ["total"] + self.names
+        for i in range(0, len(names)):
+            recent = self.recent(TOTAL if i == 0 else ENTITY_FIELDS + i - 1)
+            if recent:
+                p50 = recent[len(recent) // 2] / 1000
+                p99 = recent[min(len(recent) - 1, int(len(recent) * 0.99))] / 1000
+                worst = recent[-1] / 1000
+            else:
+                p50 = p99 = worst = 0
+            load = 100 * p99 / deadline if deadline else 0
+            lines.append("{0:<10} {1:>8.1f} {2:>8.1f} {3:>8.1f} {4:>5.1f}%  {5}".format(
+                names[i][:10], p50, p99, worst, load,
+                " ".join(str(count) for count in self.histograms[i])))
+        return "\n".join(lines) + "\n"
+
+    def write(self, path):
+        '''
+        Replace the stats file with a fresh report in one go, so a reader
+        never sees half of one.
+        '''
+        partial = path + ".tmp"
+        with open(partial, "w") as f:
+            f.write(self.render())
+        os.replace(partial, path)
@@ -0,0 +1,173 @@
+'''
+Process-per-instrument mode.
+
+Every instrument runs in a child process as a JACK client of its own, named
+palette-<number>, so the instruments run on separate cores and a garbage
+collection or a slow handler in one of them stalls nobody else. palette's
+own client keeps the metronome and with it control of the transport, the
+children only follow the JACK transport like any other client.
+
+Backend talks to a child through an InstrumentProcess, which has the
+methods of an instrument the control thread calls and turns each call into
+a record on a shared memory ring (see shmring.py) the child drains on its
+own control loop. A record carries the command in the flags byte and the
+JACK frame time of a key in the stamp, frame times are the same in every
+client of a server.
+
+Children are started with the spawn method, so none of them inherits
+palette's threads or its JACK connection. They quit when told to or when
+palette goes away.
+'''
+import multiprocessing
+import os
+
+import jack
+
+from control import ControlLoop
+from metronome import Metronome
+from realtime import CollectorControl, YOUNG_INTERVAL
+from shmring import RingWriter, RingReader, RING_POLL, DROPPED, remove
+from instruments.instrument import LooperMode
+
+# commands, stored in the flags byte of a record
+PRESS = 0
+RELEASE = 1
+LOOP = 2
+LOOPER_MODE = 3
+NORMAL_MODE = 4
+ATTACH = 5
+QUIT = 6
+
+# looper modes by the number a LOOPER_MODE record carries
+LOOPER_MODES = list(LooperMode)
+
+CLIENT_PREFIX = "palette-"
+# seconds between checks that palette is still there
+PARENT_CHECK = 1.0
+# seconds a child gets to quit before it is killed
+QUIT_TIMEOUT = 2.0
+
+CONTEXT = multiprocessing.get_context("spawn")
+
+class CommandWriter(RingWriter):
+    def send(self, command, key, device, frame):
+        if self.space() == 0:
+            self.header[DROPPED] += 1
+            return
+        self.pack(self.head, command, key, device, frame)
+        self.publish(self.head + 1)
+
+class CommandReader(RingReader):
+    '''
+    A ring of commands, handed to the handler as (key, command, frame,
+    device) so it passes through ControlLoop like key events. The ring is
+    made new for every child and the parent may send commands before the
+    child is up, so none of them are skipped.
+    '''
+    def __init__(self, name):
+        super().__init__(name, stale = True)
+
+    def dispatch(self, handler, flags, key, device, stamp):
+        handler(key, flags, stamp, device)
+
+class InstrumentProcess:
+    '''
+    Backend's handle on an instrument running in a child process.
+    '''
+    # the instrument runs in its own client, not in Backend's callback
+    process = None
+
+    def __init__(self, constructor, number, realtime = False):
+        self.number = number
+        self.name = "cmd-" + str(os.getpid()) + "-" + str(number)
+        # a ring left behind by a crashed run would replay its commands
+        remove(self.name)
+        self.ring = CommandWriter(self.name)
+        self.late_events = 0
+        self.child = CONTEXT.Process(target = run_instrument,
+                args = (constructor, number, self.name, realtime), daemon = True)
+        self.child.start()
+
+    def key_pressed(self, key, frame, device = 0):
+        self.ring.send(PRESS, key, device, frame)
+
+    def key_released(self, key, frame, device = 0):
+        self.ring.send(RELEASE, key, device, frame)
+
+    def loop(self, loop_number):
+        self.ring.send(LOOP, loop_number, 0, 0)
+
+    def set_looper_mode(self, mode):
+        self.ring.send(LOOPER_MODE, LOOPER_MODES.index(mode), 0, 0)
+
+    def normal_mode(self):
+        self.ring.send(NORMAL_MODE, 0, 0, 0)
+
+    def attach(self, device):
+        self.ring.send(ATTACH, 0, device, 0)
+
+    def overflows(self):
+        '''
+        Commands dropped because the child fell behind.
+        '''
+        return self.ring.header[DROPPED]
+
+    def close(self):
+        self.ring.send(QUIT, 0, 0, 0)
+        self.child.join(QUIT_TIMEOUT)
+        if self.child.is_alive():
+            self.child.kill()
+            self.child.join()
+        self.ring.close()
+        remove(self.name)
+
+def run_instrument(constructor, number, ring, realtime = False):
+    '''
+    Body of a child process: build the instrument in a client of its own
+    and play the commands coming in on the ring until told to quit.
+    '''
+    client = jack.Client(CLIENT_PREFIX + str(number), no_start_server = True)
+    metronome = Metronome(client)
+    port = client.midi_outports.register("out" + str(number))
+    entity = constructor(port, client.samplerate, metronome)
+
+    def process(no_frames):
+        metronome.process(no_frames)
+        entity.process(no_frames)
+
+    control = ControlLoop()
+    reader = CommandReader(ring)
+    parent = os.getppid()
+
+    def play(key, command, frame, device):
+        if command == PRESS:
+            entity.key_pressed(key, frame, device)
+        elif command == RELEASE:
+            entity.key_released(key, frame, device)
+        elif command == LOOP:
+            entity.loop(key)
+        elif command == LOOPER_MODE:
+            entity.set_looper_mode(LOOPER_MODES[key])
+        elif command == NORMAL_MODE:
+            entity.normal_mode()
+        elif command == ATTACH:
+            entity.attach(device)
+        elif command == QUIT:
+            control.stop()
+
+    def check_parent():
+        if os.getppid() != parent:
+            control.stop()
+
+    client.set_process_callback(process)
+    client.activate()
+    control.add_source(reader, play, RING_POLL)
+    control.every(PARENT_CHECK, check_parent)
+    if realtime:
+        collector = CollectorControl(metronome)
+        control.every(YOUNG_INTERVAL, collector.collect)
+        collector.start()
+    control.run()
+    client.deactivate()
+    client.close()
+    reader.close()